@@ -0,0 +1,332 @@
+# This Python file uses the following encoding: utf-8
+# Benchmark.py throughput of the data treatment of the ATS9360 board
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+    Micro-benchmark of the processors of DataTreatment.
+
+    Every processor is driven through treat_data with synthetic buffers of
+    the board, for several relationships between nb_sequence and
+    records_per_buffer. Each case runs in its own process and reports its
+    rate in MS/s and its peak memory in MB.
+    Results can be saved as a baseline and later compared to it:
+
+        python -m ATS9360.Benchmark --save baseline.json
+        python -m ATS9360.Benchmark --baseline baseline.json --threshold 0.2
+
+    The second command exits with an error if a case is slower, or uses more
+    memory, than its baseline by more than the threshold. A case whose
+    processor raises is reported as failed, with its traceback, and also
+    makes the benchmark exit with an error.
+"""
+
+from __future__ import division
+import sys
+import time
+import json
+import Queue
+import traceback
+import argparse
+import numpy as np
+import multiprocessing as mp
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the memory is not measured
+    resource = None
+
+import DataTreatment as dt
+from DataReplay import LocalQueue
+
+# Board parameters of the benchmark: 1 GS/s and the default record size and
+# records per buffer of ATS9360_NPT
+samplerate         = 1e9
+samplesPerRecord   = 128*80
+records_per_buffer = 250
+acquisition_time   = samplesPerRecord/samplerate
+frequency          = 50e6
+
+# Number of sequences for each relationship with records_per_buffer
+shapes = {'equal' : records_per_buffer,
+          'many'  : records_per_buffer//5,
+          'less'  : records_per_buffer*4}
+
+# Processors and the arguments used to instance them
+processors = (
+    ('Raw', ()),
+    ('AverageTest', ()),
+    ('Average', ()),
+    ('Average_time', ()),
+    ('AmplitudePhase', (acquisition_time, samplerate, frequency)),
+    ('DBPhase', (acquisition_time, samplerate, frequency, -20.)),
+    ('RealImag', (acquisition_time, samplerate, frequency)),
+    ('AmplitudePhasePerSequence', (acquisition_time, samplerate, frequency, None)),
+    ('AmplitudePhasePerSequencedB', (acquisition_time, samplerate, frequency, -20.)),
+    ('RealImagPerSequence', (acquisition_time, samplerate, frequency)),
+    ('RealImag_raw', (acquisition_time, samplerate, frequency)),
+    ('Average_IQ', (acquisition_time, samplerate, frequency, 10e6)),
+    ('SeveralRealImagPerSequence', (acquisition_time, samplerate, frequency, 2,
+                                    (0., acquisition_time/2.),
+                                    (acquisition_time/2., acquisition_time))),
+    ('RealImagPerSequence_reset', (acquisition_time, samplerate, frequency)),
+    ('HomodyneRealImagPerSequence', (2e-6, samplerate, 1e-6)),
+    ('HomodyneRealImag_raw', (2e-6, samplerate, 1e-6)),
+    ('HomodyneRealImag_raw_sevRO', (2e-6, 0.5e-6, 2e-6, 5e-6, samplerate, 1e-6)),
+    ('HomodyneRealImag_Nraw', (2e-6, samplerate, 1e-6, 2)),
+    ('Homodyne_Tchebytchev', (acquisition_time, samplerate, 10e6, 40., 4, True)),
+    ('HomodyneRealImagPerSequenceWeighted', (acquisition_time, 2e-6, samplerate, 1e-6, 100e-9)),
+    ('HomodyneRealImag_rawWeighted', (acquisition_time, 2e-6, samplerate, 1e-6, 100e-9)),
+    ('HomodyneRealImag_raw_sevROWeighted', (acquisition_time, 2e-6, 0.5e-6, 2e-6, 5e-6, samplerate, 1e-6, 100e-9)),
+    ('HomodyneRealImag_raw_sevROBestWeighted', (acquisition_time, 2e-6, 0.5e-6, 2e-6, 5e-6, samplerate, np.ones(1000))),
+    )
+
+
+
+def synthetic_buffer(nb_sequence):
+    """
+        Return a raw buffer of the board: a noisy oscillation at frequency
+        whose amplitude depends on the sequence, coded on the 12 upper bits
+        of uint16.
+        The buffer is built record per record so that its temporary arrays
+        don't hide the peak memory of the treatment.
+    """
+
+    random = np.random.RandomState(0)
+    oscillation = np.cos(2.*np.pi*frequency*np.arange(samplesPerRecord)/samplerate)
+
+    buffer = np.empty((records_per_buffer, samplesPerRecord), dtype=np.uint16)
+    for record in range(records_per_buffer):
+
+        amplitude = 500. + 1000.*(record % nb_sequence)/nb_sequence
+        codes = 2047.5 + amplitude*oscillation\
+                + random.normal(0., 20., samplesPerRecord)
+        buffer[record] = np.clip(np.round(codes), 0, 4095).astype(np.uint16) << 4
+
+    return buffer.ravel()
+
+
+
+def run_case(name, args, nb_sequence, nb_buffers, precision, queue):
+    """
+        Treat nb_buffers synthetic buffers with the processor name and put
+        (rate in MS/s, peak memory in MB, None) in queue, or
+        (None, None, traceback) if the case failed.
+    """
+
+    try:
+        queue.put(measure_case(name, args, nb_sequence, nb_buffers, precision) + (None,))
+    except Exception:
+        queue.put((None, None, traceback.format_exc()))
+
+
+
+def measure_case(name, args, nb_sequence, nb_buffers, precision):
+    """
+        Body of run_case, return (rate in MS/s, peak memory in MB).
+    """
+
+    dt.set_precision(precision)
+
+    # When a sequence spans several buffers, only complete sequences are
+    # treated
+    buffers_per_sequence = -(-nb_sequence//records_per_buffer)
+    nb_buffers = -(-nb_buffers//buffers_per_sequence)*buffers_per_sequence
+
+    buffer = synthetic_buffer(nb_sequence)
+
+    if resource is not None:
+        memory_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # AmplitudePhasePerSequence needs the number of sequences
+    args = tuple(nb_sequence if arg is None else arg for arg in args)
+    processor = getattr(dt, name)(*args)
+
+    parameters = {'samplesPerRecord'   : samplesPerRecord,
+                  'records_per_buffer' : records_per_buffer,
+                  'nb_sequence'        : nb_sequence,
+                  'measured_buffers'   : nb_buffers,
+                  'safe_treatment'     : [False, False],
+                  'message'            : ''}
+
+    # The same buffer is put several times, it is never modified
+    queue_data      = LocalQueue()
+    queue_treatment = LocalQueue()
+    for i in range(nb_buffers):
+        queue_data.put(buffer)
+
+    start = time.time()
+    processor.treat_data(queue_data, queue_treatment, parameters)
+    elapsed = time.time() - start
+
+    # ru_maxrss is in kB on Linux
+    memory = None
+    if resource is not None:
+        memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory_start)/1024.
+
+    return samplesPerRecord*records_per_buffer*nb_buffers/elapsed/1e6, memory
+
+
+
+def run(nb_buffers=20, precision='float64', names=None):
+    """
+        Run the benchmark of all the processors on all the shapes.
+
+        Input:
+            - nb_buffers (int): number of buffers treated per case.
+            - precision (str): precision of the treatment, see
+              DataTreatment.set_precision
+            - names (list): processors to benchmark, all by default.
+
+        Output:
+            - results (dict): {case : {'rate' : MS/s, 'memory' : MB}} with
+              case "processor/shape". A failed case has a None rate and
+              memory and the error in 'error'.
+    """
+
+    results = {}
+    for name, args in processors:
+
+        if names and name not in names:
+            continue
+
+        for shape, nb_sequence in sorted(shapes.items()):
+
+            # Each case in its own process to measure its peak memory
+            queue  = mp.Queue()
+            worker = mp.Process(target = run_case,
+                                args   = (name, args, nb_sequence, nb_buffers,
+                                          precision, queue))
+            worker.start()
+
+            # A worker dying without a result, killed or crashed, must not
+            # block the benchmark
+            while True:
+                try:
+                    rate, memory, error = queue.get(timeout=1.)
+                    break
+                except Queue.Empty:
+                    if not worker.is_alive():
+                        rate, memory = None, None
+                        error = 'worker exited with code %s' % worker.exitcode
+                        break
+            worker.join()
+
+            results[name+'/'+shape] = {'rate' : rate, 'memory' : memory}
+            if error is not None:
+                results[name+'/'+shape]['error'] = error
+
+    return results
+
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+        Compare results to a baseline.
+
+        Input:
+            - results (dict): as returned by run.
+            - baseline (dict): as returned by run.
+            - threshold (float): relative loss of rate, or increase of memory,
+              tolerated.
+
+        Output:
+            - regressions (list): description of the cases out of the
+              threshold.
+    """
+
+    regressions = []
+    for case, result in sorted(results.items()):
+
+        if case not in baseline:
+            continue
+        reference = baseline[case]
+
+        if result['rate'] is None:
+            if reference['rate'] is not None:
+                regressions.append('%s: failed' % case)
+            continue
+        if reference['rate'] is None:
+            continue
+
+        if result['rate'] < reference['rate']*(1. - threshold):
+            regressions.append('%s: %f MS per sec instead of %f' %\
+                               (case, result['rate'], reference['rate']))
+
+        # A few MB are always allowed, small cases are too noisy
+        if result['memory'] is not None and reference['memory'] is not None\
+           and result['memory'] > reference['memory']*(1. + threshold) + 1.:
+            regressions.append('%s: %f Mbytes instead of %f' %\
+                               (case, result['memory'], reference['memory']))
+
+    return regressions
+
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmark of the DataTreatment processors.')
+    parser.add_argument('--buffers', type=int, default=20,
+                        help='number of buffers treated per case')
+    parser.add_argument('--precision', default='float64',
+                        choices=dt.allow_precisions)
+    parser.add_argument('--processor', action='append',
+                        help='processor to benchmark, all by default')
+    parser.add_argument('--baseline',
+                        help='json file of the results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative regression tolerated')
+    parser.add_argument('--save',
+                        help='json file in which the results are saved')
+    options = parser.parse_args(argv)
+
+    results = run(options.buffers, options.precision, options.processor)
+
+    failures = []
+    for case, result in sorted(results.items()):
+        if result['rate'] is None:
+            print '%-50s %10s' % (case, 'failed')
+            failures.append(case)
+            continue
+        print '%-50s %10.2f MS/s %10s MB' % (case, result['rate'],
+              'n/a' if result['memory'] is None else '%.1f' % result['memory'])
+
+    if failures:
+        print 'Failures:'
+        for case in failures:
+            print case
+            print results[case]['error']
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare(results, json.load(f), options.threshold)
+
+        if regressions:
+            print 'Regressions:'
+            for regression in regressions:
+                print regression
+            return 1
+
+    return 1 if failures else 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
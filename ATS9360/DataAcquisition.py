@@ -20,11 +20,23 @@ from __future__ import division
 import ctypes
 import numpy as np
 import time
-import atsapi as ats
+import threading
+import Queue
+import SimulatedBoard
+from DataReplay import DataCapture, put_buffer, close_queue
+
+# atsapi loads the library of the Alazar SDK when it is imported. Without
+# it only the simulated boards are available, SimulatedBoard providing the
+# constants of atsapi they use.
+try:
+    import atsapi as ats
+    hardware = True
+except (ImportError, OSError):
+    ats = SimulatedBoard
+    hardware = False
 
 windowType = ats.DSP_WINDOW_HAMMING
 
-
 class DataAcquisition(object):
     """
         Class handling the acquisition of data from the ATS board.
@@ -33,6 +45,31 @@ class DataAcquisition(object):
 
 
 
+    def __init__(self, simulated=False):
+        """
+            Input:
+                - simulated (bool): If True, the boards are simulated, see
+                  SimulatedBoard.
+        """
+
+        self.simulated = simulated
+
+
+
+    def backend(self):
+        """
+            Return the module providing the Board and DMABuffer classes.
+        """
+
+        if self.simulated:
+            return SimulatedBoard
+        elif not hardware:
+            raise ImportError('The Alazar SDK (libATSApi) is not available, only the simulated boards can be used')
+        else:
+            return ats
+
+
+
     def set_clock(self, board, parameters):
         '''Set the clock of the board.
             The method uses all clock attribut to set the clock.
@@ -278,7 +315,7 @@ class DataAcquisition(object):
 
         buffers = []
         for i in range(bufferCount):
-            buffers.append(ats.DMABuffer(sample_type, bytesPerBuffer))
+            buffers.append(self.backend().DMABuffer(sample_type, bytesPerBuffer))
 
 
         board.setRecordSize(preTriggerSamples, postTriggerSamples)
@@ -341,6 +378,13 @@ class DataAcquisition(object):
         postTriggerSamples    = parameters['samplesPerRecord']
         samplesPerRecord      = preTriggerSamples + postTriggerSamples
 
+        # In capture mode, the raw DMA buffers are also saved on the disk,
+        # see DataReplay
+        capture = None
+        if parameters['capture_file']:
+            capture = DataCapture(parameters['capture_file'], parameters,
+                                  buffers[0].buffer)
+
         start = time.clock() # Keep track of when acquisition started
         board.startCapture() # Start the acquisition
 
@@ -350,29 +394,30 @@ class DataAcquisition(object):
 
         # We measure up to have empty all the buffers set by the user or
         # if the user stop the measurement
-        while buffersCompleted < buffersPerAcquisition and parameters['measuring']:
+        try:
+            while buffersCompleted < buffersPerAcquisition and parameters['measuring']:
 
-            buff = buffers[buffersCompleted % len(buffers)]
-            if parameters['mode'] == 'FFT':
-                board.dspGetBuffer(buff.addr, timeout_ms=5000)
-            else:
-                board.waitAsyncBufferComplete(buff.addr, timeout_ms=5000)
+                buff = buffers[buffersCompleted % len(buffers)]
+                if parameters['mode'] == 'FFT':
+                    board.dspGetBuffer(buff.addr, timeout_ms=5000)
+                else:
+                    board.waitAsyncBufferComplete(buff.addr, timeout_ms=5000)
 
-            buffersCompleted += 1
-            bytesTransferred += buff.size_bytes
+                if capture is not None:
+                    capture.save(buffersCompleted, buff.buffer)
 
-            if parameters['mode'] == 'FFT':
-                queue_data.put(np.copy(buff.buffer))
-            elif parameters['mode'] == 'CHANNEL_AB':
-                queue_data[0].put(np.copy(buff.buffer[0::2]))
-                queue_data[1].put(np.copy(buff.buffer[1::2]))
-            elif parameters['mode'] == 'CHANNEL_A':
-                queue_data.put(np.copy(buff.buffer))
-            elif parameters['mode'] == 'CHANNEL_B':
-                queue_data.put(np.copy(buff.buffer))
+                buffersCompleted += 1
+                bytesTransferred += buff.size_bytes
 
-            # Add the buffer to the end of the list of available buffers.
-            board.postAsyncBuffer(buff.addr, buff.size_bytes)
+                put_buffer(queue_data, buff.buffer, parameters)
+
+                # Add the buffer to the end of the list of available buffers.
+                board.postAsyncBuffer(buff.addr, buff.size_bytes)
+        finally:
+            # Even after an error, the capture only holds the buffers
+            # actually acquired
+            if capture is not None:
+                capture.close(buffersCompleted)
 
         # Compute the total transfer time, and display performance information.
         transferTime_sec = time.clock() - start
@@ -398,6 +443,123 @@ class DataAcquisition(object):
 
 
 
+    def board_acquisition(self, board, index, buffers, queue_merge, parameters,
+                          stop):
+        """
+            DMA loop of one board of a multi-board system.
+            Each filled buffer is put in queue_merge as
+            (board index, buffer index, data).
+            In case of error, the exception is put instead of the data.
+        """
+
+        buffersPerAcquisition = parameters['buffers_per_acquisition']
+        buffersCompleted = 0
+
+        try:
+            while buffersCompleted < buffersPerAcquisition and not stop.is_set():
+
+                buff = buffers[buffersCompleted % len(buffers)]
+                board.waitAsyncBufferComplete(buff.addr, timeout_ms=5000)
+
+                queue_merge.put((index, buffersCompleted, np.copy(buff.buffer)))
+                buffersCompleted += 1
+
+                # Add the buffer to the end of the list of available buffers.
+                board.postAsyncBuffer(buff.addr, buff.size_bytes)
+        except Exception as e:
+            if not stop.is_set():
+                queue_merge.put((index, buffersCompleted, e))
+
+
+
+    def data_acquisition_boards(self, boards, queue_data, parameters, buffers):
+        """
+            Acquire data with several synchronized boards.
+            Each board has its own DMA loop, the buffers of the boards with
+            the same index are merged record by record in a single buffer put
+            in the FIFO queue_data buffer memory, as for one board: the record
+            i of the board b becomes the record i*nb_boards + b.
+            parameters['records_per_buffer'] counts the records of all the
+            boards.
+
+            Output buffersCompleted (int): Number of emptied buffer per board.
+        """
+
+        buffersPerAcquisition = parameters['buffers_per_acquisition']
+        recordsPerBuffer      = parameters['records_per_buffer']//len(boards)
+        samplesPerRecord      = parameters['samplesPerRecord']
+
+        queue_merge = Queue.Queue()
+        stop = threading.Event()
+        loops = [threading.Thread(target = self.board_acquisition,
+                                  args   = (board, index, buffers[index],
+                                            queue_merge, parameters, stop))
+                 for index, board in enumerate(boards)]
+
+        for loop in loops:
+            loop.start()
+
+        start = time.clock() # Keep track of when acquisition started
+
+        # The master board starts the acquisition of the whole system
+        boards[0].startCapture()
+
+        message = 'Attempt to capture %d buffers on %d boards\n' % (buffersPerAcquisition, len(boards))
+        buffersCompleted = 0
+        bytesTransferred = 0
+
+        # Buffers waiting for the ones of the other boards, by buffer index
+        pending = {}
+
+        try:
+            while buffersCompleted < buffersPerAcquisition and parameters['measuring']:
+
+                try:
+                    index, buffer_index, data = queue_merge.get(timeout=1.)
+                except Queue.Empty:
+                    continue
+
+                if isinstance(data, Exception):
+                    raise data
+
+                pending.setdefault(buffer_index, {})[index] = data
+
+                # We send the buffers as soon as all the boards have filled
+                # them, the records of the boards are put side by side
+                while len(pending.get(buffersCompleted, ())) == len(boards):
+
+                    datas = pending.pop(buffersCompleted)
+                    data  = np.hstack([datas[index].reshape(recordsPerBuffer, -1)
+                                       for index in range(len(boards))])
+                    put_buffer(queue_data, data.ravel(), parameters)
+                    bytesTransferred += data.nbytes
+
+                    buffersCompleted += 1
+        finally:
+            # We stop the transfer, which also releases the DMA loops
+            # waiting for a buffer.
+            stop.set()
+            for board in boards:
+                board.abortAsyncRead()
+            for loop in loops:
+                loop.join()
+
+        # Compute the total transfer time, and display performance information.
+        transferTime_sec = time.clock() - start
+        message += 'Capture completed in %f sec\n' % transferTime_sec
+        samplesTransferred = bytesTransferred//2
+        if transferTime_sec > 0:
+            message += 'Captured %d buffers per board (%f buffers per sec)\n' % (buffersCompleted, buffersCompleted/transferTime_sec)
+            message += 'Captured %d records per board (%f records per sec)\n' % (recordsPerBuffer*buffersCompleted, recordsPerBuffer*buffersCompleted/transferTime_sec)
+            message += 'Transferred %d bytes (%f Mbytes per sec)\n' % (bytesTransferred, bytesTransferred/transferTime_sec/1024**2.)
+            message += 'Transferred %d samples (%f MS per sec)\n' % (samplesTransferred, samplesTransferred/transferTime_sec/1e6)
+
+        parameters['message'] = message
+
+        return buffersCompleted
+
+
+
     def get_data(self, queue_data, parameters):
         """
             Method allowing the transfert of data from the board to the computer.
@@ -413,9 +575,12 @@ class DataAcquisition(object):
                               from multiprocess library
         """
 
+        if parameters['nb_boards'] > 1:
+            return self.get_data_boards(queue_data, parameters)
+
         # We instance a board object
         # All the parameters of the measurement will be set on this instance
-        board = ats.Board(systemId = 1, boardId = 1)
+        board = self.backend().Board(systemId = 1, boardId = 1)
 
         # We set the clock
         self.set_clock(board, parameters)
@@ -447,12 +612,55 @@ class DataAcquisition(object):
         parameters['safe_acquisition'] = True
 
         # Once the board is "close" properly, we close the FIFO memory
-        if parameters['mode'] == 'FFT' :
-            queue_data.close()
-        if parameters['mode'] == 'CHANNEL_AB' :
-            queue_data[0].close()
-            queue_data[1].close()
-        if parameters['mode'] == 'CHANNEL_A' :
-            queue_data.close()
-        if parameters['mode'] == 'CHANNEL_B' :
-            queue_data.close()
+        close_queue(queue_data, parameters)
+
+
+
+    def get_data_boards(self, queue_data, parameters):
+        """
+            Same as get_data for the parameters['nb_boards'] first boards of
+            a master/slave system. The board 1 is the master: it provides the
+            clock and the trigger to the others and starts the acquisition.
+            The records of the boards are interleaved in a single stream,
+            see data_acquisition_boards, and each board acquires
+            parameters['records_per_buffer']/nb_boards records per buffer.
+
+            Input:
+                - queue_data: FIFO memory buffer instance from the
+                              multiprocess library, as for get_data.
+                - parameters: Dictionnary with all board parameters instance
+                              from multiprocess library
+        """
+
+        if parameters['mode'] == 'FFT':
+            raise ValueError('The FFT mode is not available with several boards')
+
+        boards = [self.backend().Board(systemId = 1, boardId = i + 1)
+                  for i in range(parameters['nb_boards'])]
+
+        # All boards are configured the same way, the slaves follow the
+        # clock and the trigger of the master
+        board_parameters = dict(parameters.items())
+        board_parameters['records_per_buffer'] //= len(boards)
+        buffers = []
+        for board in boards:
+
+            self.set_clock(board, board_parameters)
+            self.set_input_control(board)
+            self.set_trigger(board, board_parameters)
+            buffers.append(self.prepare_acquisition(board, board_parameters))
+
+        # We wait a little to let the time to the boards to initialize themselves
+        time.sleep(0.5)
+
+        # We launch the data acquisition, the transfer is stopped at its end
+        parameters['measured_buffers'] = self.data_acquisition_boards(boards,
+                                                                      queue_data,
+                                                                      parameters,
+                                                                      buffers)
+
+        # We inform the parent process that the boards are properly "closed"
+        parameters['safe_acquisition'] = True
+
+        # Once the boards are "close" properly, we close the FIFO memory
+        close_queue(queue_data, parameters)
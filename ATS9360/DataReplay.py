@@ -0,0 +1,360 @@
+# This Python file uses the following encoding: utf-8
+# DataReplay.py capture and replay of the buffers of the ATS9360 board
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from __future__ import division
+import numpy as np
+import time
+import pickle
+import logging
+import threading
+import Queue
+
+# Parameters coming from the capture which overwrite the current ones when a
+# capture is replayed: they fix the shape of the recorded buffers.
+replayed_parameters = ('samplerate',
+                       'samplesPerRecord',
+                       'records_per_buffer',
+                       'buffers_per_acquisition',
+                       'nb_sequence')
+
+# Parameters which are not saved with a capture since they only describe the
+# communication between the processes.
+communication_parameters = ('measuring',
+                            'safe_acquisition',
+                            'safe_treatment',
+                            'measured_buffers',
+                            'message',
+                            'capture_file')
+
+
+
+def capture_filenames(filename):
+    """
+        Return the names of the files of a capture:
+        (raw buffers, parameters snapshot)
+    """
+
+    return filename+'.npy', filename+'_parameters.pkl'
+
+
+
+class DataCapture(object):
+    """
+        Save the raw DMA buffers of an acquisition in a memory-mapped file.
+        Used by DataAcquisition when the "capture_file" parameter is set.
+    """
+
+
+
+    def __init__(self, filename, parameters, buffer):
+        """
+            Input:
+                - filename (str): name of the capture without extension.
+                - parameters: Dictionnary with all board parameters, a
+                  snapshot is saved with the capture.
+                - buffer (np.array): one of the DMA buffers, gives the shape
+                  and type of the data.
+        """
+
+        self.filename = filename
+
+        self.parameters = dict((key, value) for key, value in parameters.items()
+                               if key not in communication_parameters)
+
+        self.buffers = np.lib.format.open_memmap(capture_filenames(filename)[0],
+                                                 mode  = 'w+',
+                                                 dtype = buffer.dtype,
+                                                 shape = (parameters['buffers_per_acquisition'],
+                                                          buffer.size))
+
+        self.timestamps = np.zeros(parameters['buffers_per_acquisition'])
+        self.start_time = None
+
+
+
+    def save(self, index, buffer):
+        """
+            Save the buffer at the given index of the acquisition.
+        """
+
+        # Timestamps are taken from the first buffer
+        if self.start_time is None:
+            self.start_time = time.time()
+
+        self.buffers[index] = buffer
+        self.timestamps[index] = time.time() - self.start_time
+
+
+
+    def close(self, measured_buffers):
+        """
+            Flush the buffers on the disk and save the parameters snapshot.
+
+            Input:
+                - measured_buffers (int): number of buffers acquired.
+        """
+
+        self.buffers.flush()
+        del self.buffers
+
+        info = {'parameters'       : self.parameters,
+                'timestamps'       : self.timestamps[:measured_buffers],
+                'measured_buffers' : measured_buffers}
+
+        with open(capture_filenames(self.filename)[1], 'wb') as f:
+            pickle.dump(info, f, 2)
+
+
+
+# The two following functions are shared by DataAcquisition and DataReplay
+
+def put_buffer(queue_data, buffer, parameters):
+    """
+        Put a copy of a buffer in the FIFO queue_data buffer memory.
+        In "CHANNEL_AB" mode, the samples of both channels are interleaved
+        and sent in their own queue.
+    """
+
+    if parameters['mode'] == 'FFT':
+        queue_data.put(np.copy(buffer))
+    elif parameters['mode'] == 'CHANNEL_AB':
+        queue_data[0].put(np.copy(buffer[0::2]))
+        queue_data[1].put(np.copy(buffer[1::2]))
+    elif parameters['mode'] == 'CHANNEL_A':
+        queue_data.put(np.copy(buffer))
+    elif parameters['mode'] == 'CHANNEL_B':
+        queue_data.put(np.copy(buffer))
+
+
+
+def close_queue(queue_data, parameters):
+    """
+        Close the FIFO memory once all the buffers have been sent.
+    """
+
+    if parameters['mode'] == 'FFT' :
+        queue_data.close()
+    if parameters['mode'] == 'CHANNEL_AB' :
+        queue_data[0].close()
+        queue_data[1].close()
+    if parameters['mode'] == 'CHANNEL_A' :
+        queue_data.close()
+    if parameters['mode'] == 'CHANNEL_B' :
+        queue_data.close()
+
+
+
+def load_capture(filename):
+    """
+        Open a capture made by the board.
+
+        Input:
+            - filename (str): name of the capture without extension.
+
+        Output:
+            - buffers (np.memmap): raw DMA buffers with the shape
+              (measured_buffers, samples per buffer), read from the disk on
+              demand.
+            - info (dict): with the keys 'parameters' (snapshot of the board
+              parameters), 'timestamps' (in second from the first buffer)
+              and 'measured_buffers'.
+    """
+
+    buffers_file, info_file = capture_filenames(filename)
+
+    with open(info_file, 'rb') as f:
+        info = pickle.load(f)
+
+    buffers = np.load(buffers_file, mmap_mode='r')
+
+    return buffers[:info['measured_buffers']], info
+
+
+
+class DataReplay(object):
+    """
+        Replace the board by a capture previously made with it.
+        The get_data method has the same behaviour than the one of
+        DataAcquisition so that the data treatment can't see the difference.
+        This module doesn't need the library of the board so that captures
+        can be replayed on any computer.
+    """
+
+
+
+    def __init__(self, filename, pacing=False):
+        """
+            Input:
+                - filename (str): name of the capture without extension.
+                - pacing (bool): If True, buffers are sent with the timing of
+                  the capture. Otherwise, they are sent as fast as possible.
+        """
+
+        self.filename = filename
+        self.pacing   = pacing
+
+
+
+    def data_replay(self, buffers, info, queue_data, parameters):
+        """
+            Send the recorded buffers in the FIFO queue_data buffer memory.
+
+            Output buffersCompleted (int): Number of sent buffer.
+        """
+
+        timestamps = info['timestamps']
+
+        start = time.time()
+
+        message = 'Attempt to replay %d buffers\n' % len(buffers)
+        buffersCompleted = 0
+        bytesTransferred = 0
+
+        while buffersCompleted < len(buffers) and parameters['measuring']:
+
+            if self.pacing:
+                time.sleep(max(0., start + timestamps[buffersCompleted] - time.time()))
+
+            buff = buffers[buffersCompleted]
+            put_buffer(queue_data, buff, parameters)
+
+            buffersCompleted += 1
+            bytesTransferred += buff.nbytes
+
+        transferTime_sec = time.time() - start
+        message += 'Replay completed in %f sec\n' % transferTime_sec
+        if transferTime_sec > 0:
+            message += 'Replayed %d buffers (%f buffers per sec)\n' % (buffersCompleted, buffersCompleted/transferTime_sec)
+            message += 'Transferred %d bytes (%f Mbytes per sec)\n' % (bytesTransferred, bytesTransferred/transferTime_sec/1024**2.)
+
+        parameters['message'] = message
+
+        return buffersCompleted
+
+
+
+    def get_data(self, queue_data, parameters):
+        """
+            Method replaying a capture instead of acquiring with the board.
+            The shape of the buffers is taken from the capture.
+
+            Input:
+                - queue_data: FIFO memory buffer instance from the
+                              multiprocess library.
+                - parameters: Dictionnary with all board parameters instance
+                              from multiprocess library
+        """
+
+        buffers, info = load_capture(self.filename)
+
+        # The mode fixes the number of treatment processes, it can't be
+        # changed at this point.
+        if parameters['mode'] != info['parameters']['mode']:
+            raise ValueError('The capture has been made in the mode '\
+                             +info['parameters']['mode']+'.')
+
+        for key in replayed_parameters:
+            if parameters[key] != info['parameters'][key]:
+                logging.warning(__name__+' : '+key+' of the capture ('\
+                                +str(info['parameters'][key])+') is used instead of '\
+                                +str(parameters[key]))
+
+            parameters[key] = info['parameters'][key]
+
+        parameters['measured_buffers'] = self.data_replay(buffers, info,
+                                                          queue_data,
+                                                          parameters)
+
+        # We inform the parent process that the "board" is properly "closed"
+        parameters['safe_acquisition'] = True
+
+        close_queue(queue_data, parameters)
+
+
+
+class LocalQueue(Queue.Queue):
+    """
+        Queue used to run a data treatment inside the current process.
+        It behaves as the queue of the multiprocess library for treat_data.
+    """
+
+    def close(self):
+
+        pass
+
+
+
+def replay(processor, filename, pacing=False, channel=0):
+    """
+        Treat a capture with a processor in the current process, without the
+        board.
+        Useful to benchmark a processor on real data or to compare two
+        processors bit-for-bit.
+
+        Input:
+            - processor (obj instance): Instance of class coming from the
+              file DataTreatment with the class DataTreatment as parent.
+            - filename (str): name of the capture without extension.
+            - pacing (bool): If True, buffers are sent with the timing of the
+              capture. Otherwise, they are sent as fast as possible.
+            - channel (int): In "CHANNEL_AB" mode, the channel to treat,
+              0 for A and 1 for B.
+
+        Output:
+            - results (list): all the results put by the processor in its
+              treatment queue.
+            - message (str): transfer and treatment information.
+    """
+
+    buffers, info = load_capture(filename)
+
+    parameters = dict(info['parameters'])
+    parameters['measuring']        = True
+    parameters['safe_acquisition'] = False
+    parameters['safe_treatment']   = [False, False]
+    parameters['measured_buffers'] = info['measured_buffers']
+    parameters['message']          = ''
+
+    # A bounded queue to avoid loading the whole capture in memory
+    queue_data      = LocalQueue(maxsize=parameters['nb_buffer_allocated'])
+    queue_treatment = LocalQueue()
+
+    def feed():
+
+        start = time.time()
+        for i in range(len(buffers)):
+
+            if pacing:
+                time.sleep(max(0., start + info['timestamps'][i] - time.time()))
+
+            if parameters['mode'] == 'CHANNEL_AB':
+                queue_data.put(buffers[i][channel::2])
+            else:
+                queue_data.put(buffers[i])
+
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+
+    processor.treat_data(queue_data, queue_treatment, parameters)
+    feeder.join()
+
+    results = []
+    while not queue_treatment.empty():
+        results.append(queue_treatment.get())
+
+    return results, parameters['message']
@@ -18,20 +18,114 @@
 
 import numpy as np
 import time
+import Queue
 import multiprocessing as mp
 import scipy.signal as scisig
 
+
+
+# Precisions allowed for the data treatment.
+# In "float32" the conversion of the codes, the sin and cos references and the
+# intermediate arrays are in single precision, which halves the memory
+# bandwidth of the treatment. The averaged results are always kept in float64.
+allow_precisions = ('float64', 'float32')
+
+# The board returns 12-bit codes, we tabulate once for all the conversion of
+# the 4096 possible codes in V.
+# AlazarTech digitizers are calibrated as follows
+# codeZero  = (1 << (bits_per_sample - 1)) - 0.5
+# codeRange = (1 << (bits_per_sample - 1)) - 0.5
+# Following this a proportionality of 2047.5 is applied
+# The calcul is inputRange_volts*(data - codeZero) / codeRange
+_codes = np.arange(4096)
+code_to_volt = {'float64' : 0.4*(_codes - 2047.5)/2047.5,
+                'float32' : (0.4*(_codes - 2047.5)/2047.5).astype(np.float32)}
+
+
+
+def set_precision(precision):
+    """
+        Set the precision used by all the data treatment classes.
+        Only the processors instanced afterwards are affected.
+
+        Input:
+            - precision (str): "float64" or "float32"
+    """
+
+    if precision not in allow_precisions:
+        raise ValueError('The precision must be "float64" or "float32"')
+
+    DataTreatment.precision = precision
+
+
+
+def get_precision():
+    """
+        Get the precision used by the data treatment classes.
+
+        Output:
+            - precision (str): "float64" or "float32"
+    """
+
+    return DataTreatment.precision
+
+
+
 class DataTreatment(object):
     """
         Canvas for data treatment class.
         Should only be used as parent class
     """
 
+    # Precision of the treatment, see set_precision
+    precision = 'float64'
 
-    @staticmethod
-    def data_in_volt(data):
+
+
+    def __new__(cls, *args, **kwargs):
+        """
+            The precision is frozen on the instance at its creation so that
+            the treatment process, which receives a pickled copy of the
+            processor, uses the same one whatever the state of its module.
+        """
+
+        self = super(DataTreatment, cls).__new__(cls)
+        self.precision = cls.precision
+
+        return self
+
+
+
+    @property
+    def dtype(self):
+        """
+            Numpy dtype of the treatment.
+        """
+
+        return np.dtype(self.precision)
+
+
+
+    def references(self, frequency, time):
+        """
+            Return the cos and sin references at the given frequency in the
+            precision of the treatment.
+
+            Input:
+                - frequency (float): in hertz
+                - time (np.array): in second
+        """
+
+        phase = 2.*np.pi*frequency*time
+
+        return np.cos(phase).astype(self.dtype), np.sin(phase).astype(self.dtype)
+
+
+
+    def data_in_volt(self, data):
         """
             Get raw data coming from the board and transform them in V.
+            The result is in the precision of the treatment.
         """
 
         # Parameters of the board (are fixed).
@@ -40,15 +134,8 @@ class DataTreatment(object):
         # inputRange_volts = 400e-3 # Fixed for the ats9360
 
         # Right-shift 16-bit sample value by 4 to get 12-bit sample code
-        data = data >> 4
-
-        # AlazarTech digitizers are calibrated as follows
-        # codeZero  = (1 << (bits_per_sample - 1)) - 0.5
-        # codeRange = (1 << (bits_per_sample - 1)) - 0.5
-        # Following this a proportionality of 2047.5 is applied
-        # The calcul is inputRange_volts*(data - codeZero) / codeRange
-
-        return 0.4*(data - 2047.5)/2047.5
+        # and look up its value in V, see code_to_volt
+        return np.take(code_to_volt[self.precision], data >> 4)
 
 
 
@@ -73,6 +160,9 @@ class DataTreatment(object):
     def mean_averaging(self, current_average, new_data):
         # print self.treated_sequance
 
+        # The averaging is always done in float64 whatever the precision
+        new_data = np.asarray(new_data, dtype=np.float64)
+
         return (self.treated_sequance*current_average + new_data)\
               /(self.treated_sequance + 1.)
 
@@ -89,6 +179,9 @@ class DataTreatment(object):
 
     def std_averaging(self, current_std, new_std):
 
+        # The averaging is always done in float64 whatever the precision
+        new_std = np.asarray(new_std, dtype=np.float64)
+
         return np.sqrt((self.treated_sequance*current_std**2. + new_std**2.)\
                       /(self.treated_sequance + 1.))
 
@@ -379,8 +472,7 @@ class AmplitudePhase(DataTreatment):
         # We calculate the sin and cos
         time = np.arange(self.nb_points)/samplerate
 
-        self.cos = np.cos(2.*np.pi*frequency*time)
-        self.sin = np.sin(2.*np.pi*frequency*time)
+        self.cos, self.sin = self.references(frequency, time)
 
         # Data save
         self.amp_mean = 0.
@@ -454,8 +546,7 @@ class DBPhase(DataTreatment):
         # We calculate the sin and cos
         time = np.arange(self.nb_points)/samplerate
 
-        self.cos = np.cos(2.*np.pi*frequency*time)
-        self.sin = np.sin(2.*np.pi*frequency*time)
+        self.cos, self.sin = self.references(frequency, time)
 
         # Data save
         self.amp_mean = 0.
@@ -544,8 +635,7 @@ class RealImag(DataTreatment):
         # We calculate the sin and cos
         time = np.arange(self.nb_points)/samplerate
 
-        self.cos = np.cos(2.*np.pi*frequency*time)
-        self.sin = np.sin(2.*np.pi*frequency*time)
+        self.cos, self.sin = self.references(frequency, time)
 
         # Data save
         self.real_mean = 0.
@@ -614,8 +704,7 @@ class AmplitudePhasePerSequence(DataTreatment):
         # We calculate the sin and cos
         time = np.arange(self.nb_points)/samplerate
 
-        self.cos = np.cos(2.*np.pi*frequency*time)
-        self.sin = np.sin(2.*np.pi*frequency*time)
+        self.cos, self.sin = self.references(frequency, time)
 
         # We initialize np.array with the right dimension
         self.amp_mean = np.zeros(nb_sequence)
@@ -701,8 +790,7 @@ class AmplitudePhasePerSequencedB(DataTreatment):
         # We calculate the sin and cos
         time = np.arange(self.nb_points)/samplerate
 
-        self.cos = np.cos(2.*np.pi*frequency*time)
-        self.sin = np.sin(2.*np.pi*frequency*time)
+        self.cos, self.sin = self.references(frequency, time)
 
         # Data save
         self.amp_mean = 0.
@@ -802,8 +890,7 @@ class RealImagPerSequence(DataTreatment):
         # We calculate the sin and cos
         time = np.arange(self.nb_points)/samplerate
 
-        self.cos = np.cos(2.*np.pi*frequency*time)
-        self.sin = np.sin(2.*np.pi*frequency*time)
+        self.cos, self.sin = self.references(frequency, time)
 
         self.real_mean = 0.
         self.real_std  = 0.
@@ -858,8 +945,7 @@ class RealImag_raw(DataTreatment):
         # We calculate the sin and cos
         time = np.arange(self.nb_points)/samplerate
 
-        self.cos = np.cos(2.*np.pi*frequency*time)
-        self.sin = np.sin(2.*np.pi*frequency*time)
+        self.cos, self.sin = self.references(frequency, time)
 
         # Data save
         self.real_raw = []
@@ -913,8 +999,7 @@ class Average_IQ(DataTreatment):
         # We calculate the sin and cos
         time = np.arange(self.nb_points)/samplerate
 
-        self.cos = np.cos(2.*np.pi*frequency*time)
-        self.sin = np.sin(2.*np.pi*frequency*time)
+        self.cos, self.sin = self.references(frequency, time)
 
         # self.mat = np.zeros((self.nb_points, self.nb_points))
 
@@ -1026,8 +1111,7 @@ class SeveralRealImagPerSequence(DataTreatment):
         # We calculate the sin and cos
         time = np.arange(self.nb_points[-1, 1])/samplerate
 
-        self.cos = np.cos(2.*np.pi*frequency*time)
-        self.sin = np.sin(2.*np.pi*frequency*time)
+        self.cos, self.sin = self.references(frequency, time)
 
         self.real_mean = np.zeros(N)
         self.real  =  np.zeros(N)
@@ -1094,8 +1178,7 @@ class RealImagPerSequence_reset(DataTreatment):
         # We calculate the sin and cos
         time = np.arange(self.nb_points)/samplerate
 
-        self.cos = np.cos(2.*np.pi*frequency*time)
-        self.sin = np.sin(2.*np.pi*frequency*time)
+        self.cos, self.sin = self.references(frequency, time)
 
         self.real= 0.
         self.imag = 0.
@@ -1404,7 +1487,7 @@ class HomodyneRealImagPerSequenceWeighted(DataTreatment):
         Heavi2 = np.piecewise(self.time-t_stop,
             [(self.time-t_stop)<0, (self.time-t_stop) == 0, (self.time-t_stop) >0],
             [0., 0.5, 1.] )
-        self.ideal_pulse = (1.-np.exp(-(self.time-t_start)/tau))*Heavi1 - Heavi2*(1.-np.exp(-(self.time-t_stop)/tau))
+        self.ideal_pulse = ((1.-np.exp(-(self.time-t_start)/tau))*Heavi1 - Heavi2*(1.-np.exp(-(self.time-t_stop)/tau))).astype(self.dtype)
 
         self.nb_points = int(samplerate*pulse_time)
         self.nb_points2 = int(samplerate*(pulse_time+delta_t))
@@ -1463,7 +1546,7 @@ class HomodyneRealImag_rawWeighted(DataTreatment):
         Heavi2 = np.piecewise(self.time-t_stop,
             [(self.time-t_stop)<0, (self.time-t_stop) == 0, (self.time-t_stop) >0],
             [0., 0.5, 1.] )
-        self.ideal_pulse = (1.-np.exp(-(self.time-t_start)/tau))*Heavi1 - Heavi2*(1.-np.exp(-(self.time-t_stop)/tau))
+        self.ideal_pulse = ((1.-np.exp(-(self.time-t_start)/tau))*Heavi1 - Heavi2*(1.-np.exp(-(self.time-t_stop)/tau))).astype(self.dtype)
 
         # Data save
         self.data_pulse_raw = []
@@ -1518,7 +1601,7 @@ class HomodyneRealImag_raw_sevROWeighted(DataTreatment):
         Heavi2 = np.piecewise(self.time-t_stop,
             [(self.time-t_stop)<0, (self.time-t_stop) == 0, (self.time-t_stop) >0],
             [0., 0.5, 1.] )
-        self.ideal_pulse1 = (1.-np.exp(-(self.time-t1_start)/tau))*Heavi1 - Heavi2*(1.-np.exp(-(self.time-t_stop)/tau))
+        self.ideal_pulse1 = ((1.-np.exp(-(self.time-t1_start)/tau))*Heavi1 - Heavi2*(1.-np.exp(-(self.time-t_stop)/tau))).astype(self.dtype)
 
 
         self.nb_points_start2 = int(t2_start*samplerate)
@@ -1530,7 +1613,7 @@ class HomodyneRealImag_raw_sevROWeighted(DataTreatment):
         Heavi2 = np.piecewise(self.time-t_stop,
             [(self.time-t_stop)<0, (self.time-t_stop) == 0, (self.time-t_stop) >0],
             [0., 0.5, 1.] )
-        self.ideal_pulse2 = (1.-np.exp(-(self.time-t2_start)/tau))*Heavi1 - Heavi2*(1.-np.exp(-(self.time-t_stop)/tau))
+        self.ideal_pulse2 = ((1.-np.exp(-(self.time-t2_start)/tau))*Heavi1 - Heavi2*(1.-np.exp(-(self.time-t_stop)/tau))).astype(self.dtype)
         print np.mean(self.ideal_pulse1), np.mean(self.ideal_pulse2)
 
 
@@ -1596,8 +1679,8 @@ class HomodyneRealImag_raw_sevROBestWeighted(DataTreatment):
 
         self.nb_points_tot = int(samplerate*acquisition_time)
         self.time = np.arange(self.nb_points_tot)/samplerate
-        self.ideal_pulse1 = np.zeros_like(self.time)
-        self.ideal_pulse2 = np.zeros_like(self.time)
+        self.ideal_pulse1 = np.zeros_like(self.time, dtype=self.dtype)
+        self.ideal_pulse2 = np.zeros_like(self.time, dtype=self.dtype)
 
         self.nb_points_start1 = int(t1_start*samplerate)
         self.nb_points_start2 = int(t2_start*samplerate)
@@ -1631,3 +1714,68 @@ class HomodyneRealImag_raw_sevROBestWeighted(DataTreatment):
                     *data[:,+self.nb_points_start2:self.nb_points_weight+self.nb_points_start2], axis=1)
 
         queue_treatment.put((self.data_pulse_raw1, self.data_pulse_raw2))
+
+
+
+################################################################################
+# Precision validation
+################################################################################
+
+def compare_precision(processor_class, args, data, parameters, rtol=1e-4,
+                      atol=1e-6):
+    """
+        Validate the float32 precision against the float64 one.
+        The same raw buffer is treated by two instances of processor_class,
+        one per precision, and their results are compared.
+
+        Input:
+            - processor_class (class): child class of DataTreatment
+            - args (tuple): arguments used to instance processor_class
+            - data (np.array): raw uint16 buffer as returned by the board
+            - parameters (dict): board parameters, at least
+              'records_per_buffer' and 'samplesPerRecord'
+            - rtol (float): relative tolerance of the comparison
+            - atol (float): absolute tolerance of the comparison
+
+        Output:
+            - deviation (float): largest absolute deviation between the
+              float32 and the float64 results
+    """
+
+    initial_precision = get_precision()
+    results = {}
+
+    try:
+        for precision in allow_precisions:
+
+            set_precision(precision)
+            processor = processor_class(*args)
+            processor.treated_buffer   = 0
+            processor.treated_sequance = 0
+
+            queue_treatment = Queue.Queue()
+            processor.process(processor.data_2D(data, parameters),
+                              queue_treatment, parameters)
+            results[precision] = queue_treatment.get()
+    finally:
+        set_precision(initial_precision)
+
+    # Processors return either an array or a tuple of arrays
+    result64, result32 = results['float64'], results['float32']
+    if not isinstance(result64, tuple):
+        result64, result32 = (result64,), (result32,)
+
+    deviation = 0.
+    for r64, r32 in zip(result64, result32):
+
+        r64 = np.asarray(r64, dtype=np.float64)
+        r32 = np.asarray(r32, dtype=np.float64)
+
+        if r64.size:
+            deviation = max(deviation, np.max(np.abs(r64 - r32)))
+
+        if not np.allclose(r32, r64, rtol=rtol, atol=atol):
+            raise ValueError('The float32 treatment deviates from the float64 one by '\
+                             +str(deviation)+'.')
+
+    return deviation
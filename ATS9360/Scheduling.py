@@ -0,0 +1,244 @@
+# This Python file uses the following encoding: utf-8
+# Scheduling.py CPU affinity and priority of the ATS9360 processes
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from __future__ import division
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import logging
+import numpy as np
+import multiprocessing as mp
+
+
+
+def set_affinity(cpus):
+    """
+        Pin the current process on a set of CPUs.
+        Only available on Linux.
+
+        Input:
+            - cpus (tuple): index of the CPUs allowed for the process.
+
+        Output:
+            - success (bool)
+    """
+
+    if not sys.platform.startswith('linux'):
+        logging.warning(__name__+' : CPU affinity is only available on Linux')
+        return False
+
+    try:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpus)
+        else:
+            # Python 2 doesn't wrap the system call, we build the cpu_set_t
+            # mask ourselves.
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+            mask = (ctypes.c_ulong*16)()
+            bits = 8*ctypes.sizeof(ctypes.c_ulong)
+            for cpu in cpus:
+                mask[cpu//bits] |= 1 << (cpu%bits)
+
+            if libc.sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)):
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+    except (OSError, ValueError, IndexError) as e:
+        logging.warning(__name__+' : CPU affinity '+str(tuple(cpus))\
+                        +' could not be set: '+str(e))
+        return False
+
+    return True
+
+
+
+def set_priority(priority):
+    """
+        Set the niceness of the current process.
+        Raising the priority, negative niceness, needs the CAP_SYS_NICE
+        capability, otherwise the priority is left unchanged.
+
+        Input:
+            - priority (int): niceness between -20 (highest priority) and 19.
+
+        Output:
+            - success (bool)
+    """
+
+    if not hasattr(os, 'nice'):
+        logging.warning(__name__+' : The priority can not be set on this system')
+        return False
+
+    try:
+        os.nice(priority - os.nice(0))
+    except OSError as e:
+        logging.warning(__name__+' : The priority '+str(priority)\
+                        +' could not be set: '+str(e))
+        return False
+
+    return True
+
+
+
+def set_scheduling(cpus=None, priority=None):
+    """
+        Set the CPU affinity and the priority of the current process.
+        None or an empty set leaves the corresponding setting unchanged.
+
+        Input:
+            - cpus (tuple): index of the CPUs allowed for the process.
+            - priority (int): niceness between -20 (highest priority) and 19.
+    """
+
+    if cpus:
+        set_affinity(cpus)
+
+    if priority is not None:
+        set_priority(priority)
+
+
+
+def run_scheduled(cpus, priority, target, *args):
+    """
+        Target of the processes of the board: set the scheduling of the
+        process and next run target(*args).
+    """
+
+    set_scheduling(cpus, priority)
+
+    return target(*args)
+
+
+
+################################################################################
+# Benchmark
+################################################################################
+
+def _periodic_loop(cpus, priority, period, duration, queue):
+    """
+        Stand for the DMA loop: wake up every period and measure the delay
+        with respect to the expected time.
+    """
+
+    set_scheduling(cpus, priority)
+
+    delays = []
+    start  = time.time()
+    i = 1
+    while time.time() - start < duration:
+
+        target = start + i*period
+        time.sleep(max(0., target - time.time()))
+        delays.append(time.time() - target)
+        i += 1
+
+    queue.put(np.array(delays))
+
+
+
+def _treatment_loop(cpus, priority, duration, samples_per_buffer, queue):
+    """
+        Stand for the data treatment: convert buffers in V and demodulate
+        them as fast as possible.
+    """
+
+    set_scheduling(cpus, priority)
+
+    data = np.random.randint(0, 4096, samples_per_buffer).astype(np.uint16) << 4
+    ref  = np.cos(np.linspace(0., 2.*np.pi*100., samples_per_buffer))
+
+    treated = 0
+    start = time.time()
+    while time.time() - start < duration:
+
+        np.mean((0.4*((data >> 4) - 2047.5)/2047.5)*ref)
+        treated += 1
+
+    queue.put(treated*samples_per_buffer/(time.time() - start))
+
+
+
+def _load_loop(duration):
+    """
+        Stand for the plotting: keep a CPU busy.
+    """
+
+    start = time.time()
+    while time.time() - start < duration:
+        pass
+
+
+
+def benchmark(acquisition_cpus=None, treatment_cpus=None, priority=None,
+              period=1e-3, duration=5., load=None,
+              samples_per_buffer=250*10240):
+    """
+        Compare the default scheduling with the given one.
+        A periodic loop stands for the acquisition and reports its wake-up
+        jitter, a treatment loop reports its sustained rate, while "load"
+        processes keep the CPUs busy.
+
+        Input:
+            - acquisition_cpus (tuple): CPUs of the acquisition process.
+            - treatment_cpus (tuple): CPUs of the treatment process.
+            - priority (int): niceness of both processes.
+            - period (float): period of the acquisition loop in second.
+            - duration (float): duration of each run in second.
+            - load (int): number of busy processes, by default the number of
+              CPUs.
+            - samples_per_buffer (int): size of the treated buffers.
+
+        Output:
+            - message (str): jitter and rate of both runs.
+    """
+
+    if load is None:
+        load = mp.cpu_count()
+
+    message = ''
+    for name, scheduling in (('Default', (None, None, None)),
+                             ('Requested', (acquisition_cpus, treatment_cpus, priority))):
+
+        queue_delays = mp.Queue()
+        queue_rate   = mp.Queue()
+
+        workers = [mp.Process(target = _load_loop, args = (duration,))
+                   for i in range(load)]
+        workers.append(mp.Process(target = _periodic_loop,
+                                  args   = (scheduling[0], scheduling[2],
+                                            period, duration, queue_delays)))
+        workers.append(mp.Process(target = _treatment_loop,
+                                  args   = (scheduling[1], scheduling[2],
+                                            duration, samples_per_buffer,
+                                            queue_rate)))
+
+        for worker in workers:
+            worker.start()
+
+        delays = queue_delays.get()*1e6
+        rate   = queue_rate.get()
+
+        for worker in workers:
+            worker.join()
+
+        message += '%s scheduling:\n' % name
+        message += 'Acquisition jitter: mean %f us, std %f us, max %f us\n' %\
+                   (np.mean(delays), np.std(delays), np.max(delays))
+        message += 'Treatment rate: %f MS per sec\n' % (rate/1e6)
+
+    return message
@@ -0,0 +1,187 @@
+# This Python file uses the following encoding: utf-8
+# SimulatedBoard.py simulation of a system of ATS9360 boards
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+    Stand-in for the Board and DMABuffer classes of atsapi, used by
+    DataAcquisition when the simulation is enabled.
+    Only the methods used by DataAcquisition are simulated.
+
+    As in a real master/slave system, the boards of a system start when
+    startCapture is called on the master board (boardId 1).
+    The 12-bit code of every sample is
+        (record + 512*(boardId - 1) + 256*channel) % 4096
+    with record the index of the record in the acquisition and channel 0 for
+    A and 1 for B, so that the alignment of the boards can be checked.
+"""
+
+import ctypes
+import threading
+import collections
+import numpy as np
+
+# Number of boards in each simulated system
+boards_per_system = 4
+
+# Constants of atsapi used by DataAcquisition, with the same values, so that
+# the simulation runs without the Alazar SDK
+CHANNEL_A                  = 1
+CHANNEL_B                  = 2
+DC_COUPLING                = 2
+INPUT_RANGE_PM_400_MV      = 0x7
+IMPEDANCE_50_OHM           = 2
+TRIG_ENGINE_OP_J           = 0
+TRIG_ENGINE_J              = 0
+TRIG_ENGINE_K              = 1
+TRIG_EXTERNAL              = 2
+TRIG_DISABLE               = 3
+TRIGGER_SLOPE_POSITIVE     = 1
+AUX_OUT_TRIGGER            = 0
+ADMA_EXTERNAL_STARTCAPTURE = 0x1
+ADMA_NPT                   = 0x200
+ADMA_FIFO_ONLY_STREAMING   = 0x800
+ADMA_DSP                   = 0x4000
+DSP_WINDOW_HAMMING         = 2
+
+# Start of the capture of each system, shared by its boards
+_systems = {}
+
+
+
+def boardsInSystemBySystemID(sid):
+
+    return boards_per_system
+
+
+
+class DMABuffer(object):
+    """
+        Buffer with the same attributes than atsapi.DMABuffer.
+    """
+
+    def __init__(self, c_sample_type, size_bytes):
+
+        npSampleType = {
+            ctypes.c_uint8  : np.uint8,
+            ctypes.c_uint16 : np.uint16
+        }[c_sample_type]
+
+        self.size_bytes = size_bytes
+        self.buffer     = np.zeros(size_bytes//ctypes.sizeof(c_sample_type),
+                                   dtype=npSampleType)
+        self.addr       = self.buffer.ctypes.data
+
+
+
+class Board(object):
+    """
+        Simulated board of a master/slave system.
+    """
+
+    def __init__(self, systemId=1, boardId=1):
+
+        if boardId > boards_per_system:
+            raise Exception("Board %d.%d not found" % (systemId, boardId))
+
+        self.systemId = systemId
+        self.boardId  = boardId
+
+        _systems.setdefault(systemId, threading.Event())
+
+        self._posted  = collections.deque()
+        self._buffers = {}
+        self._record  = 0
+
+    def setCaptureClock(self, source, rate, edge, decimation):
+        pass
+
+    def inputControl(self, channel, coupling, inputRange, impedance):
+        pass
+
+    def setTriggerOperation(self, operation, engine1, source1, slope1, level1,
+                            engine2, source2, slope2, level2):
+        pass
+
+    def setExternalTrigger(self, coupling, range):
+        pass
+
+    def setTriggerDelay(self, delay):
+        pass
+
+    def setTriggerTimeOut(self, timeout_ticks):
+        pass
+
+    def configureAuxIO(self, mode, parameter):
+        pass
+
+    def getChannelInfo(self):
+        return (ctypes.c_uint32(4*1024**3), ctypes.c_uint8(12))
+
+    def setRecordSize(self, preTriggerSamples, postTriggerSamples):
+        pass
+
+    def beforeAsyncRead(self, channels, transferOffset, samplesPerRecord,
+                        recordsPerBuffer, recordsPerAcquisition, flags):
+
+        # CHANNEL_A and CHANNEL_B are the two first bits of the mask
+        self._channels         = [c for c in (0, 1) if channels & (1 << c)]
+        self._samplesPerRecord = samplesPerRecord
+        self._recordsPerBuffer = recordsPerBuffer
+        self._record           = 0
+
+        if self.boardId == 1:
+            _systems[self.systemId].clear()
+
+    def postAsyncBuffer(self, buffer, bufferLength):
+
+        self._posted.append(buffer)
+
+    def startCapture(self):
+
+        # As in a master/slave system, only the master starts the capture
+        if self.boardId == 1:
+            _systems[self.systemId].set()
+
+    def waitAsyncBufferComplete(self, buffer, timeout_ms):
+
+        if not _systems[self.systemId].wait(timeout_ms*1e-3):
+            raise Exception("Error calling function AlazarWaitAsyncBufferComplete : ApiWaitTimeout")
+
+        if not self._posted or self._posted[0] != buffer:
+            raise Exception("Error calling function AlazarWaitAsyncBufferComplete : ApiBufferNotReady")
+        self._posted.popleft()
+
+        # Samples of the channels are interleaved
+        records  = self._record + np.arange(self._recordsPerBuffer)
+        channels = np.array(self._channels)
+        codes = (records[:, None, None] + 512*(self.boardId - 1)\
+                 + 256*channels[None, None, :]) % 4096
+        codes = np.broadcast_to(codes, (self._recordsPerBuffer,
+                                        self._samplesPerRecord,
+                                        len(channels)))
+
+        data = self._buffers.get(buffer)
+        if data is None:
+            data = np.ctypeslib.as_array(ctypes.cast(buffer, ctypes.POINTER(ctypes.c_uint16)),
+                                         shape=(codes.size,))
+            self._buffers[buffer] = data
+        data[:] = (codes << 4).ravel()
+
+        self._record += self._recordsPerBuffer
+
+    def abortAsyncRead(self):
+
+        self._posted.clear()
@@ -25,6 +25,8 @@ import multiprocessing as mp
 
 from ATS9360 import atsapi as ats
 from ATS9360.DataAcquisition import DataAcquisition
+from ATS9360.DataReplay import DataReplay
+from ATS9360.Scheduling import run_scheduled
 data_acquisition = DataAcquisition()
 
 class ATS9360_NPT(Instrument):
@@ -107,6 +109,49 @@ class ATS9360_NPT(Instrument):
             option_list = ('CHANNEL_AB','CHANNEL_A','CHANNEL_B','FFT')
             )
 
+        self.add_parameter('capture_file',
+            type        = types.StringType,
+            flags       = Instrument.FLAG_GETSET
+            )
+
+        self.add_parameter('replay_file',
+            type        = types.StringType,
+            flags       = Instrument.FLAG_GETSET
+            )
+
+        self.add_parameter('replay_pacing',
+            type        = types.BooleanType,
+            flags       = Instrument.FLAG_GETSET
+            )
+
+        self.add_parameter('nb_boards',
+            type        = types.IntType,
+            flags       = Instrument.FLAG_GETSET,
+            minval      = 1
+            )
+
+        self.add_parameter('simulation',
+            type        = types.BooleanType,
+            flags       = Instrument.FLAG_GETSET
+            )
+
+        self.add_parameter('acquisition_cpus',
+            type        = types.TupleType,
+            flags       = Instrument.FLAG_GETSET
+            )
+
+        self.add_parameter('treatment_cpus',
+            type        = types.TupleType,
+            flags       = Instrument.FLAG_GETSET
+            )
+
+        self.add_parameter('scheduling_priority',
+            type        = types.IntType,
+            flags       = Instrument.FLAG_GETSET,
+            minval      = -20,
+            maxval      = 19
+            )
+
         self.allow_samplerates = {1e-3   : ats.SAMPLE_RATE_1KSPS,
                                   2e-3   : ats.SAMPLE_RATE_2KSPS,
                                   5e-3   : ats.SAMPLE_RATE_5KSPS,
@@ -190,6 +235,27 @@ class ATS9360_NPT(Instrument):
         # Mode of the digitizer.
         self.mode = 'CHANNEL_AB'
 
+        # Capture of the raw buffers on the disk and replay of a capture
+        # instead of the board, see ATS9360/DataReplay.py
+        # An empty string disables them.
+        self.capture_file  = ''
+        self.replay_file   = ''
+        self.replay_pacing = False
+
+        # Number of synchronized boards of the system used, the board 1 is
+        # the master
+        self.nb_boards = 1
+
+        # If True, the boards are simulated, see ATS9360/SimulatedBoard.py
+        self.simulation = False
+
+        # Scheduling of the acquisition and treatment processes (Linux only),
+        # see ATS9360/Scheduling.py
+        # Empty tuples and None leave the default scheduling.
+        self.acquisition_cpus    = ()
+        self.treatment_cpus      = ()
+        self.scheduling_priority = None
+
         # For the display, we get all parameters at the end of the
         # initialization
         self.get_all()
@@ -221,6 +287,17 @@ class ATS9360_NPT(Instrument):
 
         self.get_mode()
 
+        self.get_capture_file()
+        self.get_replay_file()
+        self.get_replay_pacing()
+
+        self.get_nb_boards()
+        self.get_simulation()
+
+        self.get_acquisition_cpus()
+        self.get_treatment_cpus()
+        self.get_scheduling_priority()
+
 
 
     #########################################################################
@@ -261,6 +338,13 @@ class ATS9360_NPT(Instrument):
         parameters['buffers_per_acquisition'] = self.buffers_per_acquisition
         parameters['nb_sequence']             = self.nb_sequence
 
+        # With several boards, the data treatment receives the records of
+        # all the boards in a single stream, the record i of the board b
+        # being the record i*nb_boards + b. Each record of a sequence is
+        # then followed by the same record of the other boards.
+        parameters['records_per_buffer'] *= self.nb_boards
+        parameters['nb_sequence']        *= self.nb_boards
+
         # Correspondence between user parameters and board command
         parameters['allow_samplerates']    = self.allow_samplerates
         parameters['allow_clock_edges']    = self.allow_clock_edges
@@ -277,6 +361,12 @@ class ATS9360_NPT(Instrument):
         # Mode of the digitizer
         parameters['mode'] = self.mode
 
+        # Capture of the raw buffers
+        parameters['capture_file'] = self.capture_file
+
+        # Number of synchronized boards
+        parameters['nb_boards'] = self.nb_boards
+
         return parameters
 
 
@@ -302,6 +392,27 @@ class ATS9360_NPT(Instrument):
             Output:
                 - None
         """
+
+        # The data come either from the board or from a previous capture
+        if self.replay_file:
+            acquisition = DataReplay(self.replay_file, self.replay_pacing)
+        elif self.simulation:
+            acquisition = DataAcquisition(simulated=True)
+        else:
+            acquisition = data_acquisition
+
+        if self.nb_boards > 1:
+
+            if self.mode not in {'CHANNEL_AB', 'CHANNEL_A', 'CHANNEL_B'}:
+                raise ValueError('mode of the digitizer must be "CHANNEL_AB" or \
+                                 "CHANNEL_A" or "CHANNEL_B" with several boards')
+
+            if self.replay_file or self.capture_file:
+                raise ValueError('Capture and replay are only available with one board')
+
+        # In case of several boards, their records are merged in a single
+        # stream by the acquisition, the data treatment is the same as for
+        # one board, see _get_parameters
         if self.mode == 'CHANNEL_AB':
 
             # In case operation mode is 'CHANNEL_AB',
@@ -322,19 +433,28 @@ class ATS9360_NPT(Instrument):
             self.parameters      = self._get_parameters()
 
             # We create the data treatment process
-            self.worker_treat_data[0] = mp.Process(target = processor.treat_data,
-                                                    args   = (queue_data[0],
+            self.worker_treat_data[0] = mp.Process(target = run_scheduled,
+                                                    args   = (self._get_treatment_cpus(0),
+                                                              self.scheduling_priority,
+                                                              processor.treat_data,
+                                                              queue_data[0],
                                                               self.queue_treatment[0],
                                                               self.parameters))
 
-            self.worker_treat_data[1] = mp.Process(target = processor.treat_data,
-                                                    args   = (queue_data[1],
+            self.worker_treat_data[1] = mp.Process(target = run_scheduled,
+                                                    args   = (self._get_treatment_cpus(1),
+                                                              self.scheduling_priority,
+                                                              processor.treat_data,
+                                                              queue_data[1],
                                                               self.queue_treatment[1],
                                                               self.parameters))
 
             # We create the data acquisition process
-            self.worker_acquire_data = mp.Process(target = data_acquisition.get_data,
-                                                  args   = (queue_data,
+            self.worker_acquire_data = mp.Process(target = run_scheduled,
+                                                  args   = (self.acquisition_cpus,
+                                                            self.scheduling_priority,
+                                                            acquisition.get_data,
+                                                            queue_data,
                                                             self.parameters))
 
             # At this point the process is started
@@ -365,14 +485,20 @@ class ATS9360_NPT(Instrument):
             self.parameters      = self._get_parameters()
 
             # We create the data treatment process
-            self.worker_treat_data = mp.Process(target = processor.treat_data,
-                                                    args   = (queue_data,
+            self.worker_treat_data = mp.Process(target = run_scheduled,
+                                                    args   = (self._get_treatment_cpus(0),
+                                                              self.scheduling_priority,
+                                                              processor.treat_data,
+                                                              queue_data,
                                                               self.queue_treatment,
                                                               self.parameters))
 
             # We create the data acquisition process
-            self.worker_acquire_data = mp.Process(target = data_acquisition.get_data,
-                                                  args   = (queue_data,
+            self.worker_acquire_data = mp.Process(target = run_scheduled,
+                                                  args   = (self.acquisition_cpus,
+                                                            self.scheduling_priority,
+                                                            acquisition.get_data,
+                                                            queue_data,
                                                             self.parameters))
 
             # At this point the process is started
@@ -1017,3 +1143,295 @@ class ATS9360_NPT(Instrument):
         '''
 
         return self.mode
+
+
+
+    #########################################################################
+    #
+    #
+    #                           Capture and replay
+    #
+    #
+    #########################################################################
+
+    def do_set_capture_file(self, capture_file):
+        '''Set the file in which the raw buffers of the next measurements are
+            saved.
+
+            Input:
+                - capture_file (string): name of the capture without
+                  extension. The buffers are saved in "capture_file.npy" and
+                  the parameters of the board in
+                  "capture_file_parameters.pkl".
+                  An empty string disables the capture.
+
+            Output:
+                - None.
+        '''
+
+        self.capture_file = capture_file
+
+
+
+    def do_get_capture_file(self):
+        '''Get the file in which the raw buffers are saved.
+
+            Input:
+                - None.
+
+            Output:
+                - capture_file (string)
+        '''
+
+        return self.capture_file
+
+
+
+    def do_set_replay_file(self, replay_file):
+        '''Set a capture replayed instead of the board by the next
+            measurements.
+
+            Input:
+                - replay_file (string): name of the capture without
+                  extension. An empty string means the board is used.
+
+            Output:
+                - None.
+        '''
+
+        self.replay_file = replay_file
+
+
+
+    def do_get_replay_file(self):
+        '''Get the capture replayed instead of the board.
+
+            Input:
+                - None.
+
+            Output:
+                - replay_file (string)
+        '''
+
+        return self.replay_file
+
+
+
+    def do_set_replay_pacing(self, replay_pacing):
+        '''Set if the buffers of a capture are replayed with their original
+            timing or as fast as possible.
+
+            Input:
+                - replay_pacing (booleen)
+
+            Output:
+                - None.
+        '''
+
+        self.replay_pacing = replay_pacing
+
+
+
+    def do_get_replay_pacing(self):
+        '''Get if the buffers of a capture are replayed with their original
+            timing.
+
+            Input:
+                - None.
+
+            Output:
+                - replay_pacing (booleen)
+        '''
+
+        return self.replay_pacing
+
+
+
+    #########################################################################
+    #
+    #
+    #                           Several boards
+    #
+    #
+    #########################################################################
+
+    def do_set_nb_boards(self, nb_boards):
+        '''Set the number of synchronized boards used for the acquisition.
+            The boards must belong to the same master/slave system, the
+            board 1 being the master. All the boards acquire in the same mode
+            and their records are interleaved in a single stream treated by
+            one processor, as for one board: the sequences have
+            nb_sequence*nb_boards records, the record i of the board b being
+            the record i*nb_boards + b.
+
+            Input:
+                - nb_boards (int): number of boards.
+
+            Output:
+                - None.
+        '''
+
+        if not self.simulation and nb_boards > ats.boardsInSystemBySystemID(1):
+            raise ValueError('The system contains only '\
+                             +str(ats.boardsInSystemBySystemID(1))+' boards.')
+
+        self.nb_boards = nb_boards
+
+
+
+    def do_get_nb_boards(self):
+        '''Get the number of synchronized boards used for the acquisition.
+
+            Input:
+                - None.
+
+            Output:
+                - nb_boards (int)
+        '''
+
+        return self.nb_boards
+
+
+
+    def do_set_simulation(self, simulation):
+        '''Set if the boards are simulated, to test the acquisition without
+            them.
+
+            Input:
+                - simulation (booleen)
+
+            Output:
+                - None.
+        '''
+
+        self.simulation = simulation
+
+
+
+    def do_get_simulation(self):
+        '''Get if the boards are simulated.
+
+            Input:
+                - None.
+
+            Output:
+                - simulation (booleen)
+        '''
+
+        return self.simulation
+
+
+
+    #########################################################################
+    #
+    #
+    #                           Scheduling of the processes
+    #
+    #
+    #########################################################################
+
+    def _get_treatment_cpus(self, worker):
+        """
+            Return the CPUs of a treatment worker.
+            treatment_cpus is either a set of CPUs shared by all workers, as
+            (2, 3), or one set per worker, as ((2,), (3,)).
+        """
+
+        if self.treatment_cpus and isinstance(self.treatment_cpus[0], (tuple, list)):
+            return tuple(self.treatment_cpus[worker % len(self.treatment_cpus)])
+        else:
+            return self.treatment_cpus
+
+
+
+    def do_set_acquisition_cpus(self, acquisition_cpus):
+        '''Set the CPUs on which the acquisition process is pinned.
+            Only available on Linux.
+
+            Input:
+                - acquisition_cpus (tuple): index of the CPUs, as (1,).
+                  An empty tuple leaves the default scheduling.
+
+            Output:
+                - None.
+        '''
+
+        self.acquisition_cpus = tuple(acquisition_cpus)
+
+
+
+    def do_get_acquisition_cpus(self):
+        '''Get the CPUs on which the acquisition process is pinned.
+
+            Input:
+                - None.
+
+            Output:
+                - acquisition_cpus (tuple)
+        '''
+
+        return self.acquisition_cpus
+
+
+
+    def do_set_treatment_cpus(self, treatment_cpus):
+        '''Set the CPUs on which the treatment processes are pinned.
+            Only available on Linux.
+
+            Input:
+                - treatment_cpus (tuple): index of the CPUs shared by all the
+                  treatment processes, as (2, 3), or one set per process, as
+                  ((2,), (3,)) for channel A and B.
+                  An empty tuple leaves the default scheduling.
+
+            Output:
+                - None.
+        '''
+
+        self.treatment_cpus = tuple(treatment_cpus)
+
+
+
+    def do_get_treatment_cpus(self):
+        '''Get the CPUs on which the treatment processes are pinned.
+
+            Input:
+                - None.
+
+            Output:
+                - treatment_cpus (tuple)
+        '''
+
+        return self.treatment_cpus
+
+
+
+    def do_set_scheduling_priority(self, scheduling_priority):
+        '''Set the niceness of the acquisition and treatment processes.
+            A negative niceness raises their priority but needs the
+            CAP_SYS_NICE capability, otherwise the priority is left unchanged
+            and a warning is logged.
+
+            Input:
+                - scheduling_priority (int): niceness between -20 (highest
+                  priority) and 19.
+
+            Output:
+                - None.
+        '''
+
+        self.scheduling_priority = scheduling_priority
+
+
+
+    def do_get_scheduling_priority(self):
+        '''Get the niceness of the acquisition and treatment processes.
+
+            Input:
+                - None.
+
+            Output:
+                - scheduling_priority (int)
+        '''
+
+        return self.scheduling_priority
@@ -27,6 +27,7 @@ import ctypes
 import re
 import math
 import itertools
+import hashlib
 
 
 ################### Constants
@@ -41,6 +42,14 @@ import itertools
 #
 # Channels=(1,2,3,4)
 # Mark_num = (1,2)
+
+# Samples of the REAL waveforms: a float and a byte of markers, little-endian
+WAVEFORM_DTYPE = np.dtype([('value', '<f4'), ('markers', 'u1')])
+MARKER1 = 0b01000000
+MARKER2 = 0b10000000
+# Size of the write_raw calls of the binary blocks, in bytes
+WRITE_CHUNK = 1024**2
+
 ###### Useful functions
 def _engineer_to_scienc(value):
         '''
@@ -55,6 +64,84 @@ def _engineer_to_scienc(value):
         multipliers = {'n':1e-9,'u':1e-6,'m':1e-3,'k': 1e3, 'M': 1e6, 'G': 1e9}
         return int(float(value[:-1])*multipliers[value[-1]])
 
+class SequenceTable(object):
+    '''
+    Sequence of the AWG7000, programmed at once by AWG7000.programSequence.
+
+    Each element plays a waveform on some channels, and can be looped, wait
+    for a trigger, jump on an event or go to another element at its end.
+    The elements are indexed from 1, as on the instrument.
+
+    Usage:
+        table = SequenceTable()
+        for name in names:
+            table.addElement({1: name, 2: 'readout'}, wait=True)
+        table.addElement({1: 'idle'}, goto=1)
+        awg.programSequence(table)
+    '''
+
+    def __init__(self):
+        self.elements = []
+
+    def __len__(self):
+        return len(self.elements)
+
+    def addElement(self, waveforms, loops=1, infinite=False, wait=False,
+                   jump=None, goto=None):
+        '''
+        Appends an element to the sequence.
+
+        Input:
+            waveforms (dict): {channel: waveform name}
+            loops (int): number of repetitions of the element
+            infinite (bool): repeats the element until an event
+            wait (bool): waits for a trigger before playing the element
+            jump: target of the event jump, None (OFF), 'NEXT' or an index
+            goto (int): element played after this one, None for the next one
+
+        Output:
+            index (int): index of the element
+        '''
+        if loops < 1:
+            raise ValueError('The number of loops should be at least 1, not {}.'.format(loops))
+        if jump is not None and jump != 'NEXT' and int(jump) < 1:
+            raise ValueError('The jump target should be None, \'NEXT\' or an index, not {}.'.format(jump))
+
+        self.elements.append({'waveforms' : dict(waveforms),
+                              'loops'     : int(loops),
+                              'infinite'  : bool(infinite),
+                              'wait'      : bool(wait),
+                              'jump'      : jump,
+                              'goto'      : goto})
+        return len(self.elements)
+
+    def commands(self):
+        '''
+        Returns the commands programming the elements, only the settings
+        differing from the default of a new element are sent.
+        '''
+        msg = []
+        for index, element in enumerate(self.elements, 1):
+            prefix = 'SEQuence:ELEMent'+str(index)
+
+            for channel, name in sorted(element['waveforms'].items()):
+                msg.append(prefix+':WAVeform'+str(channel)+' "'+name+'"')
+            if element['infinite']:
+                msg.append(prefix+':LOOP:INFinite 1')
+            elif element['loops'] != 1:
+                msg.append(prefix+':LOOP:COUNt '+str(element['loops']))
+            if element['wait']:
+                msg.append(prefix+':TWAit 1')
+            if element['jump'] == 'NEXT':
+                msg.append(prefix+':JTARget:TYPE NEXT')
+            elif element['jump'] is not None:
+                msg.append(prefix+':JTARget:TYPE INDex')
+                msg.append(prefix+':JTARget:INDex '+str(element['jump']))
+            if element['goto'] is not None:
+                msg.append(prefix+':GOTO:STATe 1')
+                msg.append(prefix+':GOTO:INDex '+str(element['goto']))
+        return msg
+
 class AWG7000(Instrument):
     '''
     Initializes the AWG7000
@@ -108,8 +195,14 @@ class AWG7000(Instrument):
             logging.debug(__name__ + ' : could not open visa session')
             raise ValueError(__name__ + ' : could not open visa session')
 
+        # Mirror of the waveform list of the instrument {name: hash}, the hash
+        # of the content being None when it is unknown, see uploadWaveforms
+        self._wlist = {}
+
         if reset:
             self.reset()
+        else:
+            self.syncWaveformList()
 
 
     def reset(self):
@@ -123,6 +216,7 @@ class AWG7000(Instrument):
             None
         '''
         self.sendMessage("*RST")
+        self.syncWaveformList()
 
     def Output(self, channel=1, state='ON'):
         '''
@@ -183,6 +277,7 @@ class AWG7000(Instrument):
         msg='WLIST:WAVeform:NEW "' +name+ '", ' + str(size)+ ', REAL'
         if stringOnly==0:
             self.sendMessage(msg)
+            self._wlist[name] = None
         else:
             return msg
 
@@ -190,30 +285,136 @@ class AWG7000(Instrument):
         """
         Writes the Data given into the Waveformslot 'name' created by the function newWaveform
         """
-        MARKER1= 0b01000000
-        MARKER2= 0b10000000
-        if (marker1==[]):
-            marker1=np.zeros(len(data),dtype=int)
-        else:
-            marker1=marker1*MARKER1
+#        self.newWaveform(name,len(data))
+        msgStart, block_data = self._waveformBlock(name, data, marker1, marker2)
 
-        if (marker2==[]):
-            marker2=np.zeros(len(data),dtype=int)
+        if stringOnly==0:
+            wvf_hash = self.waveformHash(block_data)
+            if self._wlist.get(name) == wvf_hash:
+                logging.debug(__name__ + ' : waveform "{}" already up to date'.format(name))
+                return
+            self._writeBlock(msgStart, block_data)
+            self._wlist[name] = wvf_hash
         else:
-            marker2=marker2*MARKER2
-#        self.newWaveform(name,len(data))
-        block_data=''
-        msgStart=('WLISt:WAVeform:DATA "'+name+'",0,'+str(len(data))+',#'+str(len(str(5*len(data))))+str(5*len(data)))
-        for val,m1,m2 in itertools.izip(data,marker1,marker2):
-            converted_data=struct.pack('<fB',float(val),m1+m2) # or should work aswell
+            return msgStart+block_data.tostring()
 
-            block_data = block_data + converted_data
-        msg=msgStart+block_data
+    def uploadWaveforms(self, waveforms, create=True, prune=False):
+        """
+        Creates and fills many waveforms in one go: the WLIST entries are
+        created in one message, the data blocks are then written back to back
+        and the instrument is waited for only once, at the end.
+        The waveforms whose name and content are already in the waveform list
+        of the instrument are skipped.
 
-        if stringOnly==0:
+        Input:
+            waveforms (list): (name, data) or (name, data, marker1, marker2)
+                              tuples, or a dict {name: data}
+            create (bool): creates the WLIST entries first, an entry holding
+                           another content is created again as its size may
+                           differ
+            prune (bool): deletes the other user waveforms of the list, in the
+                          same message as the creations
+
+        Output:
+            uploaded (list): names of the waveforms written
+        """
+        if isinstance(waveforms, dict):
+            waveforms = sorted(waveforms.items())
+
+        blocks = []
+        for waveform in waveforms:
+            msgStart, block_data = self._waveformBlock(*waveform)
+            wvf_hash = self.waveformHash(block_data)
+            if self._wlist.get(waveform[0]) != wvf_hash:
+                blocks.append((waveform[0], msgStart, block_data, wvf_hash))
+
+        msg = []
+        if prune:
+            stale = self.staleWaveforms([waveform[0] for waveform in waveforms])
+            msg += self._forgetWaveforms(stale)
+        if create:
+            msg += self._forgetWaveforms([name for name, _, _, _ in blocks
+                                          if name in self._wlist])
+            for name, _, block_data, _ in blocks:
+                msg.append(self.newWaveform(name, len(block_data), stringOnly=1))
+                self._wlist[name] = None
+        if msg:
             self.sendMessage(msg)
-        else:
-            return msg
+
+        for name, msgStart, block_data, wvf_hash in blocks:
+            self._writeBlock(msgStart, block_data)
+            self._wlist[name] = wvf_hash
+
+        self.query('*OPC?')
+        return [name for name, _, _, _ in blocks]
+
+    def waveformHash(self, block_data):
+        """
+        Returns the hash of the content of a waveform packed by _waveformBlock.
+        """
+        return hashlib.sha1(block_data.view(np.uint8)).hexdigest()
+
+    def syncWaveformList(self):
+        """
+        Reads the waveform list of the instrument into the local mirror. The
+        content of the waveforms being unknown, they will be written again
+        by the next upload.
+        """
+        self._wlist = dict((name, None) for name in self.readWaveformNames())
+
+    def staleWaveforms(self, keep):
+        """
+        Returns the user waveforms of the list which are not in keep, the
+        predefined waveforms, whose names start with '*', are never stale.
+        """
+        keep = set(keep)
+        return sorted(name for name in self._wlist
+                      if name not in keep and not name.startswith('*'))
+
+    def deleteStaleWaveforms(self, keep):
+        """
+        Deletes, in one message, the user waveforms of the list which are not
+        in keep.
+        """
+        msg = self._forgetWaveforms(self.staleWaveforms(keep))
+        if msg:
+            self.sendMessage(msg)
+
+    def _forgetWaveforms(self, names):
+        """
+        Removes the waveforms names from the mirror and returns the messages
+        deleting them.
+        """
+        for name in names:
+            self._wlist.pop(name, None)
+        return ['WLISt:WAVeform:DELete "'+name+'"' for name in names]
+
+    def _waveformBlock(self, name, data, marker1=[], marker2=[]):
+        """
+        Returns the header of the WLIST data message of the waveform 'name'
+        and its binary block, packed at once as WAVEFORM_DTYPE samples.
+        """
+        block_data = np.zeros(len(data), dtype=WAVEFORM_DTYPE)
+        block_data['value'] = data
+        if len(marker1):
+            block_data['markers'] |= (np.asarray(marker1) != 0)*np.uint8(MARKER1)
+        if len(marker2):
+            block_data['markers'] |= (np.asarray(marker2) != 0)*np.uint8(MARKER2)
+
+        size = str(block_data.nbytes)
+        msgStart = 'WLISt:WAVeform:DATA "'+name+'",0,'+str(len(data))+',#'+str(len(size))+size
+        return msgStart, block_data
+
+    def _writeBlock(self, msgStart, block_data):
+        """
+        Writes the message msgStart followed by the binary block block_data,
+        in chunks of WRITE_CHUNK bytes.
+        """
+        payload = memoryview(block_data.view(np.uint8))
+        self._visainstrument.write_raw(msgStart)
+        for start in range(0, len(payload), WRITE_CHUNK):
+            self._visainstrument.write_raw(payload[start:start + WRITE_CHUNK].tobytes())
+        self._visainstrument.write_raw(self.msgEnd)
 
 
     def readWaveformNames(self):
@@ -224,7 +425,10 @@ class AWG7000(Instrument):
         msg=[]
         for i in range (1,int(ansr)+1):
             msg.append('WLIST:NAME? '+str(i))
-        wnames = self.query(msg)
+        if not msg:
+            return []
+        # All the names in one query
+        wnames = self.query(self.delimiter.join(msg))
         names=re.findall('".*?"',wnames)
         strippednames=[]
         for name in names:
@@ -240,11 +444,10 @@ class AWG7000(Instrument):
         """
         if isinstance(Names, basestring):
             dlmsg='WLISt:WAVeform:DELete "'+Names+'"'
+            self._wlist.pop(Names, None)
         else:
             try:
-                dlmsg=[]
-                for name in Names:
-                    dlmsg.append('WLISt:WAVeform:DELete "'+name+'"')
+                dlmsg=self._forgetWaveforms(list(Names))
             except TypeError:
                 print('TypeError occourred on Waveform Names in function deleteWaveforms, please ensure that message is a string or a list of strings')
         self.sendMessage(dlmsg)
@@ -323,6 +526,21 @@ class AWG7000(Instrument):
         """
         self.sendMessage('SEQuence:LENGth '+str(SequenceLength))
 
+    def programSequence(self, table, batch=256):
+        """
+        Programs the whole sequence table, a SequenceTable, in a few large
+        messages of batch commands instead of one message per setting.
+        The previous sequence is deleted first, so that the elements start
+        from their default settings.
+        """
+        self.sendMessage(['SEQuence:LENGth 0', 'SEQuence:LENGth '+str(len(table))])
+
+        msg = table.commands()
+        for start in range(0, len(msg), batch):
+            self.sendMessage(msg[start:start + batch])
+
+        self.query('*OPC?')
+
     def setSeqElementGoto(self,SequenceIndex=1,State=1,Index=1):#TODO implement stringonly
         """
         Used to set JumpMode for a sequence Element
@@ -400,10 +618,7 @@ class AWG7000(Instrument):
         else:
             try:
 
-                fullMsg=''
-                for msgPart in msg:
-                    fullMsg=fullMsg+msgPart+self.delimiter
-                fullMsg.rstrip(self.delimiter)
+                fullMsg=self.delimiter.join(msg)
                 self._visainstrument.write_raw(fullMsg+self.msgEnd)
 
             except TypeError:
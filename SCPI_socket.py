@@ -0,0 +1,496 @@
+# This Python file uses the following encoding: utf-8
+# SCPI_socket.py raw TCP transport of SCPI binary blocks
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+    Direct TCP transport of the SCPI binary blocks of an instrument on LAN,
+    used by Tabor_WX1284C.download_binary_data for ':TRAC:DATA' and
+    ':SEQ:DATA' when its socket transport is enabled.
+
+    SocketTransport sends a block in chunks whose size adapts to the
+    measured throughput, so that each chunk takes about target seconds, and
+    reports the MB/s of every transfer.
+    BlockServer is a local stand-in of the instrument which speaks the same
+    IEEE-488.2 definite length block protocol, so that the transport can be
+    benchmarked and checked without the AWG:
+
+        python SCPI_socket.py --save baseline.json
+        python SCPI_socket.py --baseline baseline.json --threshold 0.2
+
+    The second command exits with an error if a size is slower than its
+    baseline by more than the threshold.
+"""
+
+import sys
+import time
+import json
+import socket
+import hashlib
+import argparse
+import threading
+import numpy as np
+
+
+
+def block_header(msg, size):
+    """
+        Return the command msg followed by the header of a definite length
+        block of size bytes, '#<number of digits><size>'.
+    """
+
+    digits = str(size)
+    return '{} #{}{}'.format(msg, len(digits), digits)
+
+
+
+class SocketTransport(object):
+    """
+        Raw TCP connection to the SCPI port of an instrument.
+    """
+
+    def __init__(self, host, port=5025, timeout=20., send_buffer=4*1024**2,
+                 chunk=256*1024, min_chunk=64*1024, max_chunk=16*1024**2,
+                 target=0.05):
+        """
+            Input:
+                - host (str): address of the instrument.
+                - port (int): SCPI port of the instrument.
+                - timeout (float): timeout of the socket in s.
+                - send_buffer (int): size of the send buffer of the socket in
+                  bytes.
+                - chunk (int): size of the first chunk in bytes, later
+                  transfers start with the last size used.
+                - min_chunk, max_chunk (int): limits of the chunk size.
+                - target (float): duration of a chunk aimed at, in s.
+        """
+
+        self.host        = host
+        self.port        = port
+        self.timeout     = timeout
+        self.send_buffer = send_buffer
+        self.chunk       = chunk
+        self.min_chunk   = min_chunk
+        self.max_chunk   = max_chunk
+        self.target      = target
+
+        # Statistics of the last block sent, see write_block
+        self.last_transfer = None
+
+        self._socket = None
+        self._received = ''
+
+
+
+    def connect(self):
+
+        if self._socket is not None:
+            return
+
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket   = sock
+        self._received = ''
+
+
+
+    def close(self):
+
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+
+    def write(self, command):
+
+        self.connect()
+        self._socket.sendall(command + '\n')
+
+
+
+    def read(self):
+        """
+            Return the next answer of the instrument, without termination.
+        """
+
+        self.connect()
+        while '\n' not in self._received:
+            data = self._socket.recv(4096)
+            if not data:
+                self.close()
+                raise IOError('Connection closed by %s:%d' % (self.host, self.port))
+            self._received += data
+
+        answer, self._received = self._received.split('\n', 1)
+        return answer.rstrip('\r')
+
+
+
+    def query(self, command):
+
+        self.write(command)
+        return self.read()
+
+
+
+    def write_block(self, msg, data):
+        """
+            Send data as a definite length block after the command msg.
+
+            Input:
+                - msg (str): command of the block, ':TRAC:DATA' for instance.
+                - data: numpy array or str of the bytes to send.
+
+            Output:
+                - transfer (dict): 'bytes', 'seconds', 'MBps' and the last
+                  'chunk' size of the transfer, also kept in last_transfer.
+        """
+
+        if isinstance(data, np.ndarray):
+            data = np.ascontiguousarray(data).view(np.uint8).ravel()
+        view = memoryview(data)
+        size = len(view)
+
+        self.connect()
+        start = time.time()
+        self._socket.sendall(block_header(msg, size))
+
+        chunk  = self.chunk
+        offset = 0
+        while offset < size:
+
+            length = min(chunk, size - offset)
+            sent = time.time()
+            self._socket.sendall(view[offset:offset + length])
+            elapsed = time.time() - sent
+            offset += length
+
+            # Fewer larger chunks when the link is fast, smaller ones when
+            # the instrument does not follow
+            if elapsed < self.target/2. and length == chunk:
+                chunk = min(2*chunk, self.max_chunk)
+            elif elapsed > 2.*self.target:
+                chunk = max(chunk//2, self.min_chunk)
+
+        self._socket.sendall('\n')
+        elapsed = time.time() - start
+
+        self.chunk = chunk
+        self.last_transfer = {'bytes'   : size,
+                              'seconds' : elapsed,
+                              'MBps'    : size/1e6/max(elapsed, 1e-9),
+                              'chunk'   : chunk}
+        return self.last_transfer
+
+
+
+class BlockServer(object):
+    """
+        Local stand-in of a SCPI instrument. It accepts several connections,
+        answers the queries and receives the definite length blocks.
+
+        Every block received is recorded in blocks as (command, size, sha1 of
+        the data), and its data in data when keep_data is True.
+        '*OPC?' answers '1', ':SYST:ERR?' answers '0, no error' and every
+        other query answers '0'.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, keep_data=False, rate=None):
+        """
+            Input:
+                - host (str): address of the server.
+                - port (int): port of the server, 0 for any free port.
+                - keep_data (bool): keep the data of the blocks.
+                - rate (float): throughput of the simulated instrument in
+                  MB/s, unlimited if None.
+        """
+
+        self.keep_data = keep_data
+        self.rate      = rate
+        self.blocks    = []
+        self.data      = []
+        self.commands  = []
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((host, port))
+        self._socket.listen(4)
+        self._socket.settimeout(0.1)
+        self.address = self._socket.getsockname()
+
+        self._thread = threading.Thread(target=self._accept)
+        self._thread.daemon = True
+        self._workers = []
+
+
+
+    def start(self):
+
+        self._thread.start()
+        return self
+
+
+
+    def stop(self):
+
+        self._stop.set()
+        self._thread.join()
+        for worker in self._workers:
+            worker.join()
+        self._socket.close()
+
+
+
+    def _accept(self):
+
+        while not self._stop.is_set():
+            try:
+                connection, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            worker = threading.Thread(target=self._serve, args=(connection,))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+
+
+    def _serve(self, connection):
+
+        connection.settimeout(0.1)
+        connection.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4*1024**2)
+        client = _Client(connection)
+        try:
+            while True:
+                line = self._read_command(client)
+                if line is None:
+                    break
+                for command in line.split(';'):
+                    self._execute(client, command.strip())
+        finally:
+            connection.close()
+
+
+
+    def _recv(self, client):
+        """
+            Append the next bytes received to the buffer of client, False
+            when the connection is closed or the server stopped.
+        """
+
+        while not self._stop.is_set():
+            try:
+                data = client.connection.recv(1024**2)
+            except socket.timeout:
+                continue
+            if not data:
+                return False
+            client.received += data
+            return True
+        return False
+
+
+
+    def _read_exactly(self, client, size):
+
+        while len(client.received) < size:
+            if not self._recv(client):
+                return None
+        data = client.received[:size]
+        del client.received[:size]
+        return data
+
+
+
+    def _read_command(self, client):
+        """
+            Read a command line, receive the block it holds if any.
+        """
+
+        while True:
+            newline = client.received.find('\n')
+            block   = client.received.find('#')
+            if block >= 0 and (newline < 0 or block < newline):
+                break
+            if newline >= 0:
+                line = str(client.received[:newline]).rstrip('\r')
+                del client.received[:newline + 1]
+                return line
+            if not self._recv(client):
+                return None
+
+        # Definite length block: #<number of digits><size><data>
+        msg = str(client.received[:block]).strip()
+        del client.received[:block + 1]
+        digits = self._read_exactly(client, 1)
+        if digits is None:
+            return None
+        size = self._read_exactly(client, int(str(digits)))
+        if size is None:
+            return None
+        size = int(str(size))
+
+        start = time.time()
+        data = self._read_exactly(client, size)
+        if data is None:
+            return None
+        if self.rate is not None:
+            time.sleep(max(0., size/1e6/self.rate - (time.time() - start)))
+
+        with self._lock:
+            self.blocks.append((msg, size, hashlib.sha1(data).hexdigest()))
+            if self.keep_data:
+                self.data.append(bytes(data))
+
+        # The termination of the block, and any command following it
+        rest = self._read_command(client)
+        return rest if rest is not None else ''
+
+
+
+    def _execute(self, client, command):
+
+        if not command:
+            return
+
+        with self._lock:
+            self.commands.append(command)
+
+        if command.endswith('?'):
+            if command.upper() == '*OPC?':
+                answer = '1'
+            elif command.upper().lstrip(':') == 'SYST:ERR?':
+                answer = '0, no error'
+            else:
+                answer = '0'
+            client.connection.sendall(answer + '\n')
+
+
+
+class _Client(object):
+    """
+        Connection to a BlockServer and the bytes received but not read yet.
+    """
+
+    def __init__(self, connection):
+
+        self.connection = connection
+        self.received   = bytearray()
+
+
+
+def benchmark(sizes=(2**20, 2**23, 2**26), repeat=3, rate=None):
+    """
+        Measure the throughput of SocketTransport to a local BlockServer.
+
+        Input:
+            - sizes (tuple): sizes of the blocks in bytes.
+            - repeat (int): number of transfers per size, the best is kept.
+            - rate (float): throughput of the simulated instrument in MB/s.
+
+        Output:
+            - results (dict): {size : {'MBps' : MB/s, 'chunk' : last chunk
+              size}} with size as a str.
+    """
+
+    server = BlockServer(rate=rate).start()
+    transport = SocketTransport(*server.address)
+    results = {}
+    try:
+        for size in sizes:
+            data = np.random.RandomState(0).randint(0, 2**14, size//2).astype(np.uint16)
+            best = None
+            for i in range(repeat):
+                start = time.time()
+                transfer = transport.write_block(':TRAC:DATA', data)
+                # The transfer is complete once the server answers
+                transport.query('*OPC?')
+                throughput = size/1e6/(time.time() - start)
+                if best is None or throughput > best['MBps']:
+                    best = {'MBps' : throughput, 'chunk' : transfer['chunk']}
+            if server.blocks[-1][2] != hashlib.sha1(data).hexdigest():
+                raise ValueError('The block of %d bytes was corrupted' % size)
+            results[str(size)] = best
+    finally:
+        transport.close()
+        server.stop()
+
+    return results
+
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+        Return the description of the sizes of results slower than their
+        baseline by more than threshold.
+    """
+
+    regressions = []
+    for size, result in sorted(results.items()):
+        if size in baseline and\
+           result['MBps'] < baseline[size]['MBps']*(1. - threshold):
+            regressions.append('%s bytes: %f MB per sec instead of %f' %\
+                               (size, result['MBps'], baseline[size]['MBps']))
+    return regressions
+
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmark of the SCPI socket transport.')
+    parser.add_argument('--size', type=int, action='append',
+                        help='size of the blocks in bytes, 1, 8 and 64 MiB by default')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--rate', type=float,
+                        help='throughput of the simulated instrument in MB/s')
+    parser.add_argument('--baseline',
+                        help='json file of the results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative regression tolerated')
+    parser.add_argument('--save',
+                        help='json file in which the results are saved')
+    options = parser.parse_args(argv)
+
+    sizes = options.size or (2**20, 2**23, 2**26)
+    results = benchmark(sizes, options.repeat, options.rate)
+
+    for size, result in sorted(results.items(), key=lambda item: int(item[0])):
+        print '%12s bytes %10.1f MB/s, chunk of %d bytes' % (size, result['MBps'], result['chunk'])
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare(results, json.load(f), options.threshold)
+
+        if regressions:
+            print 'Regressions:'
+            for regression in regressions:
+                print regression
+            return 1
+
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
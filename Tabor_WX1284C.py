@@ -21,15 +21,18 @@ import visa
 import types
 import logging
 import numpy as np
-import struct
 import pyvisa.constants as vc
 import ctypes
+import hashlib
+import contextlib
+import time
+import SCPI_socket
 
 ################### Constants
 
 MARKER_QUANTUM = 2        #: quantum of marker-length and marker-offset
-_EX_DAT_MARKER_1_MASK = 0x20000000L #: the mask of marker 1 in the extra-data (32-bits) value
-_EX_DAT_MARKER_2_MASK = 0x10000000L #: the mask of marker 2 in the extra-data (32-bits) value
+SEGMENT_QUANTUM = 16      #: quantum of segment-length
+SEGMENT_MIN_LENGTH = 192  #: minimum segment-length
 _EX_DAT_M2_MASK_NICO = 0x8000
 _EX_DAT_M1_MASK_NICO = 0x4000
 octet = 8
@@ -37,6 +40,15 @@ number_of_bits = 16
 
 Channels=(1,2,3,4)
 Mark_num = (1,2)
+
+# Settings shared by all the channels while they are coupled, see _common_key
+COUPLED_SETTINGS = ('RUN:MODE', 'TRIG:SOUR:ADV', 'TRIG:MODE', 'TRIG:TIM:MODE',
+                    'TRIG:TIM:TIME', 'TRIG:LEV', 'SEQ:ADV', 'SEQ:JUMP')
+
+# Step of a sequence table, as read by the device: uint32 loops, uint16
+# segment number, uint8 jump flag and a pad byte, in little-endian
+SEQ_STEP_DTYPE = np.dtype([('loops', '<u4'), ('segment', '<u2'),
+                           ('jump', 'u1'), ('pad', 'u1')])
 ###### Useful functions
 def _engineer_to_scienc(value):
         '''
@@ -51,6 +63,135 @@ def _engineer_to_scienc(value):
         multipliers = {'n':1e-9,'u':1e-6,'m':1e-3,'k': 1e3, 'M': 1e6, 'G': 1e9}
         return int(float(value[:-1])*multipliers[value[-1]])
 
+def sequence_table(segments, loops=1, jump=0):
+        '''
+        Builds a sequence table, one step per segment.
+
+        Input:
+            segments (int array): segment number of each step
+            loops (int or int array): number of loops of each step
+            jump (int or int array): jump flag of each step
+
+        Output:
+            table (SEQ_STEP_DTYPE array): steps of the sequence
+        '''
+        segments, loops, jump = np.broadcast_arrays(np.atleast_1d(segments), loops, jump)
+
+        table = np.zeros(len(segments), dtype=SEQ_STEP_DTYPE)
+        table['segment'] = segments
+        table['loops'] = loops
+        table['jump'] = jump
+        return table
+
+def tile_sequence(table, repetitions):
+        '''
+        Repeats a sequence table, e.g. for an averaging pattern.
+
+        Input:
+            table (SEQ_STEP_DTYPE array): steps of the pattern
+            repetitions (int): number of times the pattern is played
+
+        Output:
+            table (SEQ_STEP_DTYPE array): steps of the sequence
+        '''
+        return np.tile(as_sequence_table(table), repetitions)
+
+def interleave_sequences(*tables):
+        '''
+        Interleaves sequence tables of the same length step by step:
+        the first step of each table, then the second one of each table, ...
+
+        Input:
+            tables (SEQ_STEP_DTYPE arrays): tables to interleave
+
+        Output:
+            table (SEQ_STEP_DTYPE array): steps of the sequence
+        '''
+        tables = [as_sequence_table(table) for table in tables]
+        if len(set(len(table) for table in tables)) > 1:
+            raise ValueError('The sequence tables to interleave should have the same length')
+
+        table = np.empty(len(tables)*len(tables[0]), dtype=SEQ_STEP_DTYPE)
+        for i, steps in enumerate(tables):
+            table[i::len(tables)] = steps
+        return table
+
+def as_sequence_table(buffer):
+        '''
+        Converts a sequence formated as [[loop,segment#,jump_flag],...] into
+        a sequence table, a sequence table being returned as it is.
+
+        Input:
+            buffer: 2D array of the sequence or SEQ_STEP_DTYPE array
+
+        Output:
+            table (SEQ_STEP_DTYPE array): steps of the sequence
+        '''
+        if isinstance(buffer, np.ndarray) and buffer.dtype == SEQ_STEP_DTYPE:
+            return buffer
+
+        buffer = np.asarray(buffer).reshape(-1, 3)
+        return sequence_table(buffer[:,1], buffer[:,0], buffer[:,2])
+
+class CoalescingSession(object):
+    '''
+    Wraps the visa session of the instrument.
+    While coalescing, the commands written are kept and sent as
+    semicolon-joined strings at the next read, query or binary transfer, or
+    at the next flush. Every other attribute is the one of the session.
+    '''
+
+    def __init__(self, session, max_length=4000):
+        '''
+        Input:
+            session: the visa session of the instrument
+            max_length (int): maximum length of a joined command string
+        '''
+        # coalesced counts the commands sent joined
+        self.__dict__.update(_session=session, _pending=[], coalescing=0,
+                             max_length=max_length, coalesced=0)
+
+    def write(self, command):
+        '''
+        Writes command, or keeps it until the next flush while coalescing.
+        '''
+        if self.coalescing:
+            self._pending.append(command)
+        else:
+            self.flush()
+            return self._session.write(command)
+
+    def flush(self):
+        '''
+        Sends the pending commands.
+        '''
+        pending, self._pending = self._pending, []
+        self.coalesced += len(pending)
+
+        line = ''
+        for command in pending:
+            # After a semicolon, a header without colon is relative to the
+            # previous one
+            if not command.startswith((':', '*')):
+                command = ':' + command
+            if line and len(line) + len(command) >= self.max_length:
+                self._session.write(line)
+                line = ''
+            line = command if not line else line + ';' + command
+        if line:
+            self._session.write(line)
+
+    def __getattr__(self, name):
+        self.flush()
+        return getattr(self._session, name)
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__:
+            self.__dict__[name] = value
+        else:
+            self.flush()
+            setattr(self._session, name, value)
+
 class Tabor_WX1284C(Instrument):
     '''
     This is the python driver for the Tabor WX1284C
@@ -68,7 +209,7 @@ class Tabor_WX1284C(Instrument):
     make the string formatting uniform
     '''
 
-    def __init__(self, name, address, reset=False):
+    def __init__(self, name, address, reset=False, socket_transport=False):
         '''
         Initializes the Tabor_WX1284C.
 
@@ -76,6 +217,8 @@ class Tabor_WX1284C(Instrument):
             name (string)    : name of the instrument
             address (string) :  address
             reset (bool)     : resets to default values, default=false
+            socket_transport (bool) : sends the binary data through a direct
+                                      TCP connection, see use_socket_transport
 
         Output:
             None
@@ -196,6 +339,35 @@ class Tabor_WX1284C(Instrument):
         self.add_function('delete_segments')
         self.add_function('delete_segment_i')
         self.add_function('segment_select')
+        self.add_function('upload_waveform')
+        self.add_function('send_waveforms')
+        self.add_function('invalidate_waveform_cache')
+        self.add_function('add_segment_table_listener')
+        self.add_function('invalidate_state')
+        self.add_function('resync_state')
+        self.add_function('use_socket_transport')
+        self.add_function('last_transfer')
+
+        # Content of the segments in the awg memory, see upload_waveform
+        # {ch_id: {hash: seg_id}} and {ch_id: {seg_id: hash}}. The channels
+        # 1-2 and 3-4 share their segment table, a segment defined or deleted
+        # through a channel is forgotten on both channels of its pair.
+        self._waveform_cache = dict((ch, {}) for ch in Channels)
+        self._segment_hashes = dict((ch, {}) for ch in Channels)
+
+        # Called with the channel when its segment table is replaced, see
+        # send_waveforms and add_segment_table_listener
+        self._segment_table_listeners = []
+
+        # Last known settings of the instrument, see _apply
+        # {header: value} for the selected channel 'INST:SEL', and
+        # {(header, ch_id): value} for the settings of a channel
+        self._state = {}
+
+        # Direct TCP transport of the binary data, see use_socket_transport,
+        # and statistics of the last binary transfer
+        self._transport = None
+        self._last_transfer = None
 
         #opening the visa session #############################################
         self.clean_visa_open()
@@ -204,6 +376,9 @@ class Tabor_WX1284C(Instrument):
             self.reset()
             self.clear_err()
 
+        if socket_transport:
+            self.use_socket_transport()
+
         self.get_all()
 
     # Functions ###############################################################
@@ -224,6 +399,7 @@ class Tabor_WX1284C(Instrument):
         for i in [1,2,3,4]:
             self.channel_select(i)
             self._visainstrument.write(':TRAC:DEL:ALL')
+        self.invalidate_waveform_cache()
 
     def delete_segment_i(self, i):
         '''
@@ -239,19 +415,19 @@ class Tabor_WX1284C(Instrument):
             None
         '''
         logging.info(__name__ + ' : Deleting some of the waveform memory')
-        if len(i) == 1:
-            for ch in Channels:
-                self.channel_select(ch)
-                self._visainstrument.write(':TRAC:DEL {}'.format(i))
-        elif len(i) > 1:
-            for ch in Channels:
-                self.channel_select(ch)
-                for j in i:
-                    self._visainstrument.write(':TRAC:DEL {}'.format(j))
-
-        else:
+        segments = [int(j) for j in np.atleast_1d(i)]
+        if len(segments) == 0:
             print 'problem with len(i) '
 
+        for ch in Channels:
+            self.channel_select(ch)
+            for j in segments:
+                self._visainstrument.write(':TRAC:DEL {}'.format(j))
+
+        for ch in Channels:
+            for j in segments:
+                self._forget_segment(ch, j)
+
     def clean_visa_open(self):
         '''
         Opens a visa session with the proper parameters
@@ -286,7 +462,8 @@ class Tabor_WX1284C(Instrument):
 
             inst.clear()
 
-            self._visainstrument = inst
+            self._visainstrument = CoalescingSession(inst)
+            self.invalidate_state()
 
             logging.debug(__name__ + ' : visa session opened correctly')
 
@@ -306,6 +483,8 @@ class Tabor_WX1284C(Instrument):
         '''
         logging.info(__name__ + ' : Resetting instrument')
         self._visainstrument.write('*RST')
+        self.invalidate_waveform_cache()
+        self.invalidate_state()
 
     def clear_err(self):
         '''
@@ -320,6 +499,154 @@ class Tabor_WX1284C(Instrument):
         logging.info(__name__ + ' : Clearing error queue of the instrument')
         self._visainstrument.write('*CLS')
 
+    def invalidate_state(self):
+        '''
+        Forgets the last known settings of the instrument. To be called when
+        the instrument has been changed without the driver, from the front
+        panel for instance.
+
+        Input:
+            None
+
+        Output:
+            None
+        '''
+        logging.debug(__name__ + ' : Forgetting the state of the instrument')
+        self._state = {}
+
+    def resync_state(self):
+        '''
+        Reads the settings of the instrument again, after a reset or a change
+        from the front panel.
+
+        Input:
+            None
+
+        Output:
+            None
+        '''
+        logging.info(__name__ + ' : Reading the state of the instrument')
+        self.invalidate_state()
+        self._state['INST:SEL'] = int(self._visainstrument.query('INST:SEL?'))
+        self._known('INST:COUP:STAT', 'INST:COUP:STAT ?')
+        self.get_all()
+
+    @contextlib.contextmanager
+    def coalesce(self):
+        '''
+        Context in which the settings are not read back and the commands are
+        sent as semicolon-joined strings. The error queue of the instrument is
+        checked at the end instead.
+
+        Usage:
+            with awg.coalesce():
+                awg.set_trigger_source('EVEN')
+                awg.set_ch1_output('ON')
+        '''
+        session = self._visainstrument
+        coalesced = session.coalesced
+        session.coalescing += 1
+        try:
+            yield
+        finally:
+            session.coalescing -= 1
+            if not session.coalescing:
+                session.flush()
+
+        if not session.coalescing and session.coalesced != coalesced:
+            error = session.query(':SYST:ERR?')
+            if not error.startswith('0'):
+                self.invalidate_state()
+                logging.warning(__name__ + ' : error while setting the instrument: ' + error)
+                raise ValueError('The instrument returned the error {} while being set.'.format(error))
+
+    def _verify(self):
+        '''
+        Returns True if the settings should be read back after being written,
+        which is not done while coalescing.
+        '''
+        return not self._visainstrument.coalescing
+
+    def _channel_key(self, header):
+        '''
+        Returns the key in the state of the setting header of the selected
+        channel, None if the selected channel is unknown.
+        '''
+        ch_id = self._state.get('INST:SEL')
+        if ch_id is None:
+            return None
+        return (header, ch_id)
+
+    def _pair_key(self, header):
+        '''
+        Returns the key in the state of the setting header of the channel
+        pair of the selected channel, as the markers, None if the selected
+        channel is unknown.
+        '''
+        ch_id = self._state.get('INST:SEL')
+        if ch_id is None:
+            return None
+        return (header, self._channel_pair(ch_id)[0])
+
+    def _common_key(self, header):
+        '''
+        Returns the key in the state of a setting of COUPLED_SETTINGS: common
+        to all the channels while they are coupled, of the selected channel
+        otherwise. None if the coupling is unknown.
+        '''
+        coupled = self._state.get('INST:COUP:STAT')
+        if coupled == 'ON':
+            return (header, 'COUP')
+        elif coupled == 'OFF':
+            return self._channel_key(header)
+        return None
+
+    def _forget_coupled_settings(self):
+        '''
+        Removes the settings of COUPLED_SETTINGS from the state, their scope
+        changing with the coupling of the channels.
+        '''
+        for key in list(self._state):
+            if isinstance(key, tuple) and key[0] in COUPLED_SETTINGS:
+                del self._state[key]
+
+    def _apply(self, key, value, command):
+        '''
+        Writes command, which sets the setting key to value, unless the
+        instrument is known to be in this state already.
+
+        Input:
+            key: key of the setting in the state, None if it is not tracked
+            value: value of the setting
+            command (string): command to write
+
+        Output:
+            written (bool): False if the command was redundant
+        '''
+        if key is not None and self._state.get(key) == value:
+            return False
+
+        self._state.pop(key, None)
+        self._visainstrument.write(command)
+        if key is not None:
+            self._state[key] = value
+        return True
+
+    def _known(self, key, command, convert=None):
+        '''
+        Returns the last known value of the setting key, queries it with
+        command when it is unknown.
+        '''
+        if key is not None and key in self._state:
+            return self._state[key]
+
+        value = self._visainstrument.query(command)
+        if convert is not None:
+            value = convert(value)
+        if key is not None:
+            self._state[key] = value
+        return value
+
     def get_all(self):
         '''
         Reads all implemented parameters from the instrument,
@@ -381,9 +708,9 @@ class Tabor_WX1284C(Instrument):
         # Select channel
         self.channel_select(channel)
         # Set it to 'User-Mode'
-        self._visainstrument.write(":FUNC:MODE USER")
+        self._apply(self._channel_key('FUNC:MODE'), 'USER', ':FUNC:MODE USER')
         # Set markers-type to 'user-defined' (external)
-        self._visainstrument.write(":SOUR:MARK:SOUR USER")
+        self._apply(self._pair_key('MARK:SOUR'), 'USER', ':SOUR:MARK:SOUR USER')
 
     def set_all_amp(self, amp):
         '''
@@ -421,6 +748,7 @@ class Tabor_WX1284C(Instrument):
         '''
         Sets the active waveform segment seg_id at the output connector ch_id
         and then download the waveform data buffer to the WX2184C waveform memory.
+        Nothing is downloaded if the segment already holds this buffer.
         Inputs:
             buffer: the binary data buffer.
             ch_id (int): channel index. Valid values are 1, 2, 3 and 4.
@@ -428,24 +756,207 @@ class Tabor_WX1284C(Instrument):
         Output:
             visa-error-code
         '''
+        # The segment already holds this waveform, nothing to transfer
+        wvf_hash = self.waveform_hash(buffer)
+        if self._segment_hashes[ch_id].get(seg_id) == wvf_hash:
+            logging.debug(__name__ + ' : segment {} of channel {} already up to date'.format(seg_id, ch_id))
+            return 0
+
         #self._visainstrument.write('TRAC:MODE SING')
-        self.channel_select(ch_id)
-        self._visainstrument.write(':TRAC:SEL {}'.format(seg_id))
+        self.segment_select(ch_id, seg_id)
         self._visainstrument.write(':TRAC:DEF {},{}'.format(seg_id,len(buffer)))
         err_code = self.download_binary_data(":TRAC:DATA",  buffer, len(buffer) * buffer.itemsize)
+
+        self._forget_segment(ch_id, seg_id)
+        if err_code >= 0:
+            self._waveform_cache[ch_id][wvf_hash] = seg_id
+            self._segment_hashes[ch_id][seg_id] = wvf_hash
+
         return err_code
 
+    def send_waveforms(self, buffers, ch_id, first_seg_id, lengths=None, replace_table=False):
+        '''
+        Downloads several waveforms in consecutive segments of the channel
+        ch_id with a single binary transfer, in the combined trace mode.
+        The segments are defined in a single command string, the other
+        segments of the channel being kept. With replace_table, they are
+        defined by downloading the segment table instead, which deletes all
+        the other segments of the channel pair; the listeners added by
+        add_segment_table_listener are then called.
+        The data is not copied if it is already contiguous, so that segments
+        rendered in a memory-mapped file (numpy.memmap) are read from the disk
+        during the transfer without being loaded in memory.
+
+        Inputs:
+            buffers: 2D array of the waveforms, one per row, or list of 1D
+                     arrays, or 1D array of the concatenated waveforms with
+                     their lengths.
+            ch_id (int): channel index. Valid values are 1, 2, 3 and 4.
+            first_seg_id (int): segment index of the first waveform, the
+                                following ones go in the next segments.
+            lengths (list): lengths of the waveforms when buffers is a 1D
+                            array.
+            replace_table (bool): replace the segment table, first_seg_id
+                                  must then be 1.
+        Output:
+            visa-error-code
+        '''
+        if lengths is not None:
+            data = np.asarray(buffers)
+            lengths = [int(length) for length in lengths]
+            if data.ndim != 1 or sum(lengths) != len(data):
+                raise ValueError('The lengths should sum up to the length of the 1D buffers')
+        elif isinstance(buffers, np.ndarray) and buffers.ndim == 2:
+            data = buffers.reshape(-1) if buffers.flags.c_contiguous else buffers.ravel()
+            lengths = [buffers.shape[1]]*buffers.shape[0]
+        else:
+            buffers = [np.asarray(buffer) for buffer in buffers]
+            data = np.concatenate(buffers)
+            lengths = [len(buffer) for buffer in buffers]
+
+        if not lengths:
+            return 0
+        if data.dtype != np.uint16:
+            raise ValueError('The waveforms should be uint16, not {}'.format(data.dtype))
+        if not data.flags.c_contiguous:
+            data = np.ascontiguousarray(data)
+        for length in lengths:
+            if length < SEGMENT_MIN_LENGTH or length % SEGMENT_QUANTUM:
+                raise ValueError('The length of a segment should be a multiple of {} of at least {}, not {}'.format(SEGMENT_QUANTUM, SEGMENT_MIN_LENGTH, length))
+        if first_seg_id < 1 or first_seg_id + len(lengths) - 1 > 32000:
+            raise ValueError('The segments should be between 1 and 32 000')
+        if replace_table and first_seg_id != 1:
+            raise ValueError('The segment table can only be replaced from the segment 1')
+
+        self.channel_select(ch_id)
+
+        if replace_table:
+            table = np.array(lengths, dtype='uint32')
+            err_code = self.download_binary_data(':SEGM:DATA', table, table.nbytes)
+            if err_code < 0:
+                return err_code
+            self.invalidate_waveform_cache(ch_id)
+            for listener in self._segment_table_listeners:
+                listener(ch_id)
+        else:
+            self._visainstrument.write(';'.join(':TRAC:DEF {},{}'.format(first_seg_id + i, length)
+                                                for i, length in enumerate(lengths)))
+
+        self._visainstrument.write(':TRAC:MODE COMB;:TRAC:SEL {}'.format(first_seg_id))
+        self._state[('TRAC:SEL', ch_id)] = first_seg_id
+        err_code = self.download_binary_data(':TRAC:DATA', data, data.nbytes)
+        self._visainstrument.write(':TRAC:MODE SING')
+
+        offsets = np.cumsum([0] + lengths)
+        for i in range(len(lengths)):
+            seg_id = first_seg_id + i
+            self._forget_segment(ch_id, seg_id)
+            if err_code >= 0:
+                wvf_hash = self.waveform_hash(data[offsets[i]:offsets[i + 1]])
+                self._waveform_cache[ch_id][wvf_hash] = seg_id
+                self._segment_hashes[ch_id][seg_id] = wvf_hash
+
+        return err_code
+
+    def upload_waveform(self, buffer, ch_id, seg_id):
+        '''
+        Makes sure that the waveform data buffer is in the memory of the channel
+        ch_id and returns the segment holding it.
+        If a segment of the channel already holds exactly the same data, markers
+        included, its index is returned and nothing is transferred. Otherwise
+        the buffer is downloaded in the segment seg_id.
+        The sequences should then be built with the returned index.
+
+        Inputs:
+            buffer: the binary data buffer.
+            ch_id (int): channel index. Valid values are 1, 2, 3 and 4.
+            seg_id (int): segment index used if the waveform is not yet in the
+                          memory. Between 1 and 32 000.
+        Output:
+            seg_id (int): index of the segment holding the waveform.
+        '''
+        cached_id = self.cached_segment(buffer, ch_id)
+        if cached_id is not None:
+            logging.debug(__name__ + ' : waveform already in segment {} of channel {}'.format(cached_id, ch_id))
+            return cached_id
+
+        err_code = self.send_waveform(buffer, ch_id, seg_id)
+        if err_code < 0:
+            raise ValueError('The segment {} of channel {} could not be downloaded, error-code=0x{:x}'.format(seg_id, ch_id, err_code))
+
+        return seg_id
+
+    def add_segment_table_listener(self, listener):
+        '''
+        Adds a function called with the channel index when the segment table
+        of a channel is replaced by send_waveforms, so that the segments
+        known outside of the driver can be forgotten.
+        '''
+        if listener not in self._segment_table_listeners:
+            self._segment_table_listeners.append(listener)
+
+    def cached_segment(self, buffer, ch_id):
+        '''
+        Returns the segment of the channel ch_id already holding the waveform
+        data buffer, None if there is none.
+        '''
+        return self._waveform_cache[ch_id].get(self.waveform_hash(buffer))
+
+    def invalidate_waveform_cache(self, ch_id=None):
+        '''
+        Forgets the content of the segments, so that the next waveforms are
+        downloaded again.
+        To be used if the waveform memory has been modified without this
+        driver (front panel, other software, power cycle...).
+
+        Input:
+            ch_id (int): channel index, all the channels by default. The
+                         other channel of its pair is forgotten as well.
+
+        Output:
+            None
+        '''
+        for ch in (Channels if ch_id is None else self._channel_pair(ch_id)):
+            self._waveform_cache[ch] = {}
+            self._segment_hashes[ch] = {}
+
+    def waveform_hash(self, buffer):
+        '''
+        Returns the hash identifying the content of a waveform data buffer.
+        '''
+        buffer = np.ascontiguousarray(buffer)
+        return hashlib.sha1(buffer.dtype.str + buffer.tostring()).hexdigest()
+
+    def _channel_pair(self, ch_id):
+        '''
+        Returns the two channels sharing the segment table of the channel ch_id.
+        '''
+        first = ch_id - (ch_id - 1) % 2
+        return (first, first + 1)
+
+    def _forget_segment(self, ch_id, seg_id):
+        '''
+        Removes the segment seg_id of the channel ch_id, and of the other
+        channel of its pair, from the cache.
+        '''
+        for ch in self._channel_pair(ch_id):
+            wvf_hash = self._segment_hashes[ch].pop(seg_id, None)
+            if self._waveform_cache[ch].get(wvf_hash) == seg_id:
+                del self._waveform_cache[ch][wvf_hash]
+
     def segment_select(self,ch_id,seg_id):
         '''
         Sets the active segment seg_id at the output connector ch_id
         '''
         self.channel_select(ch_id)
-        self._visainstrument.write(':TRAC:SEL {}'.format(seg_id))
+        self._apply(('TRAC:SEL', ch_id), seg_id, ':TRAC:SEL {}'.format(seg_id))
 
     def inquir(self,command):
         return self._visainstrument.query(command)
 
     def Write(self,command):
+        # The command may change any setting
+        self.invalidate_state()
         self._visainstrument.write(command)
 
     #Parameters ###############################################################
@@ -521,7 +1032,7 @@ class Tabor_WX1284C(Instrument):
             Function mode (string) : 'FIX','USER','SEQ','ASEQ','MOD','PULS','PATT' depending on the mode
         '''
         logging.info( '{} : Getting the function mode'.format(__name__))
-        return self._visainstrument.query('FUNC:MODE?')
+        return self._known(self._channel_key('FUNC:MODE'), 'FUNC:MODE?')
 
     def do_set_func_mode(self,value='SEQ'):
         '''
@@ -535,9 +1046,11 @@ class Tabor_WX1284C(Instrument):
         '''
         logging.info( '{} : Setting the output function mode to {}'.format(__name__,value))
         if value.upper() in ('FIX','USER','SEQ','ASEQ','MOD','PULS','PATT'):
-            self._visainstrument.write('FUNC:MODE {}'.format(value))
-            if self._visainstrument.query('FUNC:MODE?') != value:
-                logging.info('Instrument did not select the output function correctly')
+            key = self._channel_key('FUNC:MODE')
+            if self._apply(key, value.upper(), 'FUNC:MODE {}'.format(value)) and self._verify():
+                if self._visainstrument.query('FUNC:MODE?') != value:
+                    self._state.pop(key, None)
+                    logging.info('Instrument did not select the output function correctly')
         else:
             logging.info('The invalid value {} was sent to func_mode method'.format(value))
 
@@ -554,12 +1067,19 @@ class Tabor_WX1284C(Instrument):
             Trigger mode (string): 'CONT', 'TRIG', 'GATE' depending on the mode
         '''
         logging.info( '{} : Getting the run mode'.format(__name__))
+        key = self._common_key('RUN:MODE')
+        if key in self._state:
+            return self._state[key]
+
         if self._visainstrument.query('INIT:CONT?') == 'ON':
-            return 'CONT'
+            value = 'CONT'
         elif self._visainstrument.query('INIT:GATE?') == 'ON':
-            return 'GATE'
+            value = 'GATE'
         else:
-            return 'TRIG'
+            value = 'TRIG'
+        if key is not None:
+            self._state[key] = value
+        return value
 
     def do_set_run_mode(self, value='TRIG'):
         '''
@@ -572,14 +1092,19 @@ class Tabor_WX1284C(Instrument):
             None
         '''
         logging.info( '{} : Setting the run mode to {}'.format(__name__,value))
+        key = self._common_key('RUN:MODE')
+        if key is not None and self._state.get(key) == value.upper():
+            return
+        self._state.pop(key, None)
+
         if value.upper() == 'CONT':
             self._visainstrument.write('INIT:CONT ON')
-            if self._visainstrument.query('INIT:CONT?') != 'ON':
+            if self._verify() and self._visainstrument.query('INIT:CONT?') != 'ON':
                 logging.info('Run mode wasn\'t set properly')
         elif value.upper() == 'TRIG':
             self._visainstrument.write('INIT:CONT OFF')
             # self._visainstrument.write('INIT:GATE OFF')
-            if self._visainstrument.query('INIT:CONT?') != 'OFF':
+            if self._verify() and self._visainstrument.query('INIT:CONT?') != 'OFF':
                 logging.info('Run mode wasn\'t set properly')
             # elif self._visainstrument.query('INIT:GATE?') != 'OFF':
             #     logging.info('Run mode wasn\'t set properly')
@@ -588,12 +1113,15 @@ class Tabor_WX1284C(Instrument):
             self._visainstrument.write('INIT:GATE ON')
             # if self._visainstrument.query('INIT:CONT?') != 'OFF':
             #     logging.info('Run mode wasn\'t set properly')
-            if self._visainstrument.query('INIT:GATE?') != 'ON':
+            if self._verify() and self._visainstrument.query('INIT:GATE?') != 'ON':
                 logging.info('Run mode wasn\'t set properly')
         else:
             logging.info('The invalid value {} was sent to set_run_mode method'.format(value))
             raise ValueError('The invalid value {} was sent to set_run_mode method. Valid values are \'CONT\', \'TRIG\', \'GATE\'.'.format(value))
 
+        if key is not None:
+            self._state[key] = value.upper()
+
     def do_get_trigger_source(self):
         '''
         Get the trigger source of the instrument
@@ -606,7 +1134,7 @@ class Tabor_WX1284C(Instrument):
         '''
 
         logging.info( '{} : Getting the trigger source')
-        return self._visainstrument.query(':TRIG:SOUR:ADV?')
+        return self._known(self._common_key('TRIG:SOUR:ADV'), ':TRIG:SOUR:ADV?')
 
     def do_set_trigger_source(self, value='TIM'):
         '''
@@ -625,12 +1153,12 @@ class Tabor_WX1284C(Instrument):
         '''
 
         logging.info( '{} : Setting the trigger source to {}'.format(__name__,value))
-        self._visainstrument.write(':TRIG:SOUR:ADV '+str(value.upper()))
-
-        if self._visainstrument.query(':TRIG:SOUR:ADV?') != value.upper():
-
-            logging.info('Trigger source was not set properly')
-            raise ValueError('Trigger source was not set properly')
+        key = self._common_key('TRIG:SOUR:ADV')
+        if self._apply(key, value.upper(), ':TRIG:SOUR:ADV '+str(value.upper())) and self._verify():
+            if self._visainstrument.query(':TRIG:SOUR:ADV?') != value.upper():
+                self._state.pop(key, None)
+                logging.info('Trigger source was not set properly')
+                raise ValueError('Trigger source was not set properly')
 
     def do_get_trigger_mode(self):
         '''
@@ -644,7 +1172,7 @@ class Tabor_WX1284C(Instrument):
         '''
 
         logging.info( '{} : Getting the trigger mode')
-        return self._visainstrument.query(':TRIG:MODE?')
+        return self._known(self._common_key('TRIG:MODE'), ':TRIG:MODE?')
 
     def do_set_trigger_mode(self, value='NORM'):
         '''
@@ -663,12 +1191,12 @@ class Tabor_WX1284C(Instrument):
         '''
 
         logging.info( '{} : Setting the trigger mode to {}'.format(__name__,value))
-        self._visainstrument.write(':TRIG:MODE '+str(value.upper()))
-
-        if self._visainstrument.query(':TRIG:MODE?') != value.upper():
-
-            logging.info('Trigger mode was not set properly')
-            raise ValueError('Trigger mode was not set properly')
+        key = self._common_key('TRIG:MODE')
+        if self._apply(key, value.upper(), ':TRIG:MODE '+str(value.upper())) and self._verify():
+            if self._visainstrument.query(':TRIG:MODE?') != value.upper():
+                self._state.pop(key, None)
+                logging.info('Trigger mode was not set properly')
+                raise ValueError('Trigger mode was not set properly')
 
     def do_get_trigger_timer_mode(self):
         '''
@@ -682,7 +1210,7 @@ class Tabor_WX1284C(Instrument):
         '''
 
         logging.info( '{} : Getting the trigger timer mode')
-        return self._visainstrument.query(':TRIG:TIM:MODE?')
+        return self._known(self._common_key('TRIG:TIM:MODE'), ':TRIG:TIM:MODE?')
 
     def do_set_trigger_timer_mode(self, value='TIME'):
         '''
@@ -702,12 +1230,12 @@ class Tabor_WX1284C(Instrument):
         '''
 
         logging.info( '{} : Setting the trigger timer mode to {}'.format(__name__,value))
-        self._visainstrument.write(':TRIG:TIM:MODE '+str(value.upper()))
-
-        if self._visainstrument.query(':TRIG:TIM:MODE?') != value.upper():
-
-            logging.info('Trigger timer mode was not set properly')
-            raise ValueError('Trigger timer mode was not set properly')
+        key = self._common_key('TRIG:TIM:MODE')
+        if self._apply(key, value.upper(), ':TRIG:TIM:MODE '+str(value.upper())) and self._verify():
+            if self._visainstrument.query(':TRIG:TIM:MODE?') != value.upper():
+                self._state.pop(key, None)
+                logging.info('Trigger timer mode was not set properly')
+                raise ValueError('Trigger timer mode was not set properly')
 
     def do_get_trigger_timer_time(self):
         '''
@@ -721,7 +1249,8 @@ class Tabor_WX1284C(Instrument):
         '''
 
         logging.info( '{} : Getting the trigger timer time')
-        return float(self._visainstrument.query(':TRIG:TIM:TIME?'))*1e6
+        return self._known(self._common_key('TRIG:TIM:TIME'), ':TRIG:TIM:TIME?',
+                           lambda answer: float(answer)*1e6)
 
     def do_set_trigger_timer_time(self, period):
         '''
@@ -740,11 +1269,12 @@ class Tabor_WX1284C(Instrument):
         '''
 
         logging.info( '{} : Setting the trigger timer time to {}'.format(__name__,period))
-        self._visainstrument.write(':TRIG:TIM:TIME '+str(period*1e-6))
-
-        if round(float(self._visainstrument.query(':TRIG:TIM:TIME?'))*1e6,0) != round(period,0):
-            logging.info('Trigger timer time was not set properly')
-            raise ValueError('Trigger timer time was not set properly')
+        key = self._common_key('TRIG:TIM:TIME')
+        if self._apply(key, period, ':TRIG:TIM:TIME '+str(period*1e-6)) and self._verify():
+            if round(float(self._visainstrument.query(':TRIG:TIM:TIME?'))*1e6,0) != round(period,0):
+                self._state.pop(key, None)
+                logging.info('Trigger timer time was not set properly')
+                raise ValueError('Trigger timer time was not set properly')
 
 
 
@@ -764,9 +1294,10 @@ class Tabor_WX1284C(Instrument):
 
         self.channel_select(channel)
         if state in ('ON','OFF'):
-            self._visainstrument.write('OUTP{}'.format(state))
-            if self._visainstrument.query('OUTP?') != state:
-                logging.info('ON/OFF wasn\'t set properly')
+            if self._apply(('OUTP', channel), state, 'OUTP{}'.format(state)) and self._verify():
+                if self._visainstrument.query('OUTP?') != state:
+                    self._state.pop(('OUTP', channel), None)
+                    logging.info('ON/OFF wasn\'t set properly')
         else:
             logging.info('The invalid state {} was sent to set_output'.format(state))
             raise ValueError('The invalid state {} was sent to set_output. Valid values are \'ON\' or \'OFF\'.'.format(state))
@@ -785,7 +1316,7 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+' : Getting the output state of channel %s'%( channel))
 
         self.channel_select(channel)
-        return self._visainstrument.query('OUTP?')
+        return self._known(('OUTP', channel), 'OUTP?')
 
     def do_get_coupling(self, channel=1):
         '''
@@ -801,7 +1332,7 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Getting the coupling of channel %s' % channel)
 
         self.channel_select(channel)
-        return self._visainstrument.query('OUTP:COUP ?')
+        return self._known(('OUTP:COUP', channel), 'OUTP:COUP ?')
 
     def do_set_coupling(self, coupling='DC', channel=1):
         '''
@@ -820,9 +1351,12 @@ class Tabor_WX1284C(Instrument):
         self.channel_select(channel)
 
         if coupling in ('DC','HV'):
-            self._visainstrument.write('OUTP:COUP %s'% coupling)
-            if self._visainstrument.query('OUTP:COUP ?') != coupling:
-                logging.info('DC/HV wasn\'t set properly')
+            if self._apply(('OUTP:COUP', channel), coupling, 'OUTP:COUP %s'% coupling):
+                # The amplitude depends on the coupling
+                self._state.pop(('VOLT:AMPL', channel), None)
+                if self._verify() and self._visainstrument.query('OUTP:COUP ?') != coupling:
+                    self._state.pop(('OUTP:COUP', channel), None)
+                    logging.info('DC/HV wasn\'t set properly')
         else:
             logging.info('The invalid coupling {} was sent to set_coupling'.format(coupling))
             raise ValueError('The invalid coupling {} was sent to set_coupling. Valid values are \'DC\' or \'HV\'.'.format(coupling))
@@ -971,13 +1505,13 @@ class Tabor_WX1284C(Instrument):
 
         self.channel_select(channel)
         if self.do_get_coupling(channel) == 'HV':
-            self._visainstrument.write('VOLT:AMPL:HV %s'% amp)
-            if self._visainstrument.query('VOLT:AMPL:HV ?') != amp:
-                logging.info('The amplitude wasn\'t set properly')
+            if self._apply(('VOLT:AMPL', channel), amp, 'VOLT:AMPL:HV %s'% amp) and self._verify():
+                if self._visainstrument.query('VOLT:AMPL:HV ?') != amp:
+                    logging.info('The amplitude wasn\'t set properly')
         else:
-            self._visainstrument.write('VOLT:AMPL:DC %s'% amp)
-            if self._visainstrument.query('VOLT:AMPL:DC ?') != amp:
-                logging.info('The amplitude wasn\'t set properly')
+            if self._apply(('VOLT:AMPL', channel), amp, 'VOLT:AMPL:DC %s'% amp) and self._verify():
+                if self._visainstrument.query('VOLT:AMPL:DC ?') != amp:
+                    logging.info('The amplitude wasn\'t set properly')
 
     def do_get_amplitude(self, channel):
         '''
@@ -993,9 +1527,9 @@ class Tabor_WX1284C(Instrument):
 
         self.channel_select(channel)
         if self.do_get_coupling(channel) == 'HV':
-            return self._visainstrument.query('VOLT:AMPL:HV ?')
+            return self._known(('VOLT:AMPL', channel), 'VOLT:AMPL:HV ?', float)
         else:
-            return self._visainstrument.query('VOLT:AMPL ?')
+            return self._known(('VOLT:AMPL', channel), 'VOLT:AMPL ?', float)
 
     def do_set_offset(self, offset, channel=1):
         '''
@@ -1036,11 +1570,12 @@ class Tabor_WX1284C(Instrument):
             None
         '''
         logging.info( __name__+ ': Setting the trigger level to %s.' % trig_val)
-        self._visainstrument.write('TRIG:LEV %s' % trig_val)
-
-        if float(self._visainstrument.query('TRIG:LEV ?')) != trig_val:
-            logging.info('The trigger level wasn\'t set properly')
-            raise ValueError('The trigger level wasn\'t set properly to set_trigger_level. Valid value are between -5 and 5.')
+        key = self._common_key('TRIG:LEV')
+        if self._apply(key, trig_val, 'TRIG:LEV %s' % trig_val) and self._verify():
+            if float(self._visainstrument.query('TRIG:LEV ?')) != trig_val:
+                self._state.pop(key, None)
+                logging.info('The trigger level wasn\'t set properly')
+                raise ValueError('The trigger level wasn\'t set properly to set_trigger_level. Valid value are between -5 and 5.')
 
     def do_get_trigger_level(self):
         '''
@@ -1051,7 +1586,7 @@ class Tabor_WX1284C(Instrument):
             trig_val (float): the trigger level in V
         '''
         logging.info( __name__+ ': Getting the trigger level.' )
-        return self._visainstrument.query('TRIG:LEV ?')
+        return self._known(self._common_key('TRIG:LEV'), 'TRIG:LEV ?', float)
 
     def do_set_marker_source(self, source='WAVE'):
         '''
@@ -1069,11 +1604,12 @@ class Tabor_WX1284C(Instrument):
             None
         '''
         logging.info( __name__+ ': Setting the marker source to %s.' % source)
-        self._visainstrument.write('MARK:SOUR %s' % source)
-
-        if self._visainstrument.query('MARK:SOUR?') != source.upper():
-            logging.info('The marker source wasn\'t set properly')
-            raise ValueError('The marker source wasn\'t set properly to set_marker_source. Valid value are \'WAVE\', \'USER\'.')
+        key = self._pair_key('MARK:SOUR')
+        if self._apply(key, source.upper(), 'MARK:SOUR %s' % source) and self._verify():
+            if self._visainstrument.query('MARK:SOUR?') != source.upper():
+                self._state.pop(key, None)
+                logging.info('The marker source wasn\'t set properly')
+                raise ValueError('The marker source wasn\'t set properly to set_marker_source. Valid value are \'WAVE\', \'USER\'.')
 
     def do_get_marker_source(self):
         '''
@@ -1085,7 +1621,7 @@ class Tabor_WX1284C(Instrument):
             source (string): 'WAVE', 'USER'
         '''
         logging.info( __name__+ ': Getting the marker source.' )
-        return self._visainstrument.query('MARK:SOUR?')
+        return self._known(self._pair_key('MARK:SOUR'), 'MARK:SOUR?')
 
     def do_get_marker_status_1_2(self, channel=1):
         '''
@@ -1098,19 +1634,16 @@ class Tabor_WX1284C(Instrument):
 
         logging.info( __name__+ ': Getting the marker status of the marker %s of the channel 1 or 2.' % (channel))
 
-        if self._visainstrument.query('INST:SEL?') not in (1, 2):
+        if self._state.get('INST:SEL') not in (1, 2):
             self.channel_select(1)
 
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for this marker. Valid values are 1,2.')
 
 
-        return self._visainstrument.query('MARK:STAT ?')
+        return self._known(self._pair_key('MARK{0:d}:STAT'.format(channel)), 'MARK:STAT ?')
 
     def do_set_marker_status_1_2(self, status, channel=1):
         '''
@@ -1126,20 +1659,19 @@ class Tabor_WX1284C(Instrument):
         # if self._visainstrument.query('INST:SEL?') not in (1,2):
         #     logging.info('Channel 1 or 2  was not selected before hand')
         #     raise ValueError('Channel 1 or 2  was not selected before hand.')
-        if self._visainstrument.query('INST:SEL?') not in (1,2):
+        if self._state.get('INST:SEL') not in (1,2):
             self.channel_select(1)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for this marker. Valid values are 1,2.')
 
-        self._visainstrument.write('MARK:STAT %s' % status)
-        if self._visainstrument.query('MARK:STAT ?') != status:
-            logging.info('The instrument didn\'t set properly the status %s' % status)
-            raise ValueError('The instrument  didn\'t set properly the status %s by set_marker_status' % status)
+        key = self._pair_key('MARK{0:d}:STAT'.format(channel))
+        if self._apply(key, status, 'MARK:STAT %s' % status) and self._verify():
+            if self._visainstrument.query('MARK:STAT ?') != status:
+                self._state.pop(key, None)
+                logging.info('The instrument didn\'t set properly the status %s' % status)
+                raise ValueError('The instrument  didn\'t set properly the status %s by set_marker_status' % status)
 
     def do_get_marker_status_3_4(self, channel=1):
         '''
@@ -1152,19 +1684,15 @@ class Tabor_WX1284C(Instrument):
 
         logging.info( __name__+ ': Getting the marker status of the marker %s of the channel 3 and 4.' % (channel))
 
-        if self._visainstrument.query('INST:SEL?') not in (3, 4):
+        if self._state.get('INST:SEL') not in (3, 4):
             self.channel_select(3)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for this marker. Valid values are 1, 2.')
 
 
-        return self._visainstrument.query('MARK:STAT ?')
+        return self._known(self._pair_key('MARK{0:d}:STAT'.format(channel)), 'MARK:STAT ?')
 
     def do_set_marker_status_3_4(self, status, channel=1):
         '''
@@ -1178,22 +1706,21 @@ class Tabor_WX1284C(Instrument):
 
         logging.info( __name__+ ': Setting the marker status of the marker %s of the channel 3 and 4 to the status %s.' % (channel, status))
 
-        if self._visainstrument.query('INST:SEL?') not in (3, 4):
+        if self._state.get('INST:SEL') not in (3, 4):
             self.channel_select(3)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for this marker. Valid values are 1, 2.')
 
-        self._visainstrument.write('MARK:STAT %s' % status )
-        print status
-        print self._visainstrument.query('MARK:STAT ?')
-        if self._visainstrument.query('MARK:STAT ?') != status:
-            logging.info('The instrument didn\'t set properly the status %s' % status)
-            raise ValueError('The instrument  didn\'t set properly the status %s by set_marker_status' % status)
+        key = self._pair_key('MARK{0:d}:STAT'.format(channel))
+        if self._apply(key, status, 'MARK:STAT %s' % status) and self._verify():
+            print status
+            print self._visainstrument.query('MARK:STAT ?')
+            if self._visainstrument.query('MARK:STAT ?') != status:
+                self._state.pop(key, None)
+                logging.info('The instrument didn\'t set properly the status %s' % status)
+                raise ValueError('The instrument  didn\'t set properly the status %s by set_marker_status' % status)
 
     def do_get_marker_high_1_2(self, channel=1):
         '''
@@ -1206,19 +1733,15 @@ class Tabor_WX1284C(Instrument):
 
         logging.info( __name__+ ': Getting the marker high level of the marker %s of the channel 1 or 2.' % (channel))
 
-        if self._visainstrument.query('INST:SEL?') not in (1, 2):
+        if self._state.get('INST:SEL') not in (1, 2):
             self.channel_select(1)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 1,2.')
 
 
-        return self._visainstrument.query('MARK:VOLT:HIGH?')
+        return self._known(self._pair_key('MARK{0:d}:VOLT:HIGH'.format(channel)), 'MARK:VOLT:HIGH?', float)
 
     def do_set_marker_high_1_2(self, high_level, channel=1):
         '''
@@ -1234,21 +1757,19 @@ class Tabor_WX1284C(Instrument):
 
 
 
-        if self._visainstrument.query('INST:SEL?') not in (1,2):
+        if self._state.get('INST:SEL') not in (1,2):
             self.channel_select(1)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 1,2.')
 
-        self._visainstrument.write('MARK:VOLT:HIGH %s' % high_level)
-        if np.float(self._visainstrument.query('MARK:VOLT:HIGH?')) != high_level:
-            logging.info('The instrument didn\'t set properly the high_level %s' % high_level)
-            raise ValueError('The instrument  didn\'t set properly the high_level %s by set_marker_high' % high_level)
+        key = self._pair_key('MARK{0:d}:VOLT:HIGH'.format(channel))
+        if self._apply(key, high_level, 'MARK:VOLT:HIGH %s' % high_level) and self._verify():
+            if np.float(self._visainstrument.query('MARK:VOLT:HIGH?')) != high_level:
+                self._state.pop(key, None)
+                logging.info('The instrument didn\'t set properly the high_level %s' % high_level)
+                raise ValueError('The instrument  didn\'t set properly the high_level %s by set_marker_high' % high_level)
 
     def do_get_marker_high_3_4(self, channel=1):
         '''
@@ -1261,19 +1782,15 @@ class Tabor_WX1284C(Instrument):
 
         logging.info( __name__+ ': Getting the marker high level of the marker %s of the channel 3_4.' % (channel))
 
-        if self._visainstrument.query('INST:SEL?') not in (3, 4):
+        if self._state.get('INST:SEL') not in (3, 4):
             self.channel_select(3)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 3, 4.')
 
 
-        return self._visainstrument.query('MARK:VOLT:HIGH?')
+        return self._known(self._pair_key('MARK{0:d}:VOLT:HIGH'.format(channel)), 'MARK:VOLT:HIGH?', float)
 
     def do_set_marker_high_3_4(self, high_level, channel=1):
         '''
@@ -1288,21 +1805,19 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Setting the marker high level of the marker %s of the channel 3_4 to %s.' % (channel, high_level))
 
 
-        if self._visainstrument.query('INST:SEL?') not in (3,4):
+        if self._state.get('INST:SEL') not in (3,4):
             self.channel_select(3)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 1, 2.')
 
-        self._visainstrument.write('MARK:VOLT:HIGH %s' % high_level)
-        if np.float(self._visainstrument.query('MARK:VOLT:HIGH ?')) != high_level:
-            logging.info('The instrument didn\'t set properly the high_level %s' % high_level)
-            raise ValueError('The instrument  didn\'t set properly the high_level %s by set_marker_high' % high_level)
+        key = self._pair_key('MARK{0:d}:VOLT:HIGH'.format(channel))
+        if self._apply(key, high_level, 'MARK:VOLT:HIGH %s' % high_level) and self._verify():
+            if np.float(self._visainstrument.query('MARK:VOLT:HIGH ?')) != high_level:
+                self._state.pop(key, None)
+                logging.info('The instrument didn\'t set properly the high_level %s' % high_level)
+                raise ValueError('The instrument  didn\'t set properly the high_level %s by set_marker_high' % high_level)
 
     def do_get_marker_position_1_2(self, channel=1):
         '''
@@ -1318,14 +1833,10 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Getting the marker position of the marker %s of the channel 1_2.' % (channel))
 
 
-        if self._visainstrument.query('INST:SEL?') not in (1,2):
+        if self._state.get('INST:SEL') not in (1,2):
             self.channel_select(2)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 1, 2.')
 
@@ -1347,14 +1858,10 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Setting the marker position of the marker %s of the channel 1_2.' % (channel))
 
 
-        if self._visainstrument.query('INST:SEL?') not in (1,2):
+        if self._state.get('INST:SEL') not in (1,2):
             self.channel_select(1)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 1, 2.')
 
@@ -1378,14 +1885,10 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Getting the marker position of the marker %s of the channel 1_2.' % (channel))
 
 
-        if self._visainstrument.query('INST:SEL?') not in (3,4):
+        if self._state.get('INST:SEL') not in (3,4):
             self.channel_select(3)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 3, 4.')
 
@@ -1407,14 +1910,10 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Setting the marker position of the marker %s of the channel 3_4.' % (channel))
 
 
-        if self._visainstrument.query('INST:SEL?') not in (3,4):
+        if self._state.get('INST:SEL') not in (3,4):
             self.channel_select(3)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 1, 2.')
 
@@ -1443,14 +1942,10 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Setting the marker width of the marker %s of the channel 1_2.' % (channel))
 
 
-        if self._visainstrument.query('INST:SEL?') not in (1,2):
+        if self._state.get('INST:SEL') not in (1,2):
             self.channel_select(1)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 1, 2.')
 
@@ -1480,14 +1975,10 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Setting the marker width of the marker %s of the channel 1_2.' % (channel))
 
 
-        if self._visainstrument.query('INST:SEL?') not in (1,2):
+        if self._state.get('INST:SEL') not in (1,2):
             self.channel_select(1)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 1, 2.')
 
@@ -1514,14 +2005,10 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Setting the marker width of the marker %s of the channel 3_4.' % (channel))
 
 
-        if self._visainstrument.query('INST:SEL?') not in (3,4):
+        if self._state.get('INST:SEL') not in (3,4):
             self.channel_select(3)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 1, 2.')
 
@@ -1550,14 +2037,10 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Setting the marker width of the marker %s of the channel 3_4.' % (channel))
 
 
-        if self._visainstrument.query('INST:SEL?') not in (3,4):
+        if self._state.get('INST:SEL') not in (3,4):
             self.channel_select(3)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 3, 4.')
 
@@ -1577,14 +2060,10 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Setting the marker delay of the marker %s of the channel 1_2.' % (channel))
 
 
-        if self._visainstrument.query('INST:SEL?') not in (1,2):
+        if self._state.get('INST:SEL') not in (1,2):
             self.channel_select(1)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 1, 2.')
 
@@ -1604,14 +2083,10 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Setting the marker delay of the marker %s of the channel 1_2.' % (channel))
 
 
-        if self._visainstrument.query('INST:SEL?') not in (1,2):
+        if self._state.get('INST:SEL') not in (1,2):
             self.channel_select(1)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 1, 2.')
 
@@ -1634,14 +2109,10 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Setting the marker delay of the marker %s of the channel 3_4.' % (channel))
 
 
-        if self._visainstrument.query('INST:SEL?') not in (3,4):
+        if self._state.get('INST:SEL') not in (3,4):
             self.channel_select(3)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 3, 4.')
 
@@ -1664,14 +2135,10 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Setting the marker delay of the marker %s of the channel 3_4.' % (channel))
 
 
-        if self._visainstrument.query('INST:SEL?') not in (3,4):
+        if self._state.get('INST:SEL') not in (3,4):
             self.channel_select(3)
         if channel in Mark_num:
-            self._visainstrument.write('MARK:SEL{0:d}'.format(channel))
-
-            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(channel):
-                logging.info('Instrument did not select the marker correctly')
-                raise ValueError('The marker {0:d} was not properly selected.'.format(channel))
+            self._marker_select(channel)
         else:
             logging.info('Wrong number of the channel for the marker. Valid values are 3, 4.')
 
@@ -1721,11 +2188,13 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+ ': Setting the couple state of the synchronized channels')
 
         if synchronised.upper() in ('ON', 'OFF'):
-            self._visainstrument.write('INST:COUP:STAT %s' % synchronised.upper())
-
-            if self._visainstrument.query('INST:COUP:STAT ?') != synchronised.upper():
-                logging.info('Instrument did not synchronise the channels')
-                raise ValueError('Instrument did not synchronise the channels')
+            if self._state.get('INST:COUP:STAT') != synchronised.upper():
+                self._forget_coupled_settings()
+            if self._apply('INST:COUP:STAT', synchronised.upper(), 'INST:COUP:STAT %s' % synchronised.upper()) and self._verify():
+                if self._visainstrument.query('INST:COUP:STAT ?') != synchronised.upper():
+                    self._state.pop('INST:COUP:STAT', None)
+                    logging.info('Instrument did not synchronise the channels')
+                    raise ValueError('Instrument did not synchronise the channels')
         else:
             logging.info('The invalid value %s was sent to set_channels_synchronisation' % synchronised.upper())
             raise ValueError('The invalid value %s was sent to set_channels_synchronisation. Valid values are \'ON\' or \'OFF\'.' % synchronised.upper())
@@ -1739,7 +2208,7 @@ class Tabor_WX1284C(Instrument):
             (integer): returns '0' if synchronisation is OFF and '1' if synchronisation is 'ON'
         '''
         logging.info( __name__+ ': Getting the couple state of the synchronisation')
-        return self._visainstrument.query('INST:COUP:STAT ?')
+        return self._known('INST:COUP:STAT', 'INST:COUP:STAT ?')
 
     def channel_select(self,ch_id):
         """
@@ -1750,14 +2219,85 @@ class Tabor_WX1284C(Instrument):
             None
         """
         if ch_id in Channels:
-            self._visainstrument.write('INST:SEL{}'.format(ch_id))
-            if self._visainstrument.query('INST:SEL?') != '{}'.format(ch_id):
-                print('''Instrument did not select the channel correctly''')
+            if self._apply('INST:SEL', ch_id, 'INST:SEL{}'.format(ch_id)) and self._verify():
+                if self._visainstrument.query('INST:SEL?') != '{}'.format(ch_id):
+                    self._state.pop('INST:SEL')
+                    print('''Instrument did not select the channel correctly''')
         else:
             print('''The invalid value {} was sent to channel_select method''').format(ch_id)
             logging.info('The invalid Channel ID {0:d} was sent to set_amplitude'.format(ch_id))
             raise ValueError('The invalid Channel ID {0:d} was sent to set_amplitude. Valid values are 1,2,3,4.'.format(ch_id))
 
+    def _marker_select(self, marker):
+        '''
+        Selects the marker (1 or 2) of the selected channel.
+        '''
+        key = self._pair_key('MARK:SEL')
+        if self._apply(key, marker, 'MARK:SEL{0:d}'.format(marker)) and self._verify():
+            if self._visainstrument.query('MARK:SEL?') != '{0:d}'.format(marker):
+                self._state.pop(key, None)
+                logging.info('Instrument did not select the marker correctly')
+                raise ValueError('The marker {0:d} was not properly selected.'.format(marker))
+
+    def use_socket_transport(self, enable=True, port=5025):
+        '''
+        Sends the binary data of download_binary_data through a direct TCP
+        connection to the instrument, with chunks adapted to the throughput,
+        instead of the visa session. Only used on LAN.
+
+        Input:
+            enable (bool): True to use the direct connection, False to go back
+                           to the visa session
+            port (int): SCPI port of the instrument
+
+        Output:
+            None
+        '''
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+        if enable:
+            host = self._address.split('::')[1]
+            logging.info(__name__ + ' : Sending the binary data through {}:{}'.format(host, port))
+            self._transport = SCPI_socket.SocketTransport(host, port)
+            self._transport.connect()
+
+    def last_transfer(self):
+        '''
+        Returns the statistics of the last binary transfer.
+
+        Input:
+            None
+
+        Output:
+            transfer (dict): 'transport' ('VISA' or 'SOCKET'), 'bytes',
+                             'seconds' and 'MBps', None before any transfer
+        '''
+        return self._last_transfer
+
+    def _download_socket(self, msg, bin_dat, dat_size):
+        '''
+        Sends the binary data through the direct TCP connection. As it is not
+        the connection of the other commands, the instrument is waited for
+        before and after the block.
+        '''
+        if isinstance(bin_dat, np.ndarray):
+            data = np.ascontiguousarray(bin_dat).view(np.uint8).ravel()[:dat_size]
+        else:
+            data = bin_dat[:dat_size]
+
+        try:
+            self._visainstrument.query('*OPC?')
+            self._transport.write_block(msg, data)
+            self._transport.query('*OPC?')
+        except (IOError, OSError) as error:
+            logging.warning(__name__ + ' : socket transfer failed: {}'.format(error))
+            self._transport.close()
+            return -1
+
+        return 0
+
     def download_binary_data(self, msg, bin_dat, dat_size):
         """
         Download binary data to device.
@@ -1774,6 +2314,13 @@ class Tabor_WX1284C(Instrument):
         """
 
         intf_type = self._visainstrument.get_visa_attribute(vc.VI_ATTR_INTF_TYPE)
+        start = time.time()
+
+        if self._transport is not None and intf_type == vc.VI_INTF_TCPIP:
+            err_code = self._download_socket(msg, bin_dat, dat_size)
+            self._record_transfer('SOCKET', dat_size, start, err_code)
+            return err_code
+
         if intf_type == vc.VI_INTF_GPIB:
             _ = self._visainstrument.write("*OPC?")
             for _ in range(2000):
@@ -1824,175 +2371,37 @@ class Tabor_WX1284C(Instrument):
         if err_code < 0:
             print "Failed to write binary-data. error-code=0x{0:x}".format(err_code)
 
+        self._record_transfer('VISA', dat_size, start, err_code)
         return err_code
 
+    def _record_transfer(self, transport, dat_size, start, err_code):
+        '''
+        Keeps the statistics of a binary transfer started at start.
+        '''
+        if err_code < 0:
+            return
+        elapsed = time.time() - start
+        self._last_transfer = {'transport' : transport,
+                               'bytes'     : dat_size,
+                               'seconds'   : elapsed,
+                               'MBps'      : dat_size/1e6/max(elapsed, 1e-9)}
+        logging.debug(__name__ + ' : {} bytes sent in {:.3f} s, {:.1f} MB/s'.format(dat_size, elapsed, self._last_transfer['MBps']))
+
     def add_marker_flag(self, marker_idx, start_point, len_in_pts, buffer):
         """
-        Add marker flag to given pulse at the specified time-interval.
+        Add marker flag to given pulse at the specified interval.
         Inputs:
             :param marker_idx: marker index (either 0 or 1)
-            :param start_time: the marker start time
-            :param time_span: the marker time span
+            :param start_point: the marker start point
+            :param len_in_pts: the marker length in points
+            :param buffer: the wave data, modified in place
         Output:
             None
         """
-        marker_idx = int(marker_idx)
-        ex_dat = 0
-        if marker_idx == 0:
-            ex_dat = _EX_DAT_MARKER_1_MASK
-        elif marker_idx == 1:
-            ex_dat = _EX_DAT_MARKER_2_MASK
-        else:
+        if marker_idx not in (0, 1):
             raise TypeError("marker_idx should be either 0 or 1")
 
-        if start_point % MARKER_QUANTUM != 0 or len_in_pts % MARKER_QUANTUM != 0:
-            warnings.warn("the marker-interval was rounded!")
-            start_point = (start_point // MARKER_QUANTUM) * MARKER_QUANTUM
-            len_in_pts = (len_in_pts // MARKER_QUANTUM) * MARKER_QUANTUM
-
-        # intervals = self._normalize_interval(start_point, len_in_pts)
-        intervals= np.arange(start_point,start_point+len_in_pts, MARKER_QUANTUM)
-        self._add_extra_data(ex_dat, intervals)
-
-    def _normalize_interval(self, intrv_start, intrv_len):
-        """Normalize sub-interval of the waveform interval.
-
-        The sub-interval is relative to single-period of the waveform,
-        (but may be offset, so not necessarily contained in the 1st period).
-
-        The returnd normalized-intervals list contains zero or more
-        2-tuples of the form: `(<start_point_index>,<length in points>)`
-        that represent sub-intervals of the duplicated waveform.
-
-        :param intrv_start: the sub-interval start point index.
-        :param intrv_len: the sub-interval length in points.
-        :returns: list of normalized-intervals in the waveform intervals.
-        """
-        if intrv_len >= self.period_len:
-            return [(0, self.period_len * self.num_periods)]
-        if intrv_len < 1:
-            return []
-        intrv_end = intrv_start + intrv_len
-
-        if intrv_start >= 0 and intrv_end <= self.period_len:
-            if self.is_for_run_mode:
-                return [(intrv_start, intrv_len)]
-            else:
-                return [(intrv_start + i * self.period_len, intrv_len)
-                        for i in range(self.num_periods)]
-
-        if self.is_for_run_mode:
-            intrv_start = max(intrv_start, Decimal(0))
-            intrv_end = min(intrv_end, self.period_len * self.num_periods)
-            if intrv_end <= intrv_start:
-                return []
-            return [(intrv_start, intrv_end - intrv_start)]
-
-        idxs = [intrv_start, intrv_end]
-
-        q = intrv_start / self.period_len
-        q = q.to_integral_exact(rounding=ROUND_FLOOR)
-        if not q.is_zero():
-            for i in range(len(idxs)):
-                idxs[i] = idxs[i] - q * self.period_len
-                idxs[i] = idxs[i].to_integral()
-                idxs[i] = max(idxs[i], Decimal(0))
-                idxs[i] = min(idxs[i], self.period_len)
-
-        if idxs[0] == idxs[1]:
-            return []
-
-        if idxs[0] < idxs[1]:
-            return [(idxs[0] + i * self.period_len, idxs[1] - idxs[0])
-                    for i in range(self.num_periods)]
-
-        intervals = []
-        for i in range(self.num_periods):
-            intrv_1 = (i * self.period_len, idxs[1] + i * self.period_len)
-            intrv_2 = (idxs[0] + i * self.period_len, (i + 1) * self.period_len)
-            intervals.append(intrv_1)
-            intervals.append(intrv_2)
-        return intervals
-
-    def _add_extra_data(self, ex_dat, intervals):
-        """
-        Add extra-data to at the specified intervals of the waveform.
-
-        The 'extra-data' is a 32-bits value composed of:
-          - markers-flags (2-bits)
-          - digital-data mask (28-bits)
-          - spare (2-bits)
-
-        The intervals-list consists of zero or more 2-tuples
-        of the form: `(<first_point_index>,<length_in_points>)`
-        that represent normalized intervals in the duplicated waveform.
-
-
-        :param ex_dat: the extra-data (32-bits value)
-        :param intervals: list of sub-intervals in the waveform.
-        """
-        if len(intervals) == 0:
-            return
-
-        ex_dat = self._convert_to_long(ex_dat)
-
-        new_sub_segs = []
-        pos = Decimal(0)
-
-
-        i = 0
-        first_pt = intervals[i][0]
-        last_pt = first_pt + intervals[i][1]
-
-
-        for sub_seg in self._sub_lin_segs:
-            while pos > last_pt and i + 1 < len(intervals):
-                i += 1
-                first_pt = intervals[i][0]
-                last_pt = first_pt + intervals[i][1]
-
-            if (pos + sub_seg.length <= first_pt or pos >= last_pt or first_pt > last_pt):
-                new_sub_segs.append(sub_seg)
-                pos += sub_seg.length
-                continue
-
-            p0 = pos
-            p1 = max(p0, first_pt)
-            p2 = min(p0 + sub_seg.length, last_pt)
-            p3 = p0 + sub_seg.length
-
-            if p1 > p0:
-                new_sub_seg = LinSubSeg(
-                        sub_seg.ext_len,
-                        sub_seg.ext_v0,
-                        sub_seg.ext_v1,
-                        sub_seg.sub_offs,
-                        p1 - p0,
-                        sub_seg.ex_dat)
-                new_sub_segs.append(new_sub_seg)
-
-            new_sub_seg = LinSubSeg(
-                    sub_seg.ext_len,
-                    sub_seg.ext_v0,
-                    sub_seg.ext_v1,
-                    sub_seg.sub_offs + p1 - p0,
-                    p2 - p1,
-                    sub_seg.ex_dat | ex_dat)
-            new_sub_segs.append(new_sub_seg)
-
-            if p3 > p2:
-                new_sub_seg = LinSubSeg(
-                        sub_seg.ext_len,
-                        sub_seg.ext_v0,
-                        sub_seg.ext_v1,
-                        sub_seg.sub_offs + p2 - p0,
-                        p3 - p2,
-                        sub_seg.ex_dat)
-                new_sub_segs.append(new_sub_seg)
-
-            pos += sub_seg.length
-
-        self._sub_lin_segs = new_sub_segs
+        self.add_markers(int(marker_idx) + 1, start_point, len_in_pts, buffer)
 
     def add_markers_mask(self, marker_idx, offset, length, dat_buff):
         """
@@ -2008,34 +2417,92 @@ class Tabor_WX1284C(Instrument):
         Output:
             returns the modified buffer of wave data containing the marker positions
         """
-
-
-        mask = 0
-        # |= takes the hexidecimal value into a decimal value.
-        if marker_idx == 1:
-            mask |= _EX_DAT_M1_MASK_NICO
-        if marker_idx == 2:
-            mask |= _EX_DAT_M2_MASK_NICO
-
-        if mask == 0 or length == 0:
+        if marker_idx not in Mark_num or length == 0:
             print('''Wrong value of marker_idx or length. The marker_idx has to be 1 or 2. length should be superior or egal to 2 ?''')
             # you should verify the assertion on length
             return
-        # % returns the modulo of the division
-        if offset %2 !=0:
-            offset=offset-1
-        if length %2 !=0:
-            length=length-1
 
-        marker_points=length/2 # number of marker points to be programmed as one marker point hase size of 2 wave form points
+        self.add_markers(marker_idx, offset, length, dat_buff)
+        return dat_buff
+
+    def add_markers(self, marker_idx, offsets, lengths, dat_buff, rows=None):
+        """
+        Add the marker marker_idx to the wave data dat_buff, in place, on any
+        number of intervals at once. The marker resolution is two wave points,
+        odd offsets and lengths are rounded down.
+        Inputs:
+            marker_idx (int): index of the marker. Valid values are 1 or 2.
+            offsets (int or array of int): positions of the intervals in wave
+                points.
+            lengths (int or array of int): lengths of the intervals in wave
+                points, broadcast with offsets.
+            dat_buff (array of uint16): wave data, one segment or an array
+                (segments, points) of segments.
+            rows (int or array of int): segment of dat_buff of each interval.
+                By default, every interval is added to every segment.
 
-        for i in range(0, marker_points):
+        Output:
+            None
+        """
+        mask = self._marker_mask(marker_idx)
+        interval, index = self._marker_words(offsets, lengths)
 
-            k=8*(np.int(offset/16)+1)+offset/2 # encodes marker position in the last 8 words of a 16 word data block
-            offset=offset+2
-            dat_buff[k] = mask+dat_buff[k]
+        if len(index) and index.max() >= dat_buff.shape[-1]:
+            raise ValueError('The marker {} goes beyond the {} points of the wave data.'.format(marker_idx, dat_buff.shape[-1]))
 
-        return dat_buff
+        if rows is None:
+            dat_buff[..., index] |= mask
+        else:
+            rows = np.broadcast_arrays(np.atleast_1d(offsets), np.atleast_1d(lengths),
+                                       np.atleast_1d(rows))[2]
+            dat_buff[rows[interval], index] |= mask
+
+    def markers_mask_index(self, marker_idx, offset, length):
+        """
+        Returns the mask of the marker and the indexes of the words of the
+        wave data carrying it, so that the markers can be added to one or
+        several buffers at once with buffer[..., index] |= mask.
+        Inputs:
+            marker_idx (int): index of the marker. Valid values are 1 or 2.
+            offset (int): position of the marker in wave points.
+            length (int): length of the marker in wave points.
+
+        Output:
+            mask (int): bit of the marker in the wave data words.
+            index (array of int): indexes of the words to be masked.
+        """
+        return self._marker_mask(marker_idx), self._marker_words(offset, length)[1]
+
+    def _marker_mask(self, marker_idx):
+        """
+        Returns the bit of the marker marker_idx in the wave data words.
+        """
+        if marker_idx == 1:
+            return _EX_DAT_M1_MASK_NICO
+        elif marker_idx == 2:
+            return _EX_DAT_M2_MASK_NICO
+        raise ValueError('The marker_idx has to be 1 or 2.')
+
+    def _marker_words(self, offsets, lengths):
+        """
+        Returns, for every marker point of the intervals (offsets, lengths),
+        the index of its interval and the index of the wave data word carrying
+        it, sorted by interval then position.
+        """
+        offsets, lengths = np.broadcast_arrays(np.atleast_1d(offsets).astype(np.int64),
+                                               np.atleast_1d(lengths).astype(np.int64))
+
+        # The marker resolution is two wave points
+        offsets = offsets - offsets % MARKER_QUANTUM
+        counts = np.maximum(lengths, 0)//MARKER_QUANTUM
+
+        # Position of each marker point, all the intervals at once
+        interval = np.repeat(np.arange(len(counts)), counts)
+        first = np.cumsum(counts) - counts
+        points = offsets[interval] + MARKER_QUANTUM*(np.arange(counts.sum()) - first[interval])
+
+        # Each marker point is encoded in the last 8 words of a 16 words block
+        return interval, 16*(points//16) + 8 + (points % 16)//2
 
     def seq_mode(self, value='STEP'):
         """
@@ -2043,9 +2510,11 @@ class Tabor_WX1284C(Instrument):
         """
 
         if value in ('AUTO','ONCE','STEP'):
-            self._visainstrument.write('SEQ:ADV{}'.format(value))
-            if self._visainstrument.query('SEQ:ADV?') != value:
-                print('''Instrument did not set correctly the sequence mode''')
+            key = self._common_key('SEQ:ADV')
+            if self._apply(key, value, 'SEQ:ADV{}'.format(value)) and self._verify():
+                if self._visainstrument.query('SEQ:ADV?') != value:
+                    self._state.pop(key, None)
+                    print('''Instrument did not set correctly the sequence mode''')
         else:
             print('''The invalid value {} was sent to seq_mode method''').format(value)
 
@@ -2063,19 +2532,21 @@ class Tabor_WX1284C(Instrument):
         logging.info( __name__+' : Getting the sequence mode setter method')
 
 
-        return self._visainstrument.query('SEQ:ADV?')
+        return self._known(self._common_key('SEQ:ADV'), 'SEQ:ADV?')
 
     def seq_jump_source(self,value='BUS'):
         """
         Sequence jump source setter method: in AUTOmatic and STEPped mode only, a jump signal is required to reach the next step of the sequence.
         This jump can be either a trig (BUS) or being input on the Event input port (EVEN).
         """
-        if self._visainstrument.query('SEQ:ADV?') not in ('AUTO', 'STEP'):
+        if self._known(self._common_key('SEQ:ADV'), 'SEQ:ADV?') not in ('AUTO', 'STEP'):
             raise ValueError('The sequence mode should be in AUTOmatic or in STEPped in order to use the seq_jump_source')
         if value in ('BUS','EVEN'):
-            self._visainstrument.write('SEQ:JUMP{}'.format(value))
-            if self._visainstrument.query('SEQ:JUMP?') !=value:
-                print('''Instrument did not set correctly the sequence jump source''')
+            key = self._common_key('SEQ:JUMP')
+            if self._apply(key, value, 'SEQ:JUMP{}'.format(value)) and self._verify():
+                if self._visainstrument.query('SEQ:JUMP?') !=value:
+                    self._state.pop(key, None)
+                    print('''Instrument did not set correctly the sequence jump source''')
         else:
             print('''The invalid value {} was sent to seq_jump_source method''').format(value)
 
@@ -2094,24 +2565,15 @@ class Tabor_WX1284C(Instrument):
         where n is the number of the first one (i.e. `n = first_seg_nb`).
         Inputs:
             buffer: 2D numpy.array of the sequence formated in the following way [[loop,segment#,jum_flag],[loop,segment#,jum_flag],...]
+                    or a sequence table built by sequence_table
 
         Output:
             m: a `numpy.array` (of bytes) with the wvf's steps-info.
         """
 
 
-        # define packed struct of: uint32, uint16, uint8 and pad byte
-        # (in little-endian bytes order)
-        s = struct.Struct('< L H B x')
-
-        num_steps = len(buffer)
-        s_size = s.size
-
-        m = np.empty(s_size * num_steps, dtype='uint8')
-        jump_flag = 0
-        for i in range(num_steps):
-            s.pack_into(m, i * s_size, buffer[i,0], buffer[i,1], buffer[i,2])
-        return m
+        # The steps are already packed as the device reads them
+        return np.ascontiguousarray(as_sequence_table(buffer)).view(np.uint8)
 
     def send_seq(self,buffer,seq_id):
         """
@@ -2119,12 +2581,13 @@ class Tabor_WX1284C(Instrument):
         Inputs:
             buffer: 2D numpy.array of the sequence formated in the following way
                     [[loop,segment#,jum_flag],[loop,segment#,jum_flag],...]
+                    or a sequence table built by sequence_table
             seq_id (int): the number of the sequence to be loaded. Value between 1 and 1 000.
         Output:
             None
         """
         #select the relevant sequence
-        self._visainstrument.write(":SEQ:SEL {0:d}".format(seq_id))
+        self.sequence_select(seq_id)
         # Create packed binary buffer with the sequence info ..
         buff=self.create_wvf_steps_info_buff(buffer)
         # and download the sequence info ..
@@ -2135,7 +2598,7 @@ class Tabor_WX1284C(Instrument):
         Selects the active sequence seq_id
         '''
         #select the relevant sequence
-        self._visainstrument.write(":SEQ:SEL {0:d}".format(seq_id))
+        self._apply(self._channel_key('SEQ:SEL'), seq_id, ":SEQ:SEL {0:d}".format(seq_id))
 
     def query(self, cmd):
         res= self._visainstrument.query(cmd + '?')
@@ -2143,4 +2606,5 @@ class Tabor_WX1284C(Instrument):
         return res
 
     def tell(self, cmd):
+        self.invalidate_state()
         self._visainstrument.write(cmd)
@@ -25,7 +25,41 @@ import visa
 import types
 import logging
 from numpy import pi
-import struct
+import numpy as np
+import hashlib
+
+# Highest code of the 14 bits DAC in the edit memory
+MAX_CODE = 16382
+
+# User memories in which the edit memory can be saved
+USER_SLOTS = ('USER1', 'USER2', 'USER3', 'USER4')
+
+
+def waveform_codes(wave):
+    '''
+    Converts a waveform in V into the codes of the edit memory.
+
+    Input:
+        wave (float[numpoints]) : waveform in V
+
+    Output:
+        codes (uint16[numpoints]) : codes from 0 to MAX_CODE
+        amplitude (float) : peak to peak amplitude of the waveform in V
+        offset (float) : offset of the waveform in V
+    '''
+
+    wave = np.asarray(wave, dtype=np.float64)
+    low = wave.min()
+    high = wave.max()
+    amplitude = high - low
+
+    if amplitude > 0.:
+        codes = np.rint((wave - low)*(MAX_CODE/amplitude))
+    else:
+        codes = np.zeros(len(wave))
+
+    return codes.astype(np.uint16), amplitude, (high + low)/2.
+
 
 class Tektronix_AFG3252(Instrument):
     '''
@@ -73,6 +107,8 @@ class Tektronix_AFG3252(Instrument):
 
 #        self.add_function('get_all')
         self.add_function('reset')
+        self.add_function('set_user_waveform_ch1')
+        self.add_function('invalidate_user_memory')
 
         self.maxpoint = 131072
         self.maxrate = 2e9
@@ -83,6 +119,12 @@ class Tektronix_AFG3252(Instrument):
         self.max_amplitude = 5.
         self.min_amplitude = 0.05
 
+        # Hash of the codes stored in the edit and user memories, None when
+        # unknown. Slots are listed from the least to the most recently used.
+        self._ememory = None
+        self._user_memory = dict((slot, None) for slot in USER_SLOTS)
+        self._user_order = list(USER_SLOTS)
+
         if reset :
 
             self.reset()
@@ -550,6 +592,7 @@ class Tektronix_AFG3252(Instrument):
         '''
         logging.debug(__name__ + ' : Set the transfert of the waveform present in the ememory')
         self._visainstrument.write('trace:copy user1,ememory')
+        self._use_slot('USER1', self._ememory)
 
 
     def set_function_user1_ch1(self):
@@ -708,30 +751,109 @@ class Tektronix_AFG3252(Instrument):
             return 'Errors : The waveform is out of the range.'
 
 
-        #We calculate the amplitude and the offset of the tektro
-        amplitude = max(wave) - min(wave)
-        offset = (max(wave) + min(wave)) / 2
+        #We calculate the amplitude, the offset and the codes of the waveform
+        codes, amplitude, offset = waveform_codes(wave)
 
         #We tune these values
         self.set_amplitude_ch1( amplitude )
         self.set_offset_ch1( offset )
 
-        #We transform all points of the waveforme which are in V in bytes
-        wave_bytes = ''
-        for i in wave:
+        #we prepare the device to be configured
+        self.set_arbitrary_waveform_memory_ch1()
+        self._write_ememory(codes)
 
-            #First we tranform V into bins
-            j = int( ( (i + abs(min(wave)) ) * ( 2**14 - 1 ))/amplitude )
 
-            wave_bytes = wave_bytes + struct.pack('>H', j)
+    def set_user_waveform_ch1(self, wave, slot=None):
+        '''
+        Plays a waveform from a user memory on the channel 1.
+        The shape of the waveform is only sent when no user memory already
+        holds it, the amplitude and the offset being set on the channel.
 
-        #We research the beginning of the message for the tektro
-        number_bytes = int(len(wave))*2
-        number_digits = len(str(number_bytes))
+        Input:
+            wave (float[numpoints]) : waveform in V
+            slot (string) : user memory in which the shape is saved when it
+                            is sent, 'USER1' to 'USER4'. By default the
+                            least recently used one.
 
-        #We create the final message for the device
-        mes = 'trace ememory,#' + str(number_digits) + str(number_bytes) + wave_bytes
+        Output:
+            slot (string) : user memory played on the channel 1
+        '''
+        logging.debug(__name__ + ' : set user waveform')
 
-        #we prepare the device to be configured
-        self.set_arbitrary_waveform_memory_ch1()
-        self._visainstrument.write(mes)
+        if slot is not None:
+            slot = slot.upper()
+            if slot not in USER_SLOTS:
+                raise ValueError('The slot has to be in '+str(USER_SLOTS))
+
+        if len(wave) > self.maxpoint or len(wave) < 2:
+            raise ValueError('The waveform is too long or too short (number of points).')
+
+        codes, amplitude, offset = waveform_codes(wave)
+
+        if amplitude > self.max_amplitude \
+           or abs(offset) + amplitude/2. > self.max_amplitude/2. + self.max_offset:
+            raise ValueError('The waveform is out of the range.')
+
+        digest = hashlib.sha1(codes).hexdigest()
+
+        stored = [name for name in USER_SLOTS if self._user_memory[name] == digest]
+        if stored and slot in (None, stored[0]):
+            slot = stored[0]
+        else:
+            if slot is None:
+                slot = self._user_order[0]
+            if self._user_memory[slot] != digest:
+                if self._ememory != digest:
+                    self._write_ememory(codes)
+                self._visainstrument.write('trace:copy '+slot.lower()+',ememory')
+
+        self._use_slot(slot, digest)
+
+        self.set_amplitude_ch1( amplitude )
+        self.set_offset_ch1( offset )
+        self._visainstrument.write('source1:function '+slot.lower())
+
+        return slot
+
+
+    def invalidate_user_memory(self):
+        '''
+        Forgets the content of the edit and user memories, the next shapes
+        will be sent again. To be used when the memories have been modified
+        from the front panel.
+
+        Input:
+            None
+
+        Output:
+            None
+        '''
+        self._ememory = None
+        self._user_memory = dict((slot, None) for slot in USER_SLOTS)
+
+
+    def _use_slot(self, slot, digest):
+        '''
+        Records that the user memory slot holds the shape digest and was
+        just used.
+        '''
+        self._user_memory[slot] = digest
+        self._user_order.remove(slot)
+        self._user_order.append(slot)
+
+
+    def _write_ememory(self, codes):
+        '''
+        Writes the codes in the edit memory in a single binary block.
+
+        Input:
+            codes (uint16[numpoints]) : codes from 0 to MAX_CODE
+
+        Output:
+            None
+        '''
+        data = np.asarray(codes, dtype='>u2').tostring()
+        size = str(len(data))
+
+        self._visainstrument.write_raw('trace ememory,#'+str(len(size))+size+data+'\n')
+        self._ememory = hashlib.sha1(np.asarray(codes, dtype=np.uint16)).hexdigest()
@@ -0,0 +1,699 @@
+# This Python file uses the following encoding: utf-8
+# pulse_sequence.py description and compilation of AWG pulse sequences
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+    Declarative description of the pulse sequences played by the AWG of
+    virtual_pulsing_instrument, and their compiler.
+
+    A PulseSequence is a list of steps, one step being played at each trigger.
+    A step holds pulses and markers on the logical channels of the
+    instrument ('firsttone', 'secondtone' or 'thirdtone').
+    compile_sequence renders all the steps at once and keeps only the unique
+    segments of each channel, so that idle and readout segments shared by
+    several steps are stored once. The sequence table of each channel then
+    refers to these segments.
+    virtual_pulsing_instrument.load_sequence puts a compiled sequence in the
+    AWG.
+
+    Example, a Rabi sequence:
+
+        sequence = PulseSequence('rabi')
+        for length in lengths:
+            sequence.add_step(
+                pulses=[Pulse('secondtone', 10e-6 - length, length, 0.9, 50e6),
+                        Pulse('firsttone', 10e-6, 2e-6, 0.9, 50e6)],
+                markers=[Marker('firsttone', 1, 10e-6, 50e-9)])
+"""
+
+import sys
+import Queue
+import hashlib
+import weakref
+import threading
+import numpy as np
+
+# Granularity and minimum length of the AWG segments, in samples
+segment_quantum = 16
+segment_min_length = 192
+
+# Coding of the AWG samples, see virtual_pulsing_instrument.volt2bit_2 and
+# Tabor_WX1284C.add_markers_mask
+code_full       = 2. # in volt
+code_resolution = 2**14 - 1
+code_data_mask  = 0x3fff
+code_marker_mask = 0xc000
+
+# Parameters of each shape, in the order of the methods of
+# virtual_pulsing_instrument
+shapes = {'cos'         : ('start', 'duration', 'amplitude', 'frequency'),
+          'cos_phi'     : ('start', 'duration', 'amplitude', 'frequency', 'phase'),
+          'cosGaussian' : ('start', 'duration', 'amplitude', 'frequency', 'nsigma'),
+          'cos_rise'    : ('start', 't_rise', 'duration', 'amplitude', 'frequency'),
+          'cos_plateau' : ('start', 't_rise', 'duration', 'amplitude', 'frequency',
+                           'dutycycle', 'diff_PdB')}
+
+
+
+class Pulse(object):
+    '''
+        Pulse played by a channel during a step.
+    '''
+
+    def __init__(self, channel, start, duration, amplitude, frequency,
+                 phase=0., shape='cos', **options):
+        '''
+            Input:
+                - channel (str): 'firsttone', 'secondtone' or 'thirdtone'.
+                - start (float): in second from the beginning of the segment.
+                - duration (float): in second.
+                - amplitude (float): in volt.
+                - frequency (float): intermediate frequency in hertz.
+                - phase (float): in radian.
+                - shape (str): one of the keys of shapes.
+                - options: the other parameters of the shape, for instance
+                  nsigma for 'cosGaussian'.
+        '''
+
+        # A cosine with a phase is a cos_phi
+        if shape == 'cos' and phase != 0.:
+            shape = 'cos_phi'
+
+        if shape not in shapes:
+            raise ValueError('shape should be in '+str(tuple(shapes.keys())))
+
+        if phase != 0. and 'phase' not in shapes[shape]:
+            raise ValueError('The shape '+shape+' has no phase')
+
+        values = dict(options, start=start, duration=duration,
+                      amplitude=amplitude, frequency=frequency, phase=phase)
+
+        missing = [name for name in shapes[shape] if name not in values]
+        if missing:
+            raise ValueError('The parameters '+str(missing)+' are needed by the shape '+shape)
+
+        self.channel    = channel
+        self.shape      = shape
+        self.parameters = tuple(float(values[name]) for name in shapes[shape])
+        self.stop       = start + duration
+
+
+
+class Marker(object):
+    '''
+        Marker of a channel during a step.
+    '''
+
+    def __init__(self, channel, marker_idx, start, width):
+        '''
+            Input:
+                - channel (str): 'firsttone', 'secondtone' or 'thirdtone'.
+                - marker_idx (int): 1 or 2.
+                - start (float): in second from the beginning of the segment.
+                - width (float): in second.
+        '''
+
+        self.channel    = channel
+        self.marker_idx = marker_idx
+        self.start      = start
+        self.width      = width
+        self.stop       = start + width
+
+
+
+class PulseSequence(object):
+    '''
+        Sequence of steps, one step being played at each trigger.
+    '''
+
+    def __init__(self, name, length=None):
+        '''
+            Input:
+                - name (str): name of the sequence, used for the segmentation
+                  and the sequence numbers of the AWG.
+                - length (float): length of the segments in second. By
+                  default, the end of the last pulse or marker.
+        '''
+
+        self.name   = name
+        self.length = length
+        self.steps  = []
+
+
+
+    def add_step(self, pulses=(), markers=(), loops=1):
+        '''
+            Add a step at the end of the sequence.
+
+            Input:
+                - pulses (list): Pulse played during the step.
+                - markers (list): Marker of the step.
+                - loops (int): number of times the step is repeated.
+
+            Output:
+                - index (int): index of the step.
+        '''
+
+        self.steps.append((list(pulses), list(markers), int(loops)))
+
+        return len(self.steps) - 1
+
+
+
+    def channels(self):
+        '''
+            Return the channels used by the sequence.
+        '''
+
+        return sorted(set(item.channel for pulses, markers, loops in self.steps
+                          for item in pulses + markers))
+
+
+
+class CompiledSequence(object):
+    '''
+        Result of compile_sequence.
+
+        Attributes:
+            - name (str): name of the sequence.
+            - channels (list): channels used by the sequence.
+            - time (np.array): time of the samples of the segments in second.
+            - segments (dict): {channel: list of the unique uint16 segments}
+            - tables (dict): {channel: np.array (steps, 3)} sequence table of
+              the channel, [loops, index in segments[channel], jump flag].
+            - volts (dict): {channel: np.array (steps, samples)} waveforms of
+              the steps in volt.
+            - markers (dict): {channel: np.array (steps, samples)} markers of
+              the steps, 1 when a marker is on.
+    '''
+
+    def __init__(self, name, channels, time):
+
+        self.name     = name
+        self.channels = channels
+        self.time     = time
+        self.segments = {}
+        self.tables   = {}
+        self.volts    = {}
+        self.markers  = {}
+
+
+
+    def nb_segments(self):
+        '''
+            Return the number of segments to be put in the AWG.
+        '''
+
+        return sum(len(segments) for segments in self.segments.values())
+
+
+
+class WaveformPool(object):
+    '''
+        Waveforms shared by the SequenceWaves of an instrument: a waveform is
+        kept once whatever the number of steps and sequences using it, and
+        forgotten when none uses it anymore.
+    '''
+
+    def __init__(self):
+
+        self._waveforms = weakref.WeakValueDictionary()
+
+
+
+    def intern(self, waveform):
+        '''
+            Return the waveform of the pool equal to waveform, waveform itself
+            if there is none.
+        '''
+
+        waveform = np.asarray(waveform)
+        key = hashlib.sha1(waveform.dtype.str + str(waveform.shape)\
+                           + np.ascontiguousarray(waveform).tostring()).hexdigest()
+
+        return self._waveforms.setdefault(key, waveform)
+
+
+
+    def nbytes(self):
+        '''
+            Return the memory held by the waveforms of the pool in byte.
+        '''
+
+        return sum(waveform.nbytes for waveform in self._waveforms.values())
+
+
+
+class WaveformList(object):
+    '''
+        Waveforms of the steps of a channel, interned in a WaveformPool.
+        Behaves as the list of the waveforms.
+    '''
+
+    def __init__(self, pool, waveforms=()):
+
+        self._pool = pool
+        self._waveforms = []
+        self._last = None
+        self._interned = None
+        self.extend(waveforms)
+
+
+
+    def append(self, waveform):
+
+        # A step often reuses the waveform of the previous step
+        if waveform is not self._last:
+            self._last = waveform
+            self._interned = self._pool.intern(waveform)
+        self._waveforms.append(self._interned)
+
+
+
+    def extend(self, waveforms):
+
+        for waveform in waveforms:
+            self.append(waveform)
+
+
+
+    def __len__(self):
+
+        return len(self._waveforms)
+
+
+
+    def __iter__(self):
+
+        return iter(self._waveforms)
+
+
+
+    def __getitem__(self, index):
+
+        return self._waveforms[index]
+
+
+
+class RenderedList(object):
+    '''
+        View of the waveforms in volt, or of the markers, rendered on request
+        from the codes of a WaveformList.
+        A waveform shared by several steps is rendered once per iteration.
+    '''
+
+    def __init__(self, codes, render):
+
+        self._codes  = codes
+        self._render = render
+
+
+
+    def __len__(self):
+
+        return len(self._codes)
+
+
+
+    def __iter__(self):
+
+        rendered = {}
+        for codes in self._codes:
+            if id(codes) not in rendered:
+                rendered[id(codes)] = self._render(codes)
+            yield rendered[id(codes)]
+
+
+
+    def __getitem__(self, index):
+
+        return self._render(self._codes[index])
+
+
+
+def code2volt(codes):
+    '''
+        Return the waveform in volt of AWG codes, markers removed.
+    '''
+
+    return (np.asarray(codes) & code_data_mask)*code_full/code_resolution - code_full/2.
+
+
+
+def code2marker(codes):
+    '''
+        Return 1 where a marker of the AWG codes is on, 0 elsewhere.
+        A marker point lasts two samples and is coded in the last 8 words of
+        its block of 16 words.
+    '''
+
+    codes = np.asarray(codes)
+    words = np.flatnonzero(codes & code_marker_mask)
+    words = words[words % 16 >= 8]
+    offsets = 16*(words//16) + 2*(words % 16 - 8)
+
+    marker = np.zeros(len(codes))
+    marker[offsets[offsets < len(codes)]] = 1.
+    marker[offsets[offsets + 1 < len(codes)] + 1] = 1.
+
+    return marker
+
+
+
+class SequenceWaves(object):
+    '''
+        Waveforms of the steps of a sequence, for each view ('binary',
+        'cosine' or 'marker_trigger') and channel:
+            waves['binary'][ch].append(codes)
+            waves['cosine'][ch]
+        Only the codes sent to the AWG need to be stored, the 'cosine' and
+        'marker_trigger' views are then rendered from them on request.
+        The waveforms are interned in a WaveformPool, so that the memory is
+        proportional to the unique waveforms.
+    '''
+
+    views = ('binary', 'cosine', 'marker_trigger')
+
+    def __init__(self, pool, channels=(1, 2, 3, 4)):
+
+        self._pool  = pool
+        self._views = dict((view, ChannelWaves(self, view, channels))
+                           for view in self.views)
+
+
+
+    def __getitem__(self, view):
+
+        return self._views[view]
+
+
+
+class ChannelWaves(object):
+    '''
+        Waveforms of a view of SequenceWaves, per channel.
+    '''
+
+    _render = {'cosine' : code2volt, 'marker_trigger' : code2marker}
+
+    def __init__(self, waves, view, channels):
+
+        self._waves = waves
+        self._view  = view
+        self._lists = dict((ch, WaveformList(waves._pool)) for ch in channels)
+
+
+
+    def __getitem__(self, ch):
+
+        stored = self._lists[ch]
+        if self._view != 'binary' and not stored:
+            return RenderedList(self._waves['binary']._lists[ch],
+                                self._render[self._view])
+
+        return stored
+
+
+
+    def __setitem__(self, ch, waveforms):
+
+        self._lists[ch] = WaveformList(self._waves._pool, waveforms)
+
+
+
+    def get(self, ch, default=None):
+
+        if ch in self._lists:
+            return self[ch]
+
+        return default
+
+
+
+    def keys(self):
+
+        return self._lists.keys()
+
+
+
+def sequence_samples(sequence, samplerate):
+    '''
+        Return the number of samples of the segments of a sequence.
+    '''
+
+    if sequence.length is not None:
+        samples = int(round(sequence.length*samplerate/segment_quantum))*segment_quantum
+    else:
+        stop = max([item.stop for pulses, markers, loops in sequence.steps
+                    for item in pulses + markers] + [0.])
+        samples = int(np.ceil(stop*samplerate/segment_quantum))*segment_quantum
+
+    return max(samples, segment_min_length)
+
+
+
+def compile_sequence(sequence, renderer, samplerate, block=None, on_segment=None):
+    '''
+        Render all the steps of a sequence and keep the unique segments of each
+        channel.
+
+        Input:
+            - sequence (PulseSequence)
+            - renderer: object with the methods pulses_batch and
+              volt2bit_batch of virtual_pulsing_instrument.
+            - samplerate (float): in sample per second.
+            - block (int): number of steps rendered at once, all by default.
+            - on_segment (callable): called as on_segment(channel, index,
+              codes) as soon as a new unique segment is rendered, so that it
+              can be uploaded while the next blocks are rendered.
+
+        Output:
+            - compiled (CompiledSequence)
+    '''
+
+    if not sequence.steps:
+        raise ValueError('The sequence '+sequence.name+' has no step')
+
+    nb_steps = len(sequence.steps)
+    block = nb_steps if block is None else max(1, int(block))
+    time = np.arange(sequence_samples(sequence, samplerate))/samplerate
+    compiled = CompiledSequence(sequence.name, sequence.channels(), time)
+
+    for channel in compiled.channels:
+
+        # The pulses are rendered per layer: a layer holds the n-th pulse of
+        # a given shape of every step, so that each layer is one vectorized
+        # call per block.
+        pulse_layers  = {}
+        marker_layers = {}
+        for row, (pulses, markers, loops) in enumerate(sequence.steps):
+
+            count = {}
+            for pulse in pulses:
+                if pulse.channel == channel:
+                    key = (pulse.shape, count.get(pulse.shape, 0))
+                    count[pulse.shape] = key[1] + 1
+                    rows, parameters = pulse_layers.setdefault(key, ([], []))
+                    rows.append(row)
+                    parameters.append(pulse.parameters)
+
+            count = {}
+            for marker in markers:
+                if marker.channel == channel:
+                    key = (marker.marker_idx, count.get(marker.marker_idx, 0))
+                    count[marker.marker_idx] = key[1] + 1
+                    starts, widths = marker_layers.setdefault(key, (np.zeros(nb_steps),
+                                                                    np.zeros(nb_steps)))
+                    starts[row] = marker.start
+                    widths[row] = marker.width
+
+        pulse_layers = [(shape, np.array(rows), np.array(parameters))
+                        for (shape, n), (rows, parameters) in sorted(pulse_layers.items())]
+        markers = [(marker_idx, starts, widths) for (marker_idx, n), (starts, widths)
+                   in sorted(marker_layers.items())]
+
+        volt           = np.zeros((nb_steps, len(time)))
+        marker_trigger = np.zeros((nb_steps, len(time)))
+
+        # Identical segments are kept once
+        index    = {}
+        segments = []
+        table    = np.zeros((nb_steps, 3), dtype=int)
+
+        for first in range(0, nb_steps, block):
+            last = min(first + block, nb_steps)
+
+            for shape, rows, parameters in pulse_layers:
+                selected = (rows >= first) & (rows < last)
+                if np.all(selected) and len(rows) == last - first:
+                    renderer.pulses_batch(shape, parameters.T, time, out=volt[first:last])
+                elif np.any(selected):
+                    volt[rows[selected]] += renderer.pulses_batch(shape, parameters[selected].T, time)
+
+            block_markers = [(marker_idx, starts[first:last], widths[first:last])
+                             for marker_idx, starts, widths in markers]
+            codes = renderer.volt2bit_batch(volt[first:last], time, block_markers)
+
+            for marker_idx, starts, widths in block_markers:
+                marker_trigger[first:last][(time[None, :] >= starts[:, None])\
+                                           & (time[None, :] < (starts + widths)[:, None])] = 1.
+
+            for row in range(first, last):
+                segment = codes[row - first]
+                key = hashlib.sha1(segment.tostring()).hexdigest()
+                if key not in index:
+                    index[key] = len(segments)
+                    segments.append(segment)
+                    if on_segment is not None:
+                        on_segment(channel, index[key], segment)
+                table[row] = (sequence.steps[row][2], index[key], 0)
+
+        compiled.segments[channel] = segments
+        compiled.tables[channel]   = table
+        compiled.volts[channel]    = volt
+        compiled.markers[channel]  = marker_trigger
+
+    return compiled
+
+
+
+def pipeline(produce, consume, prefetch=4):
+    '''
+        Run produce in a worker thread while consume handles its items in the
+        calling thread, for instance rendering the next segments while the
+        previous ones are uploaded. At most prefetch items wait between them.
+
+        Input:
+            - produce (callable): called as produce(put), it calls put(item)
+              for each item and returns its result.
+            - consume (callable): called as consume(item) for each item.
+            - prefetch (int): size of the queue between them.
+
+        Output:
+            - result: the result of produce.
+
+        An exception of produce or consume stops both and is raised in the
+        calling thread.
+    '''
+
+    items = Queue.Queue(maxsize=max(1, int(prefetch)))
+    stop  = threading.Event()
+    done  = object()
+    outcome = {}
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+        raise _Stopped()
+
+    def worker():
+        try:
+            outcome['result'] = produce(put)
+        except _Stopped:
+            return
+        except BaseException:
+            outcome['error'] = sys.exc_info()
+        put_final(done)
+
+    def put_final(item):
+        try:
+            put(item)
+        except _Stopped:
+            pass
+
+    thread = threading.Thread(target=worker, name='pipeline')
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            consume(item)
+    finally:
+        stop.set()
+        thread.join()
+
+    if 'error' in outcome:
+        error_type, error, traceback = outcome['error']
+        raise error_type, error, traceback
+
+    return outcome.get('result')
+
+
+
+class _Stopped(Exception):
+    '''
+        Raised in the worker of pipeline when the consumer has stopped.
+    '''
+
+
+
+def envelope(waves, width):
+    '''
+        Return the min/max envelope of consecutive waveforms, decimated to
+        about width points, without concatenating them.
+        The envelope of a waveform appearing several times at the same
+        position in a bin, like a readout shared by all the steps, is computed
+        once.
+
+        Input:
+            - waves (list): arrays played one after the other.
+            - width (int): number of points of the envelope, typically the
+              width of the plot in pixel.
+
+        Output:
+            - index (np.array): index of the first sample of each point.
+            - lower (np.array): minimum of each point.
+            - upper (np.array): maximum of each point.
+    '''
+
+    waves = list(waves)
+    lengths = [len(wave) for wave in waves]
+    total = sum(lengths)
+    step = max(1, -(-total//max(1, width)))
+    nb_points = -(-total//step)
+
+    lower = np.full(nb_points, np.inf)
+    upper = np.full(nb_points, -np.inf)
+
+    known  = {}
+    offset = 0
+    for wave, length in zip(waves, lengths):
+
+        if length:
+            key = (id(wave), offset % step)
+            if key not in known:
+                # Edges of the bins inside the waveform
+                first = -offset % step
+                edges = np.arange(first, length, step)
+                if first:
+                    edges = np.append(0, edges)
+                known[key] = (edges, np.minimum.reduceat(wave, edges),
+                              np.maximum.reduceat(wave, edges))
+
+            edges, minima, maxima = known[key]
+            points = (offset + edges)//step
+            np.minimum.at(lower, points, minima)
+            np.maximum.at(upper, points, maxima)
+
+        offset += length
+
+    return np.arange(nb_points)*step, lower, upper
@@ -38,6 +38,9 @@ class virtual_awg_gaussian_pulse(Instrument):
         self._duration = 50 # In ns
         self._delay    = 50 # In ns
 
+        # Pulses of the prepared sweep {(duration, delay): segment}
+        self._sweep = {}
+
 
         self._awg.set_ref_source('EXT')
         self._awg.set_ref_freq(10)
@@ -100,6 +103,9 @@ class virtual_awg_gaussian_pulse(Instrument):
         self.set_status('OFF')
         self._mwsrc.set_status('ON')
         #Functions
+        self.add_function('prepare_sweep')
+        self.add_function('select_sweep_point')
+        self.add_function('clear_sweep')
         self.get_all()
 
 
@@ -114,29 +120,145 @@ class virtual_awg_gaussian_pulse(Instrument):
         return  np.array(np.round((volt + full/2.)*resolution/full, 0),
                          dtype ='uint16')
 
-    def _gaussian(self):
+    def _gaussians(self, durations, delays):
+        """
+            Return the codes of the gaussian pulses of the given durations and
+            delays, one pulse per row.
+            Only the samples where at least one pulse is non zero are computed.
+        """
 
         scale = 4. # Numbers of sigma
 
         # Get timeline in sample
-        nb_samples = self._awg.get_trigger_timer_time()*self._awg.get_clock_freq()
-        time       = np.arange(nb_samples)#/self._awg.get_clock_freq()*1e-6
+        nb_samples = int(self._awg.get_trigger_timer_time()*self._awg.get_clock_freq())
+
+        durations = np.atleast_1d(np.asarray(durations, dtype=float))
+        delays    = np.atleast_1d(np.asarray(delays, dtype=float))
+
+        # In sample, as np.round rounds half to even as the built-in round of
+        # python 3, the python 2 round is used
+        std = np.array([int(round(duration/scale*self._awg.get_clock_freq()*1e-3, 0))
+                        for duration in durations])[:, None]
+        x0  = np.array([int(round(delay*self._awg.get_clock_freq()*1e-3 + s*scale/2., 0))
+                        for delay, s in zip(delays, std[:, 0])])[:, None]
 
-        # std   = self._duration/scale*1e-9 # In second
-        std = int(round(self._duration/scale*self._awg.get_clock_freq()*1e-3, 0)) # In sample
-        x0  = int(round(self._delay*self._awg.get_clock_freq()*1e-3 + std*scale/2., 0)) # In sample
+        # we keep only 2 sigma of each side
+        start = np.clip(x0 - 2*std, 0, nb_samples)
+        stop  = np.clip(x0 + 2*std, 0, nb_samples)
 
-        # We build the full gaussian
-        gaussian = np.exp(-(time-x0)**2./2./std**2.)
+        waveforms = np.empty((len(std), nb_samples), dtype='uint16')
+        waveforms[:] = self._volt2bit(0.)
 
-        # we truncate the waveform and keep only 2 sigma of each side
-        waveform = np.concatenate((np.zeros(x0-2*std),
-                                   gaussian[x0-2*std:x0+2*std],
-                                   np.zeros(nb_samples - x0 - 2*std)))
+        lo = int(start.min()) if len(std) else 0
+        hi = int(stop.max()) if len(std) else 0
+        if hi > lo:
+            time = np.arange(lo, hi)[None, :]
+            support = (time >= start) & (time < stop)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                gaussian = np.exp(-(time - x0)**2./2./std**2.)
+            waveforms[:, lo:hi] = self._volt2bit(np.where(support, gaussian, 0.))
 
-        waveform = self._volt2bit(waveform)
+        return waveforms
+
+    def _gaussian(self):
+
+        # The pulse may already be in the memory
+        segment = self._sweep.get((self._duration, self._delay))
+        if segment is not None:
+            self._awg.segment_select(self._channel, segment)
+            return
+
+        waveform = self._gaussians(self._duration, self._delay)[0]
         self._awg.send_waveform(waveform, self._channel, 1)
 
+        if self._sweep:
+            self._awg.segment_select(self._channel, 1)
+
+    def prepare_sweep(self, durations, delays=None):
+        '''
+            Put in the awg memory all the pulses of a sweep, each in its own
+            segment after the segment 1. The pulses are rendered and
+            downloaded at once.
+            A point of the sweep is then played by select_sweep_point, or by
+            setting its duration and delay, without any transfer.
+
+            Input:
+                durations (float or array): durations of the pulses [ns]
+                delays (float or array): delays of the pulses [ns], the
+                    current delay by default.
+
+            Output:
+                segments (list): segment of each point of the sweep
+        '''
+
+        if delays is None:
+            delays = self._delay
+        durations, delays = np.broadcast_arrays(np.atleast_1d(durations),
+                                                np.atleast_1d(delays))
+        durations = [float(duration) for duration in durations]
+        delays    = [float(delay) for delay in delays]
+
+        waveforms = self._gaussians(durations, delays)
+
+        # All the pulses in a single transfer
+        self._sweep = {}
+        err_code = self._awg.send_waveforms(waveforms, self._channel, 2)
+        if err_code < 0:
+            raise ValueError('The pulses of the sweep could not be downloaded, error-code=0x{:x}'.format(err_code))
+
+        segments = range(2, len(waveforms) + 2)
+        for duration, delay, segment in zip(durations, delays, segments):
+            self._sweep[(duration, delay)] = segment
+
+        # The awg plays the selected segment
+        self._awg.set_func_mode('USER')
+        self._awg.segment_select(self._channel, self._sweep.get((self._duration, self._delay), 1))
+
+        return segments
+
+    def select_sweep_point(self, duration, delay=None):
+        '''
+            Play a pulse of the prepared sweep.
+
+            Input:
+                duration (float): duration of the pulse [ns]
+                delay (float): delay of the pulse [ns], the current delay by
+                    default.
+
+            Output:
+                None
+        '''
+
+        if delay is None:
+            delay = self._delay
+
+        if (float(duration), float(delay)) not in self._sweep:
+            raise ValueError('The pulse of duration {} ns and delay {} ns is not in the prepared sweep'.format(duration, delay))
+
+        self._duration = float(duration)
+        self._delay    = float(delay)
+        self._awg.segment_select(self._channel, self._sweep[(self._duration, self._delay)])
+
+        self.get_duration()
+        self.get_delay()
+
+    def clear_sweep(self):
+        '''
+            Forget the prepared sweep, the pulses are then uploaded again in
+            the segment 1 at each change.
+
+            Input:
+                None
+
+            Output:
+                None
+        '''
+
+        if self._sweep:
+            self._sweep = {}
+            self._awg.segment_select(self._channel, 1)
+            self._awg.set_func_mode('SEQ')
+
     def get_all(self):
         '''
             Get all parameters of the virtual device
@@ -5,6 +5,9 @@ import numpy
 import types
 import logging
 
+# Channels of the pulser whose pulses have to fit in the period
+PERIOD_CHANNELS = ('A', 'C', 'D')
+
 class virtual_period(Instrument):
     '''
     This is the driver to handle period.
@@ -30,6 +33,10 @@ class virtual_period(Instrument):
         self.add_parameter('cooling_time', units='ns', flags=Instrument.FLAG_GETSET, type=types.FloatType)
         self.add_parameter('origin', units='ns', flags=Instrument.FLAG_GETSET, type=types.FloatType)
 
+        self.add_function('get_pulser_state')
+        self.add_function('apply_pulser_state')
+        self.add_function('invalidate_pulser_state')
+
 
         # Defining some stuff
         self._instruments = instruments.get_instruments()
@@ -38,6 +45,9 @@ class virtual_period(Instrument):
         self._cooling_time = 1e3 #in [ns]
         self._origin = 0. #in [ns]
 
+        # Period, delays and widths of the pulser, None until read
+        self._pulser_state = None
+
 
         self.get_all()
 
@@ -78,6 +88,7 @@ class virtual_period(Instrument):
         '''
 
         logging.info(__name__+' : set the period of the pulser')
+        self.invalidate_pulser_state()
         self._pulser.set_period(period)
 
 
@@ -165,6 +176,7 @@ class virtual_period(Instrument):
 
         logging.info(__name__+' : Set the origin of the pulses')
 
+        self.invalidate_pulser_state()
         self._origin = origin
         oldPeriod = self.get_period()
 
@@ -203,3 +215,116 @@ class virtual_period(Instrument):
 
         logging.info(__name__+' : Get the origin of the pulses')
         return float(self._origin)
+
+
+
+
+#########################################################
+#
+#
+#                Pulser state
+#
+#
+#########################################################
+
+    def get_pulser_state(self):
+        '''
+            Get the period of the pulser and the delays and widths of the
+            channels which have to fit in it.
+            The pulser is only read the first time, the state being then
+            kept up to date by apply_pulser_state.
+
+            Input:
+                None
+
+            Output:
+                state (dict): {'period' : [ns], 'chA_delay' : [ns],
+                               'chA_width' : [ns], ...}
+        '''
+
+        if self._pulser_state is None:
+
+            logging.info(__name__+' : Read the state of the pulser')
+
+            state = {'period' : float(self._pulser.get_period())}
+            for channel in PERIOD_CHANNELS:
+                for value in ('delay', 'width'):
+                    key = 'ch'+channel+'_'+value
+                    state[key] = float(getattr(self._pulser, 'get_'+key)())
+
+            self._pulser_state = state
+
+        return dict(self._pulser_state)
+
+
+    def invalidate_pulser_state(self):
+        '''
+            Forget the state of the pulser, it will be read again by the next
+            get_pulser_state.
+            To be used when the pulser has been set by another way than
+            apply_pulser_state.
+
+            Input:
+                None
+
+            Output:
+                None
+        '''
+
+        self._pulser_state = None
+
+
+    def required_period(self, state):
+        '''
+            Get the period needed by the pulses of a pulser state, taking
+            into account the cooling time
+
+            Input:
+                state (dict): state as returned by get_pulser_state
+
+            Output:
+                period (float): period of the pulser [ns]
+        '''
+
+        return max(state['ch'+channel+'_delay'] + state['ch'+channel+'_width']
+                   for channel in PERIOD_CHANNELS) + self._cooling_time
+
+
+    def apply_pulser_state(self, changes):
+        '''
+            Set delays and widths of the pulser together with the period they
+            need.
+            Only the values which differ from the known state are written.
+            When the period increases it is written first, otherwise last, so
+            that the pulses always fit in the period.
+
+            Input:
+                changes (dict): new delays and widths, as {'chC_width' : [ns]}
+
+            Output:
+                period (float): new period of the pulser [ns]
+        '''
+
+        old = self.get_pulser_state()
+
+        new = dict(old)
+        new.update(changes)
+        new['period'] = self.required_period(new)
+
+        # Values decreasing first, so that no pulse gets longer than both
+        # its old and new ends in between
+        writes = sorted([(new[key] - old[key], key, new[key]) for key in changes
+                         if new[key] != old[key]])
+
+        if new['period'] > old['period']:
+            self._pulser.set_period(new['period'])
+
+        for step, key, value in writes:
+            getattr(self._pulser, 'set_'+key)(value)
+
+        if new['period'] < old['period']:
+            self._pulser.set_period(new['period'])
+
+        self._pulser_state = new
+
+        return new['period']
@@ -64,6 +64,10 @@ class virtual_probe_pulse(Instrument):
 
         self.add_parameter('status', option_list=['ON', 'OFF'], flags=Instrument.FLAG_GETSET, type=types.StringType)
 
+        self.add_function('plan_points')
+        self.add_function('set_point')
+        self.add_function('sweep_points')
+
 
         #We initialize the trigger pulse for the board
         self._pulser.set_chC_status('OFF')
@@ -147,6 +151,7 @@ class virtual_probe_pulse(Instrument):
             self._period.set_period(newPeriod)
             self._pulser.set_chC_width(val)
 
+        self._period.invalidate_pulser_state()
 
 
 
@@ -190,9 +195,91 @@ class virtual_probe_pulse(Instrument):
 
         if self._period.get_origin() + delay >= 0:
             self._pulser.set_chC_delay(self._period.get_origin() + delay)
+            self._period.invalidate_pulser_state()
         else:
             raise ValueError("Your origin is too small.")
 
+
+
+#########################################################################
+#
+#
+#                           Points
+#
+#
+#########################################################################
+
+    def plan_points(self, points):
+        '''
+            Check planned (width, delay) points of the pulse and return the
+            settings of the pulser for each of them
+
+            Input:
+                points (list): (width, delay) of the pulse [ns], the delay
+                               being taken from the origin as in set_delay
+
+            Output:
+                plan (list): settings of the pulser of each point, to be
+                             given to the apply_pulser_state of the period
+        '''
+
+        points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        widths = points[:,0]
+        delays = points[:,1] + self._period.get_origin()
+
+        if (widths < 2.).any():
+            raise ValueError("The width of the pulse has to be at least 2 ns.")
+        if (delays < 0.).any():
+            raise ValueError("Your origin is too small.")
+
+        return [{'chC_width' : width, 'chC_delay' : delay}
+                for width, delay in zip(widths.tolist(), delays.tolist())]
+
+
+    def set_point(self, width, delay):
+        '''
+            Set the width and the delay of the pulse together, the period
+            being updated from the known state of the pulser
+
+            Input:
+                width (float): Time of the pulse width [ns]
+                delay (float): Time of the pulse delay [ns]
+
+            Output:
+                None
+        '''
+
+        self._period.apply_pulser_state(self.plan_points([(width, delay)])[0])
+
+
+    def sweep_points(self, points):
+        '''
+            Iterate over planned (width, delay) points of the pulse, the
+            pulser being set to each point before it is returned.
+            All points are checked before the first one is set and the pulser
+            is only read once, so that each point costs at most the writes of
+            the width, the delay and the period.
+
+            Usage:
+                for width, delay in probe.sweep_points(points):
+                    measure()
+
+            Input:
+                points (list): (width, delay) of the pulse [ns]
+
+            Output:
+                iterator over the points
+        '''
+
+        plan = self.plan_points(points)
+
+        def sweep():
+            for point, state in zip(points, plan):
+                self._period.apply_pulser_state(state)
+                yield point
+
+        return sweep()
+
 #########################################################################
 #
 #
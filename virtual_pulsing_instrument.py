@@ -7,10 +7,14 @@ import numpy as np
 import types
 import logging
 import ATS9360.DataTreatment as dt
+import pulse_sequence
+from Tabor_WX1284C import sequence_table, tile_sequence
 
 # now coded in this driver
 import matplotlib.pyplot as plt
 import time as TIME
+import sys
+import threading
 
 
 import multiprocessing as mp
@@ -21,6 +25,248 @@ import multiprocessing as mp
 # import ATS9360_NPT
 CHANNEL=(1,2,3,4)
 
+
+
+class SegmentAllocator(object):
+    '''
+    Bookkeeping of the segments of the AWG memory.
+    Each segment belongs to one or several sequences (its owners), a segment
+    shared by several sequences being freed with the last of them.
+    Freed segment numbers are reused, preferably by waveforms of at most the
+    same size so that the memory they held is reused as well.
+    '''
+
+    def __init__(self, max_segments=32000, memory=2*1024**2):
+        '''
+        Input:
+            max_segments (int): number of segments of the WX1284C.
+            memory (int): waveform memory of each channel in points.
+        '''
+        self.max_segments = max_segments
+        self.memory = memory
+        self.clear()
+
+    def clear(self):
+        '''
+        Forget all the segments, to be used when the awg memory is deleted.
+        '''
+        # {seg_id: set of owners} and {seg_id: {channel: size}}
+        self._owners = {}
+        self._sizes = {}
+        # sizes of the freed segments, still in the awg memory
+        self._freed = {}
+
+    def allocate(self, owner, channel, size):
+        '''
+        Return a free segment number for a waveform of size points of channel.
+        '''
+        if self.used_memory(channel) + size > self.memory:
+            raise ValueError('Not enough memory on the channel {} for {} points, '\
+                             'free some sequences or delete the awg memory'.format(channel, size))
+
+        # Best fit among the freed segments, otherwise the first free number
+        fits = [(sizes.get(channel, 0), seg_id) for seg_id, sizes in self._freed.items()
+                if sizes.get(channel, 0) >= size]
+        if fits:
+            seg_id = min(fits)[1]
+        elif self._freed:
+            seg_id = min(self._freed)
+        else:
+            seg_id = self.highest() + 1
+            if seg_id > self.max_segments:
+                raise ValueError('All the {} segments of the awg are used'.format(self.max_segments))
+
+        self.reserve(owner, seg_id, channel, size)
+        return seg_id
+
+    def reserve(self, owner, seg_id, channel=None, size=0):
+        '''
+        Add owner to the owners of the segment seg_id.
+        '''
+        # A freed segment still holds its waveforms
+        if seg_id in self._freed:
+            self._sizes[seg_id] = self._freed.pop(seg_id)
+        self._owners.setdefault(seg_id, set()).add(owner)
+        if channel is not None:
+            self._sizes.setdefault(seg_id, {})[channel] = size
+
+    def release(self, owner, seg_id):
+        '''
+        Remove owner from the owners of the segment seg_id, the segment is freed
+        with its last owner. Return True if the segment was freed.
+        '''
+        owners = self._owners.get(seg_id, set())
+        owners.discard(owner)
+        if not owners:
+            self._owners.pop(seg_id, None)
+            self._freed[seg_id] = self._sizes.pop(seg_id, {})
+            return True
+        return False
+
+    def free(self, owner):
+        '''
+        Release all the segments of owner and return the numbers of those
+        freed, the segments shared with other owners being kept.
+        '''
+        return [seg_id for seg_id in self.segments(owner)
+                if self.release(owner, seg_id)]
+
+    def forget(self, segments):
+        '''
+        Forget the waveforms of freed segments deleted from the awg memory,
+        their numbers are still reused.
+        '''
+        for seg_id in segments:
+            if seg_id in self._freed:
+                self._freed[seg_id] = {}
+
+    def segments(self, owner):
+        '''
+        Return the numbers of the segments of owner.
+        '''
+        return sorted(seg_id for seg_id, owners in self._owners.items() if owner in owners)
+
+    def highest(self):
+        '''
+        Return the highest segment number in use or freed, 0 if none.
+        '''
+        return max(self._owners.keys() + self._freed.keys() + [0])
+
+    def used_memory(self, channel):
+        '''
+        Return the number of points of the segments in use on channel.
+        '''
+        return sum(sizes.get(channel, 0) for sizes in self._sizes.values())
+
+    def report(self):
+        '''
+        Return the usage of the segments and of the memory:
+            used (int): number of segments in use.
+            freed (int): number of freed segments not yet reused.
+            highest (int): highest segment number.
+            fragmentation (float): part of the numbers up to highest which
+                are freed.
+            memory (dict): {channel: (used points, freed points)}.
+        '''
+        channels = set(ch for sizes in self._sizes.values() + self._freed.values()
+                       for ch in sizes)
+        highest = self.highest()
+
+        return {'used': len(self._owners),
+                'freed': len(self._freed),
+                'highest': highest,
+                'fragmentation': len(self._freed)/float(highest) if highest else 0.,
+                'memory': dict((ch, (self.used_memory(ch),
+                                     sum(sizes.get(ch, 0) for sizes in self._freed.values())))
+                               for ch in channels)}
+
+
+class ConfigurationDispatcher(object):
+    '''
+    Applies the settings of several instruments concurrently, one worker per
+    instrument, the settings of an instrument being applied in the order they
+    were added. A setting can also wait for settings of other instruments.
+    Example:
+        dispatcher = ConfigurationDispatcher()
+        off = dispatcher.add('awg', awg.set_ch1_output, 'OFF')
+        dispatcher.add('mw1', mw1.set_frequency, 5e9)
+        dispatcher.add('board', board.measurement_initialization, after=[off])
+        timing = dispatcher.run()
+    '''
+
+    def __init__(self, concurrent=True):
+        '''
+        Input:
+            concurrent (bool): if False, the settings are applied one after
+                the other in the order they were added.
+        '''
+        self.concurrent = concurrent
+        self._tasks = []
+
+    def add(self, instrument, function, *args, **kwargs):
+        '''
+        Add a setting function(*args, **kwargs) of instrument.
+        Input:
+            instrument (str): name of the instrument, its settings are
+                applied by the same worker.
+            function (callable)
+            after (list): settings, as returned by add, which have to be
+                applied before this one.
+        Output:
+            setting (int): to be used in after.
+        '''
+        after = kwargs.pop('after', ())
+        self._tasks.append((instrument, function, args, kwargs, tuple(after)))
+        return len(self._tasks) - 1
+
+    def run(self):
+        '''
+        Apply the settings and forget them. The first error is raised once all
+        the workers have stopped.
+        Output:
+            timing (dict): {instrument: time spent in its settings in s}, and
+                'total' the duration of the whole configuration.
+        '''
+        tasks, self._tasks = self._tasks, []
+        done   = [threading.Event() for task in tasks]
+        abort  = threading.Event()
+        errors = []
+        timing = dict((task[0], 0.) for task in tasks)
+
+        def work(instrument):
+            for i, (name, function, args, kwargs, after) in enumerate(tasks):
+                if name != instrument:
+                    continue
+                # The settings only depend on settings added before them
+                for j in after:
+                    while not done[j].is_set():
+                        if abort.is_set():
+                            return
+                        done[j].wait(0.1)
+                if abort.is_set():
+                    return
+                start = TIME.time()
+                try:
+                    function(*args, **kwargs)
+                except BaseException:
+                    errors.append((instrument, sys.exc_info()))
+                    abort.set()
+                    return
+                finally:
+                    timing[instrument] += TIME.time() - start
+                done[i].set()
+
+        start = TIME.time()
+        instruments = sorted(set(task[0] for task in tasks))
+        if self.concurrent and len(instruments) > 1:
+            workers = [threading.Thread(target=work, args=(instrument,),
+                                        name='configuration '+instrument)
+                       for instrument in instruments]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        else:
+            for i, task in enumerate(tasks):
+                if abort.is_set():
+                    break
+                start_task = TIME.time()
+                try:
+                    task[1](*task[2], **task[3])
+                except BaseException:
+                    errors.append((task[0], sys.exc_info()))
+                    abort.set()
+                timing[task[0]] += TIME.time() - start_task
+        timing['total'] = TIME.time() - start
+
+        if errors:
+            instrument, (error_type, error, traceback) = errors[0]
+            logging.warning(__name__+' : configuration of '+instrument+' failed: '+str(error))
+            raise error_type, error, traceback
+
+        return timing
+
+
 class virtual_pulsing_instrument(Instrument):
     '''
     TO DO: complete it!!!
@@ -134,6 +380,12 @@ class virtual_pulsing_instrument(Instrument):
                             option_list = ['homodyne', 'heterodyne'])
         self.set_measurement_type('homodyne')
 
+        self.add_parameter('concurrent_prep',
+                            flags = Instrument.FLAG_GETSET,
+                            type = types.BooleanType)
+        self.set_concurrent_prep(True)
+        self._prep_timing = {}
+
         self.add_parameter('board_averaging',
                             flags=Instrument.FLAG_GETSET,
                             minval = 1,
@@ -287,6 +539,13 @@ class virtual_pulsing_instrument(Instrument):
                         'board_marker':board_marker,
                         'mw_marker':mw_marker})
         self._segmentation = {}
+        self._segment_allocator = SegmentAllocator()
+        # {program: {awg channel: sequence number}} see select_program
+        self._program_bank = {}
+        self._bank_ready = False
+        # A replaced segment table deletes the segments of all the sequences
+        self._arbitrary_waveform_generator.add_segment_table_listener(
+            lambda ch_id: self.clear_awg_segmentation())
         # self._nb_segmt_memorized = 0
         self._secondtone_temp_length = 20e-6
         self._firsttone_temp_length = 4e-6
@@ -391,33 +650,13 @@ class virtual_pulsing_instrument(Instrument):
             self._awg_dict_amplitude[i](2)
             self._awg_dict_output[i]('OFF')
 
-        self._awg_waves = {'onetone':{'binary':{1:[], 2:[], 3:[], 4:[] },
-                                        'cosine':{1:[], 2:[], 3:[], 4:[] },
-                                        'marker_trigger':{1:[], 2:[], 3:[], 4:[] }},
-                            'twotone':{'binary':{1:[], 2:[], 3:[], 4:[] },
-                                        'cosine':{1:[], 2:[], 3:[], 4:[] },
-                                        'marker_trigger':{1:[], 2:[], 3:[], 4:[] }},
-                            'rabi':{'binary':{1:[], 2:[], 3:[], 4:[] },
-                                    'cosine':{1:[], 2:[], 3:[], 4:[] },
-                                    'marker_trigger':{1:[], 2:[], 3:[], 4:[] }},
-                            'relaxation': {'binary':{1:[], 2:[], 3:[], 4:[] },
-                                    'cosine':{1:[], 2:[], 3:[], 4:[] },
-                                    'marker_trigger':{1:[], 2:[], 3:[], 4:[] }},
-                            'ramsey': {'binary':{1:[], 2:[], 3:[], 4:[] },
-                                    'cosine':{1:[], 2:[], 3:[], 4:[] },
-                                    'marker_trigger':{1:[], 2:[], 3:[], 4:[] }},
-                            'IQ': {'binary':{1:[], 2:[], 3:[], 4:[] },
-                                    'cosine':{1:[], 2:[], 3:[], 4:[] },
-                                    'marker_trigger':{1:[], 2:[], 3:[], 4:[] }},
-                            'threetone': {'binary':{1:[], 2:[], 3:[], 4:[] },
-                                    'cosine':{1:[], 2:[], 3:[], 4:[] },
-                                    'marker_trigger':{1:[], 2:[], 3:[], 4:[] }},
-                            'echo': {'binary':{1:[], 2:[], 3:[], 4:[] },
-                                    'cosine':{1:[], 2:[], 3:[], 4:[] },
-                                    'marker_trigger':{1:[], 2:[], 3:[], 4:[] }},
-                            'n_photon': {'binary':{1:[], 2:[], 3:[], 4:[] },
-                                    'cosine':{1:[], 2:[], 3:[], 4:[] },
-                                    'marker_trigger':{1:[], 2:[], 3:[], 4:[] }}  }
+        # Only the codes of the unique waveforms are kept, see
+        # pulse_sequence.SequenceWaves
+        self._waveform_pool = pulse_sequence.WaveformPool()
+        self._awg_waves = dict((name, pulse_sequence.SequenceWaves(self._waveform_pool))
+                               for name in ('onetone', 'twotone', 'rabi', 'relaxation',
+                                            'ramsey', 'IQ', 'threetone', 'echo',
+                                            'n_photon'))
 
         #initialize the mw generators
         if self._presence_mwsrc2:
@@ -475,6 +714,7 @@ class virtual_pulsing_instrument(Instrument):
 
         # others
         self.add_function('display_pulses_sequence')
+        self.add_function('last_prep_timing')
         self.add_function('cos')
         self.add_function('volt2bit')
         self.add_function('volt2bit_2')
@@ -497,6 +737,23 @@ class virtual_pulsing_instrument(Instrument):
     def do_get_measurement_type(self):
         return self._meas_type
 
+    def do_set_concurrent_prep(self, value):
+        '''
+        If True, the prep_* methods configure the instruments concurrently,
+        see ConfigurationDispatcher.
+        '''
+        self._concurrent_prep = value
+
+    def do_get_concurrent_prep(self):
+        return self._concurrent_prep
+
+    def last_prep_timing(self):
+        '''
+        Return the time spent in s by each instrument during the last prep_*
+        method, see ConfigurationDispatcher.run.
+        '''
+        return self._prep_timing
+
     def do_get_board_flag(self):
         return self._board_flag
 
@@ -544,6 +801,49 @@ class virtual_pulsing_instrument(Instrument):
         for seq_name, seg_vec in dictio.iteritems():
             self._segmentation[seq_name] = seg_vec
 
+            # The previous segments of the sequence can be reused
+            self._segment_allocator.free(seq_name)
+            for seg_id in np.atleast_1d(seg_vec):
+                self._segment_allocator.reserve(seq_name, int(seg_id))
+
+    def clear_awg_segmentation(self):
+        '''
+        Forget the segmentation of all the sequences, to be used when the awg
+        memory is deleted.
+        '''
+        self._segmentation = {}
+        self._segment_allocator.clear()
+        self._program_bank = {}
+        self._bank_ready = False
+
+    def free_sequence(self, seq_name, delete=False):
+        '''
+        Free the segments of the sequence seq_name, they are reused by the next
+        sequences. The other sequences stay in the awg memory.
+        Input:
+            seq_name (str): name of the sequence
+            delete (bool): if True, the freed segments are also deleted from
+                the awg memory. Segments shared with other sequences are
+                neither freed nor deleted.
+        Output:
+            freed segments (list of int)
+        '''
+        self._segmentation.pop(seq_name, None)
+        freed = self._segment_allocator.free(seq_name)
+
+        if delete and freed:
+            self._arbitrary_waveform_generator.delete_segment_i(freed)
+            self._segment_allocator.forget(freed)
+
+        return freed
+
+    def segments_report(self):
+        '''
+        Return the usage of the awg segments and memory, see
+        SegmentAllocator.report.
+        '''
+        return self._segment_allocator.report()
+
     def do_get_power_first_tone(self):
         '''
         Get the power_first_tone. It gets the estimated power of the first tone after the SSB.
@@ -1057,18 +1357,33 @@ class virtual_pulsing_instrument(Instrument):
         Output:
             number of segments [int]
         '''
-        values = self.get_awg_segmentation().values()
-        if len(values) == 0:
-            return 0
-        else:
-            values = [item for sublist in values for item in sublist]
-            return np.max(values)
+        return self._segment_allocator.highest()
 
     ############################################################################
 
     ############################################################################
     #  Functions
     ############################################################################
+    def _init_measurement(self, pulse_time, delta_t):
+        '''
+        Set the data treatment of the board for the measurement type and
+        initialize the measurement.
+        Inputs:
+            pulse_time in ns
+            delta_t in ns
+        '''
+        if self.do_get_measurement_type() == 'homodyne':
+            processus = dt.HomodyneRealImagPerSequence(pulse_time*1e-9, self._board.get_samplerate()*1e6, delta_t*1e-9)
+        elif self.do_get_measurement_type() == 'heterodyne':
+            if self._acquisition:
+                processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
+                              self.get_down_converted_frequency()*1e9)
+            else:
+                processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
+                              self.get_down_converted_frequency()*1e9, t_ro=self.get_temp_length_firsttone())
+
+        self._board.measurement_initialization(processor=processus)
+
     def prep_onetone(self, freq_vec, average, power, acq_time=500,
             pulse_time=500, delta_t=0.):
         '''
@@ -1082,49 +1397,40 @@ class virtual_pulsing_instrument(Instrument):
             delta_t in ns
         '''
 
+        dispatcher = ConfigurationDispatcher(self.get_concurrent_prep())
+        mw1 = self._microwave_generator1
+
         # Setting the mw1 on the sweeping mode
-        self._microwave_generator1.set_freqsweep('on')
-        # self._microwave_generator1.set_sweepmode('STEP')
-        self._microwave_generator1.set_sweepmode('STEP')
-        self._microwave_generator1.set_spacingfreq('lin')
+        dispatcher.add('mw1', mw1.set_freqsweep, 'on')
+        dispatcher.add('mw1', mw1.set_sweepmode, 'STEP')
+        dispatcher.add('mw1', mw1.set_spacingfreq, 'lin')
 
         if  self._presence_mwsrc2:
-            self._microwave_generator2.set_freqsweep('off')
+            dispatcher.add('mw2', self._microwave_generator2.set_freqsweep, 'off')
 
         # Setting the sweep parameters to mw1
-        self.set_src1_frequency_start(freq_vec[0])
-        self.set_src1_frequency_stop(freq_vec[-1])
-        self.set_src1_points_freq_sweep(len(freq_vec))
-        # self.set_src1_points_freq_sweep(self, len(freq_vec), channel=1)
-
+        dispatcher.add('mw1', self.set_src1_frequency_start, freq_vec[0])
+        dispatcher.add('mw1', self.set_src1_frequency_stop, freq_vec[-1])
+        dispatcher.add('mw1', self.set_src1_points_freq_sweep, len(freq_vec))
+        dispatcher.add('mw1', mw1.set_gui_update, 'OFF')
 
         # Setting the averaging:
-        self.set_total_averaging(average)
-        self._microwave_generator1.set_gui_update('OFF')
+        dispatcher.add('board', self.set_total_averaging, average)
 
         # Selecting the AWG sequence
-        self.AWG_select_sequence(sequence='onetone', nb_channel=1)
+        dispatcher.add('awg', self.AWG_select_sequence, sequence='onetone', nb_channel=1)
 
         # Setting AWG power/amplitude
         self.set_power_first_tone(power)
         amplitude = 10**((power)/10.)
-        #noprint 190928
-        #print amplitude
-        self._awg_dict_amplitude[self._awg_routing['firsttone_channel']](2*amplitude)
+        awg_ready = dispatcher.add('awg', self._awg_dict_amplitude[self._awg_routing['firsttone_channel']],
+                                   2*amplitude)
 
-        self._board.set_acquisition_time(acq_time)
-        # Setting the measurement process
-        if self.do_get_measurement_type() == 'homodyne':
-            processus = dt.HomodyneRealImagPerSequence(pulse_time*1e-9, self._board.get_samplerate()*1e6, delta_t*1e-9)
-        elif self.do_get_measurement_type() == 'heterodyne':
-            if self._acquisition:
-                processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
-                              self.get_down_converted_frequency()*1e9)
-            else:
-                processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
-                              self.get_down_converted_frequency()*1e9, t_ro=self.get_temp_length_firsttone())
+        # Setting the measurement process once the awg is ready
+        dispatcher.add('board', self._board.set_acquisition_time, acq_time)
+        dispatcher.add('board', self._init_measurement, pulse_time, delta_t, after=[awg_ready])
 
-        self._board.measurement_initialization(processor=processus)
+        self._prep_timing = dispatcher.run()
 
     def prep_twotone(self, cwf, freq_vec, average, power_tone1, power_tone2,
             acq_time=500, pulse_time=500, delta_t=0):
@@ -1138,47 +1444,42 @@ class virtual_pulsing_instrument(Instrument):
             pulse_time in ns
             delta_t in ns
         '''
-        self._microwave_generator1.set_gui_update('OFF')
-        self._microwave_generator2.set_gui_update('OFF')
-        self._microwave_generator1.set_freqsweep('off')
-        self.set_src1_cw_frequency(cwf)
+        dispatcher = ConfigurationDispatcher(self.get_concurrent_prep())
+        mw1 = self._microwave_generator1
+        mw2 = self._microwave_generator2
 
-        self._microwave_generator2.set_freqsweep('on')
-        self._microwave_generator2.set_sweepmode('STEP')
-        self._microwave_generator2.set_spacingfreq('lin')
+        dispatcher.add('mw1', mw1.set_gui_update, 'OFF')
+        dispatcher.add('mw1', mw1.set_freqsweep, 'off')
+        dispatcher.add('mw1', self.set_src1_cw_frequency, cwf)
 
-        self.set_src2_frequency_start(freq_vec[0])
-        self.set_src2_frequency_stop(freq_vec[-1])
-        self.set_src2_points_freq_sweep(len(freq_vec))
-        # self.set_points_freq_sweep(self, len(freq_vec), channel=2)
+        dispatcher.add('mw2', mw2.set_gui_update, 'OFF')
+        dispatcher.add('mw2', mw2.set_freqsweep, 'on')
+        dispatcher.add('mw2', mw2.set_sweepmode, 'STEP')
+        dispatcher.add('mw2', mw2.set_spacingfreq, 'lin')
 
-        self._microwave_generator2.set_power(self._SSB_tone2.get_LO_power())
+        dispatcher.add('mw2', self.set_src2_frequency_start, freq_vec[0])
+        dispatcher.add('mw2', self.set_src2_frequency_stop, freq_vec[-1])
+        dispatcher.add('mw2', self.set_src2_points_freq_sweep, len(freq_vec))
 
-        self.set_total_averaging(average)
+        dispatcher.add('mw2', lambda: mw2.set_power(self._SSB_tone2.get_LO_power()))
+
+        dispatcher.add('board', self.set_total_averaging, average)
 
-        self.AWG_select_sequence(sequence='twotone', nb_channel=2 )
+        dispatcher.add('awg', self.AWG_select_sequence, sequence='twotone', nb_channel=2)
 
         self.set_power_first_tone(power_tone1)
         amplitude1 = 10**((power_tone1)/10.)
         self.set_power_second_tone(power_tone2)
         amplitude2 = 10**((power_tone2)/10.)
-        #noprint 180928
-        #print amplitude1, amplitude2
-        self._awg_dict_amplitude[self._awg_routing['firsttone_channel']](2*amplitude1)
-        self._awg_dict_amplitude[self._awg_routing['secondtone_channel']](2*amplitude2)
+        dispatcher.add('awg', self._awg_dict_amplitude[self._awg_routing['firsttone_channel']], 2*amplitude1)
+        awg_ready = dispatcher.add('awg', self._awg_dict_amplitude[self._awg_routing['secondtone_channel']],
+                                   2*amplitude2)
 
-        self._board.set_acquisition_time(acq_time)
-        # Setting the measurement process
-        if self.do_get_measurement_type() == 'homodyne':
-            processus = dt.HomodyneRealImagPerSequence(pulse_time*1e-9, self._board.get_samplerate()*1e6, delta_t*1e-9)
-        elif self.do_get_measurement_type() == 'heterodyne':
-            if self._acquisition:
-                processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
-                              self.get_down_converted_frequency()*1e9)
-            else:
-                processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
-                              self.get_down_converted_frequency()*1e9, t_ro=self.get_temp_length_firsttone())
-        self._board.measurement_initialization(processor=processus)
+        # Setting the measurement process once the awg is ready
+        dispatcher.add('board', self._board.set_acquisition_time, acq_time)
+        dispatcher.add('board', self._init_measurement, pulse_time, delta_t, after=[awg_ready])
+
+        self._prep_timing = dispatcher.run()
 
     def prep_conditional_transmission(self, freq_vec, average,
                 power1, f_cw=5, power2=0, acq_time=500, pulse_time=500, delta_t=0, tau=None, t_start=0 , nb_channel=2):
@@ -1256,77 +1557,72 @@ class virtual_pulsing_instrument(Instrument):
         self._acq_time = acq_time
         self._pulse_time = pulse_time
         self._delta_t = delta_t
-        self._microwave_generator1.set_gui_update('OFF')
-        self._microwave_generator2.set_gui_update('OFF')
-        for i in CHANNEL:
-            self._awg_dict_output[i]('OFF')
 
+        dispatcher = ConfigurationDispatcher(self.get_concurrent_prep())
+        mw1 = self._microwave_generator1
+        mw2 = self._microwave_generator2
+        awg = self._arbitrary_waveform_generator
 
-        self._microwave_generator1.set_freqsweep('off')
-        self.set_src1_cw_frequency(cwf1)
+        dispatcher.add('mw1', mw1.set_gui_update, 'OFF')
+        dispatcher.add('mw2', mw2.set_gui_update, 'OFF')
+
+        dispatcher.add('mw1', mw1.set_freqsweep, 'off')
+        dispatcher.add('mw1', self.set_src1_cw_frequency, cwf1)
         if mw ==2:
-            self._microwave_generator2.set_freqsweep('off')
-            self.set_src2_cw_frequency(cwf2)
-            self._microwave_generator2.set_power(self._SSB_tone2.get_LO_power())
+            dispatcher.add('mw2', mw2.set_freqsweep, 'off')
+            dispatcher.add('mw2', self.set_src2_cw_frequency, cwf2)
+            dispatcher.add('mw2', lambda: mw2.set_power(self._SSB_tone2.get_LO_power()))
         elif mw == 3:
-            self._microwave_generator3.set_freqsweep('off')
-            self.set_src3_cw_frequency(cwf2)
-            self._microwave_generator3.set_power(self._SSB_tone3.get_LO_power())
-
-        self._board.set_nb_sequence(nb_sequences)
-        self._board.set_averaging(average)
-
-        self._arbitrary_waveform_generator.channel_select(self._awg_routing['firsttone_channel'])
-        self._arbitrary_waveform_generator.sequence_select(self._sequence_dict['rabi1'])
-        self._awg_dict_output[self._awg_routing['firsttone_channel']]('ON')
-
-        if self._thirdtone == 1:
-            self._arbitrary_waveform_generator.channel_select(self._awg_routing['thirdtone_channel'])
-            self._arbitrary_waveform_generator.sequence_select(self._sequence_dict['rabi3'])
-            self._awg_dict_output[self._awg_routing['thirdtone_channel']]('ON')
-
-            self.set_power_third_tone(power_tone3)
-            amplitude = 10**((power_tone3)/10.)
-            #noprint 180928 !V
-            #print amplitude
-            self._awg_dict_amplitude[self._awg_routing['thirdtone_channel']](2*amplitude)
+            mw3 = self._microwave_generator3
+            dispatcher.add('mw3', mw3.set_freqsweep, 'off')
+            dispatcher.add('mw3', self.set_src3_cw_frequency, cwf2)
+            dispatcher.add('mw3', lambda: mw3.set_power(self._SSB_tone3.get_LO_power()))
 
+        dispatcher.add('board', self._board.set_nb_sequence, nb_sequences)
+        dispatcher.add('board', self._board.set_averaging, average)
 
         self.set_power_first_tone(power_tone1)
         amplitude1 = 10**((power_tone1)/10.)
         self.set_power_second_tone(power_tone2)
         amplitude2 = 10**((power_tone2)/10.)
-        #noprint 180928 !V
-        #print amplitude1, amplitude2
-        self._awg_dict_amplitude[self._awg_routing['firsttone_channel']](2*amplitude1)
+        if self._thirdtone == 1:
+            self.set_power_third_tone(power_tone3)
+            amplitude3 = 10**((power_tone3)/10.)
 
-        self._arbitrary_waveform_generator.channel_select(self._awg_routing['secondtone_channel'])
-        self._arbitrary_waveform_generator.sequence_select(self._sequence_dict['rabi2'])
-        self._awg_dict_output[self._awg_routing['secondtone_channel']]('ON')
-        self._awg_dict_amplitude[self._awg_routing['secondtone_channel']](2*amplitude2)
+        # The channel selections have to be done one after the other
+        def prep_awg():
+            for i in CHANNEL:
+                self._awg_dict_output[i]('OFF')
 
+            awg.channel_select(self._awg_routing['firsttone_channel'])
+            awg.sequence_select(self._sequence_dict['rabi1'])
+            self._awg_dict_output[self._awg_routing['firsttone_channel']]('ON')
 
-        self._arbitrary_waveform_generator.set_m1_marker_status_1_2('ON')
-        self._arbitrary_waveform_generator.set_trigger_source('EVEN')
+            if self._thirdtone == 1:
+                awg.channel_select(self._awg_routing['thirdtone_channel'])
+                awg.sequence_select(self._sequence_dict['rabi3'])
+                self._awg_dict_output[self._awg_routing['thirdtone_channel']]('ON')
+                self._awg_dict_amplitude[self._awg_routing['thirdtone_channel']](2*amplitude3)
 
-        self._board_flag = 1
+            self._awg_dict_amplitude[self._awg_routing['firsttone_channel']](2*amplitude1)
 
-        self._board.set_acquisition_time(acq_time)
-        if self.do_get_measurement_type() == 'homodyne':
-            processus = dt.HomodyneRealImagPerSequence(pulse_time*1e-9, self._board.get_samplerate()*1e6, delta_t*1e-9)
-        elif self.do_get_measurement_type() == 'heterodyne':
-            if self._acquisition:
-                processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
-                              self.get_down_converted_frequency()*1e9)
-            else:
-                processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
-                              self.get_down_converted_frequency()*1e9, t_ro=self.get_temp_length_firsttone())
+            awg.channel_select(self._awg_routing['secondtone_channel'])
+            awg.sequence_select(self._sequence_dict['rabi2'])
+            self._awg_dict_output[self._awg_routing['secondtone_channel']]('ON')
+            self._awg_dict_amplitude[self._awg_routing['secondtone_channel']](2*amplitude2)
 
-        self._board.measurement_initialization(processor=processus)
+            awg.set_m1_marker_status_1_2('ON')
+            awg.set_trigger_source('EVEN')
 
-        # processus = dt.HomodyneRealImagPerSequence(self.get_temp_length_firsttone(), self._board.get_samplerate()*1e6, delta_t)
-        #
-        # self._board.measurement_initialization(processor=processus)
+        awg_ready = dispatcher.add('awg', prep_awg)
+
+        self._board_flag = 1
+
+        # Setting the measurement process once the awg is ready
+        dispatcher.add('board', self._board.set_acquisition_time, acq_time)
+        dispatcher.add('board', self._init_measurement, pulse_time, delta_t, after=[awg_ready])
+
+        self._prep_timing = dispatcher.run()
 
     def prep_relaxation(self, cwf1, cwf2, average, nb_sequences, power_tone1,
             power_tone2, acq_time, pulse_time, delta_t):
@@ -1338,50 +1634,50 @@ class virtual_pulsing_instrument(Instrument):
             cwf2 [GHz]: continuous wave frequency of the second tone
             average (int): number of total averaging
         '''
-        self._microwave_generator1.set_gui_update('OFF')
-        self._microwave_generator2.set_gui_update('OFF')
-
-        self._microwave_generator1.set_freqsweep('off')
-        self.set_src1_cw_frequency(cwf1)
-        self._microwave_generator2.set_freqsweep('off')
-        self.set_src2_cw_frequency(cwf2)
+        dispatcher = ConfigurationDispatcher(self.get_concurrent_prep())
+        mw1 = self._microwave_generator1
+        mw2 = self._microwave_generator2
+        awg = self._arbitrary_waveform_generator
 
-        self._microwave_generator2.set_power(self._SSB_tone2.get_LO_power())
-        self._board.set_nb_sequence(nb_sequences)
-        self._board.set_averaging(average)
+        dispatcher.add('mw1', mw1.set_gui_update, 'OFF')
+        dispatcher.add('mw2', mw2.set_gui_update, 'OFF')
 
+        dispatcher.add('mw1', mw1.set_freqsweep, 'off')
+        dispatcher.add('mw1', self.set_src1_cw_frequency, cwf1)
+        dispatcher.add('mw2', mw2.set_freqsweep, 'off')
+        dispatcher.add('mw2', self.set_src2_cw_frequency, cwf2)
 
-        self._arbitrary_waveform_generator.channel_select(self._awg_routing['firsttone_channel'])
-        self._arbitrary_waveform_generator.sequence_select(self._sequence_dict['relaxation1'])
-        self._arbitrary_waveform_generator.channel_select(self._awg_routing['secondtone_channel'])
-        self._arbitrary_waveform_generator.sequence_select(self._sequence_dict['relaxation2'])
-
-        self._awg_dict_output[self._awg_routing['firsttone_channel']]('ON')
-        self._awg_dict_output[self._awg_routing['secondtone_channel']]('ON')
-        self._arbitrary_waveform_generator.set_m1_marker_status_1_2('ON')
-        self._arbitrary_waveform_generator.set_trigger_source('EVEN')
+        dispatcher.add('mw2', lambda: mw2.set_power(self._SSB_tone2.get_LO_power()))
+        dispatcher.add('board', self._board.set_nb_sequence, nb_sequences)
+        dispatcher.add('board', self._board.set_averaging, average)
 
         self.set_power_first_tone(power_tone1)
         amplitude1 = 10**((power_tone1)/10.)
         self.set_power_second_tone(power_tone2)
         amplitude2 = 10**((power_tone2)/10.)
-        #noprint 180928 !V
-        #print amplitude1, amplitude2
-        self._awg_dict_amplitude[self._awg_routing['firsttone_channel']](2*amplitude1)
-        self._awg_dict_amplitude[self._awg_routing['secondtone_channel']](2*amplitude2)
 
-        self._board.set_acquisition_time(acq_time)
-        if self.do_get_measurement_type() == 'homodyne':
-            processus = dt.HomodyneRealImagPerSequence(pulse_time*1e-9, self._board.get_samplerate()*1e6, delta_t*1e-9)
-        elif self.do_get_measurement_type() == 'heterodyne':
-            if self._acquisition:
-                processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
-                              self.get_down_converted_frequency()*1e9)
-            else:
-                processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
-                              self.get_down_converted_frequency()*1e9, t_ro=self.get_temp_length_firsttone())
+        # The channel selections have to be done one after the other
+        def prep_awg():
+            awg.channel_select(self._awg_routing['firsttone_channel'])
+            awg.sequence_select(self._sequence_dict['relaxation1'])
+            awg.channel_select(self._awg_routing['secondtone_channel'])
+            awg.sequence_select(self._sequence_dict['relaxation2'])
 
-        self._board.measurement_initialization(processor=processus)
+            self._awg_dict_output[self._awg_routing['firsttone_channel']]('ON')
+            self._awg_dict_output[self._awg_routing['secondtone_channel']]('ON')
+            awg.set_m1_marker_status_1_2('ON')
+            awg.set_trigger_source('EVEN')
+
+            self._awg_dict_amplitude[self._awg_routing['firsttone_channel']](2*amplitude1)
+            self._awg_dict_amplitude[self._awg_routing['secondtone_channel']](2*amplitude2)
+
+        awg_ready = dispatcher.add('awg', prep_awg)
+
+        # Setting the measurement process once the awg is ready
+        dispatcher.add('board', self._board.set_acquisition_time, acq_time)
+        dispatcher.add('board', self._init_measurement, pulse_time, delta_t, after=[awg_ready])
+
+        self._prep_timing = dispatcher.run()
 
     def prep_IQ_2(self, counts, average, cwf1, power_tone1, cwf2='None',
             power_tone2 = 'None', acq_time=500, pulse_time=500, delta_t=0., tau=None, t_start=0):
@@ -1692,7 +1988,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
         elif delete == 'segments':
             n_seg = self.get_awg_segmentation()['onetone']
             print n_seg, type(n_seg)
@@ -1705,8 +2001,6 @@ class virtual_pulsing_instrument(Instrument):
         # Initializing the array for the ability to display the pulses sequence
         for i in CHANNEL:
             self._awg_waves['onetone']['binary'][i] = []
-            self._awg_waves['onetone']['cosine'][i] = []
-            self._awg_waves['onetone']['marker_trigger'][i] = []
         self._seq_list = []
         ############## writing the 3 segments ##################################
         ########### changing smb frequency part of the sequence
@@ -1718,13 +2012,11 @@ class virtual_pulsing_instrument(Instrument):
             np.int(self.get_marker2_start()*self._arbitrary_waveform_generator.get_clock_freq()*1e6),
             np.int(self.get_marker2_width()*self._arbitrary_waveform_generator.get_clock_freq()*1e6),
                 segment1)
-        segment1_m = self.pulse([self.get_marker2_start(), self.get_marker2_width(), 1], time_smb)
         # Putting the segment in the awg memory
         self._arbitrary_waveform_generator.send_waveform(segment1,
                             self._awg_routing['firsttone_channel'], self.get_number_segments_memorized() + 1)
         ########## waiting part of the sequence
         segment2_c  = np.zeros(16*50)
-        segment2_m  = np.zeros(16*50)
         segment2_b  = self.volt2bit_2(segment2_c)
 
         # Putting the segment in the awg memory
@@ -1758,7 +2050,6 @@ class virtual_pulsing_instrument(Instrument):
             np.int(self.get_marker1_width()*self._arbitrary_waveform_generator.get_clock_freq()*1e6),
             segment3)
 
-        segment3_m = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time)
         # Putting the segment in the awg memory
         self._arbitrary_waveform_generator.send_waveform(segment3,
                             self._awg_routing['firsttone_channel'], self.get_number_segments_memorized() + 3)
@@ -1767,19 +2058,13 @@ class virtual_pulsing_instrument(Instrument):
             if i == self._M + self.get_pulsenumber_averaging():
                 self._seq_list.append([1, self.get_number_segments_memorized() + 1, 0])
                 self._awg_waves['onetone']['binary'][self._awg_routing['firsttone_channel']].append(segment1_b)
-                self._awg_waves['onetone']['cosine'][self._awg_routing['firsttone_channel']].append(segment1_c)
-                self._awg_waves['onetone']['marker_trigger'][self._awg_routing['firsttone_channel']].append(segment1_m)
             elif i < self._M:
                 self._seq_list.append([1, self.get_number_segments_memorized() + 2, 0])
                 self._awg_waves['onetone']['binary'][self._awg_routing['firsttone_channel']].append(segment2_b)
-                self._awg_waves['onetone']['cosine'][self._awg_routing['firsttone_channel']].append(segment2_c)
-                self._awg_waves['onetone']['marker_trigger'][self._awg_routing['firsttone_channel']].append(segment2_m)
             else:
 
                 self._seq_list.append([1, self.get_number_segments_memorized() + 3, 0])
                 self._awg_waves['onetone']['binary'][self._awg_routing['firsttone_channel']].append(segment3_b)
-                self._awg_waves['onetone']['cosine'][self._awg_routing['firsttone_channel']].append(segment3)
-                self._awg_waves['onetone']['marker_trigger'][self._awg_routing['firsttone_channel']].append(segment3_m)
 
         ########################################################################
         self._seq_list = np.array(self._seq_list)
@@ -1809,7 +2094,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
         elif delete == 'segments':
             n_seg = self.get_awg_segmentation()['twotone']
             print n_seg, type(n_seg)
@@ -1849,8 +2134,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for i in CHANNEL:
             self._awg_waves['twotone']['binary'][i] = []
-            self._awg_waves['twotone']['cosine'][i] = []
-            self._awg_waves['twotone']['marker_trigger'][i] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -1960,7 +2243,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -2017,8 +2300,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for i in CHANNEL:
             self._awg_waves['twotone']['binary'][i] = []
-            self._awg_waves['twotone']['cosine'][i] = []
-            self._awg_waves['twotone']['marker_trigger'][i] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -2160,7 +2441,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -2215,8 +2496,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for i in CHANNEL:
             self._awg_waves['twotone']['binary'][i] = []
-            self._awg_waves['twotone']['cosine'][i] = []
-            self._awg_waves['twotone']['marker_trigger'][i] = []
 
         self._seq_list = []
 
@@ -2387,7 +2666,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -2445,8 +2724,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for i in CHANNEL:
             self._awg_waves['twotone']['binary'][i] = []
-            self._awg_waves['twotone']['cosine'][i] = []
-            self._awg_waves['twotone']['marker_trigger'][i] = []
 
         self._seq_list = []
 
@@ -2642,7 +2919,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -2702,8 +2979,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for i in CHANNEL:
             self._awg_waves['threetone']['binary'][i] = []
-            self._awg_waves['threetone']['cosine'][i] = []
-            self._awg_waves['threetone']['marker_trigger'][i] = []
 
         self._seq_list = []
 
@@ -2849,7 +3124,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -2888,8 +3163,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['rabi']['binary'][ch] = []
-            self._awg_waves['rabi']['cosine'][ch] = []
-            self._awg_waves['rabi']['marker_trigger'][ch] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -2913,211 +3186,51 @@ class virtual_pulsing_instrument(Instrument):
                     np.int(self.get_marker1_start()*self._arbitrary_waveform_generator.get_clock_freq()*1e6),
                     np.int(self.get_marker1_width()*self._arbitrary_waveform_generator.get_clock_freq()*1e6),
                     wave_pulse_read_out)
-        self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
-            self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() + 1)
-
-        wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time1)
-
-        for i in np.arange(N):
-            nb_samples2 =  round(1.1*( self.get_temp_start_secondtone() + self.get_temp_length_secondtone()  ) *\
-                    self._arbitrary_waveform_generator.get_clock_freq()*1e6/16., 0)*16
-            time2 = np.arange(nb_samples2)/self._arbitrary_waveform_generator.get_clock_freq()*1e-6
-
-            if i>0:
-                self.set_temp_start_secondtone(self.get_temp_start_secondtone() - Tr_step)
-                self.set_temp_length_secondtone(self.get_temp_length_secondtone() + Tr_step)
-            if nsigma > 0:
-                # Gaussian
-                p2=[self.get_temp_start_secondtone(), self.get_temp_length_secondtone(),
-                    amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9, nsigma]
-                #!V
-                #qb_ex_cos = self.cos(p2, time1) #change 20170505
-                qb_ex_cos = self.cosGaussian(p2, time1) #change 20180820
-            else:
-                p2=[self.get_temp_start_secondtone(), self.get_temp_length_secondtone(),
-                    amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9]
-                qb_ex_cos = self.cos(p2, time1) #change 20170505
-
-            qubit_excitation = self.volt2bit_2(qb_ex_cos)
-            self._arbitrary_waveform_generator.send_waveform(qubit_excitation,
-                self._awg_routing['secondtone_channel'],  self.get_number_segments_memorized() + i + 2)
-
-            self._awg_waves['rabi']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
-            self._awg_waves['rabi']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-            self._awg_waves['rabi']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-            self._awg_waves['rabi']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-            self._awg_waves['rabi']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
-            self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
-            self._seq_list2.append([1, self.get_number_segments_memorized() + i + 2, 0])
-
-        self._seq_list1 = np.array(self._seq_list1)
-        self._seq_list2 = np.array(self._seq_list2)
-        self.set_awg_segmentation({'rabi': self.get_number_segments_memorized() + 1 + 1 + np.arange(N)} )
-        # self.set_awg_segmentation({'rabi2': self.get_number_segments_memorized() + 1 + np.arange(N)} )
-
-        self._awg_dict_output[self._awg_routing['firsttone_channel']]('OFF')
-        self._awg_dict_output[self._awg_routing['secondtone_channel']]('OFF')
-
-
-        self._arbitrary_waveform_generator.set_channels_synchronised('ON')
-
-
-        self._arbitrary_waveform_generator.channel_select(self._awg_routing['firsttone_channel'])
-        self._arbitrary_waveform_generator.send_seq(self._seq_list1, self._sequence_dict['rabi1'])
-        self._arbitrary_waveform_generator.channel_select(self._awg_routing['secondtone_channel'])
-        self._arbitrary_waveform_generator.send_seq(self._seq_list2, self._sequence_dict['rabi2'])
-        self._arbitrary_waveform_generator.sequence_select(self._sequence_dict['rabi2'])
-
-        self._arbitrary_waveform_generator.set_trigger_source('EVEN')
-
-
-        self._arbitrary_waveform_generator.seq_jump_source('BUS')
-        self._arbitrary_waveform_generator.seq_mode('STEP')
-        self._arbitrary_waveform_generator.set_trigger_mode('NORM')
-        self._arbitrary_waveform_generator.set_trigger_timer_mode('TIME')
-        self._arbitrary_waveform_generator.set_run_mode('TRIG')
-        self._arbitrary_waveform_generator.set_func_mode('SEQ')
-        self._arbitrary_waveform_generator.set_trigger_timer_time(self._trigger_time)
-
-        self._awg_dict_output[self._awg_routing['firsttone_channel']]('ON')
-        self._awg_dict_output[self._awg_routing['secondtone_channel']]('ON')
-
-
-        self._arbitrary_waveform_generator.set_m1_marker_high_1_2(1.)
-        self._arbitrary_waveform_generator.set_m1_marker_status_1_2('ON')
-
-        #!V
-
-    def write_Relaxation_pulsessequence(self, t_pi, t_wait_stop, t_wait_step, t_wait_start,t_meas=2e-6, delta_m1_start=0, delete=False):
-        '''
-        Putting in the awg memory the Relaxation pulses sequence and preparing the others instruments.
-        Inputs:
-            t_pi [s]:
-            t_wait_stop [s]:
-            t_wait_step [s]:
-            t_wait_start [s]:
-        '''
-        self._arbitrary_waveform_generator.set_m1_marker_status_1_2('OFF')
-        self._arbitrary_waveform_generator.set_m2_marker_status_1_2('OFF')
-
-        if delete == 'all':
-            # Emptying the awg memory
-            self._arbitrary_waveform_generator.delete_segments()
-            self._arbitrary_waveform_generator.reset()
-            self._arbitrary_waveform_generator.clear_err()
-            self._arbitrary_waveform_generator.set_trace_mode('SING')
-            self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
-            self._arbitrary_waveform_generator.set_clock_freq(1e3)
-            # self._arbitrary_waveform_generator.set_clock_source('EXT')
-        elif delete == 'segments':
-            n_seg = self.get_awg_segmentation()['relaxation1']
-            print n_seg, type(n_seg)
-            self._arbitrary_waveform_generator.delete_segment_i(n_seg)
-            n_seg = self.get_awg_segmentation()['relaxation2']
-            print n_seg, type(n_seg)
-            self._arbitrary_waveform_generator.delete_segment_i(n_seg)
-
-        self._arbitrary_waveform_generator.init_channel(self._awg_routing['secondtone_channel'])
-        self._awg_dict_coupling[self._awg_routing['secondtone_channel']]('DC')
-        self._awg_dict_amplitude[self._awg_routing['secondtone_channel']](2)
-
-        self._arbitrary_waveform_generator.init_channel(self._awg_routing['firsttone_channel'])
-        self._awg_dict_coupling[self._awg_routing['firsttone_channel']]('DC')
-        self._awg_dict_amplitude[self._awg_routing['firsttone_channel']](2)
-        self._arbitrary_waveform_generator.set_marker_source('USER')
-
-        # self.set_power_first_tone(power_tone1)
-        # power_tone1 += self._SSB_tone1.get_conversion_loss()
-        # self.set_power_second_tone(power_tone2)
-        # power_tone2 += self._SSB_tone2.get_conversion_loss()
-        # amplitude_tone1 = np.sqrt(2.*50.*10**((power_tone1-30.)/10.))
-        # amplitude_tone2 = np.sqrt(2.*50.*10**((power_tone2-30.)/10.))
-        # print amplitude_tone1, amplitude_tone2
-        amplitude_tone1 = 0.9999
-        amplitude_tone2 = 0.9999
-
-        self.set_temp_start_secondtone(t_wait_stop + 2*t_wait_step - t_wait_start + 2*t_pi)
-        self.set_temp_length_secondtone(t_pi)
-        self.set_temp_start_firsttone(self.get_temp_start_secondtone() + self.get_temp_length_secondtone() + t_wait_start )
-        self.set_temp_length_firsttone(t_meas)
-        self.set_marker1_start(self.get_temp_start_firsttone()-delta_m1_start)
-        # self.set_marker1_width(self.get_temp_length_firsttone())
-
-        nb_samples1 =  round((self.get_temp_start_firsttone() \
-                + np.max(self.get_temp_length_firsttone() + self.get_marker1_width()) ) *\
-                self._arbitrary_waveform_generator.get_clock_freq()*1e6/16., 0)*16
-        time1 = np.arange(nb_samples1)/self._arbitrary_waveform_generator.get_clock_freq()*1e-6
-
-        for ch in CHANNEL:
-            self._awg_waves['relaxation']['binary'][ch] = []
-            self._awg_waves['relaxation']['cosine'][ch] = []
-            self._awg_waves['relaxation']['marker_trigger'][ch] = []
-
-        self._seq_list1 = []
-        self._seq_list2 = []
-        N = len(np.arange(t_wait_start, t_wait_stop, t_wait_step))
-
-        p1 = [self.get_temp_start_firsttone(), self.get_temp_length_firsttone(),
-                amplitude_tone1, self.get_down_converted_frequency()*1e9]
-        wave_ro_cos = self.cos(p1, time1)
-
-        wave_pulse_read_out  = self.volt2bit_2(wave_ro_cos)
-        wave_pulse_read_out = self._arbitrary_waveform_generator.add_markers_mask(\
-                    self._awg_routing['board_marker'],
-                    np.int(self.get_marker1_start()*self._arbitrary_waveform_generator.get_clock_freq()*1e6),
-                    np.int(self.get_marker1_width()*self._arbitrary_waveform_generator.get_clock_freq()*1e6),
-                    wave_pulse_read_out)
-        self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
+        # Segments already holding the same waveform are reused
+        seg_read_out = self._arbitrary_waveform_generator.upload_waveform(wave_pulse_read_out,
             self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() + 1)
 
-        wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time1)
-
-        for i in np.arange(N):
-            p2=[self.get_temp_start_secondtone(), self.get_temp_length_secondtone(),
-                amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9]
-
-            nb_samples2 =  round(1.5*(self.get_temp_start_secondtone() \
-                    + self.get_temp_length_secondtone()  ) *\
-                    self._arbitrary_waveform_generator.get_clock_freq()*1e6/16., 0)*16
-            time2 = np.arange(nb_samples2)/self._arbitrary_waveform_generator.get_clock_freq()*1e-6
-            self.set_temp_start_secondtone(self.get_temp_start_secondtone() - t_wait_step)
-
-
-            qb_ex_cos = self.cos(p2, time1) #change 20170505
-            qubit_excitation = self.volt2bit_2(qb_ex_cos)
-            self._arbitrary_waveform_generator.send_waveform(qubit_excitation,
-                self._awg_routing['secondtone_channel'],  self.get_number_segments_memorized() + i + 2)
+        # All the excitations are computed at once
+        starts  = self.get_temp_start_secondtone() - Tr_step*np.arange(N)
+        lengths = self.get_temp_length_secondtone() + Tr_step*np.arange(N)
+        if nsigma > 0:
+            # Gaussian
+            p2=[starts, lengths, amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9, nsigma]
+            qb_ex_cos = self.pulses_batch('cosGaussian', p2, time1) #change 20180820
+        else:
+            p2=[starts, lengths, amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9]
+            qb_ex_cos = self.pulses_batch('cos', p2, time1) #change 20170505
+        qubit_excitation = self.volt2bit_batch(qb_ex_cos, time1)
 
-            self._awg_waves['relaxation']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
-            self._awg_waves['relaxation']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-            self._awg_waves['relaxation']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-            self._awg_waves['relaxation']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-            self._awg_waves['relaxation']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
+        if N > 0:
+            self.set_temp_start_secondtone(starts[-1])
+            self.set_temp_length_secondtone(lengths[-1])
 
-            self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
-            self._seq_list2.append([1, self.get_number_segments_memorized() + i + 2, 0])
+        for i in np.arange(N):
+            seg_excitation = self._arbitrary_waveform_generator.upload_waveform(qubit_excitation[i],
+                self._awg_routing['secondtone_channel'],  self.get_number_segments_memorized() + i + 2)
 
-        self._seq_list1 = np.array(self._seq_list1)
-        self._seq_list2 = np.array(self._seq_list2)
+            self._awg_waves['rabi']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
+            self._awg_waves['rabi']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation[i])
+            self._seq_list2.append(seg_excitation)
 
-        self.set_awg_segmentation({'relaxation': self.get_number_segments_memorized() + 1+1 + np.arange(N)} )
+        self._seq_list1 = sequence_table(np.repeat(seg_read_out, N))
+        self._seq_list2 = sequence_table(self._seq_list2)
+        self.set_awg_segmentation({'rabi': np.unique(np.append(seg_read_out, self._seq_list2['segment']))} )
+        # self.set_awg_segmentation({'rabi2': self.get_number_segments_memorized() + 1 + np.arange(N)} )
 
         self._awg_dict_output[self._awg_routing['firsttone_channel']]('OFF')
         self._awg_dict_output[self._awg_routing['secondtone_channel']]('OFF')
 
-        self._arbitrary_waveform_generator.set_ref_source('EXT')
-        self._arbitrary_waveform_generator.set_ref_freq(10)
-        self._arbitrary_waveform_generator.set_clock_freq(1e3)
 
         self._arbitrary_waveform_generator.set_channels_synchronised('ON')
 
 
         self._arbitrary_waveform_generator.channel_select(self._awg_routing['firsttone_channel'])
-        self._arbitrary_waveform_generator.send_seq(self._seq_list1, self._sequence_dict['relaxation1'])
+        self._arbitrary_waveform_generator.send_seq(self._seq_list1, self._sequence_dict['rabi1'])
         self._arbitrary_waveform_generator.channel_select(self._awg_routing['secondtone_channel'])
-        self._arbitrary_waveform_generator.send_seq(self._seq_list2, self._sequence_dict['relaxation2'])
-        self._arbitrary_waveform_generator.sequence_select(self._sequence_dict['relaxation2'])
+        self._arbitrary_waveform_generator.send_seq(self._seq_list2, self._sequence_dict['rabi2'])
+        self._arbitrary_waveform_generator.sequence_select(self._sequence_dict['rabi2'])
 
         self._arbitrary_waveform_generator.set_trigger_source('EVEN')
 
@@ -3137,6 +3250,76 @@ class virtual_pulsing_instrument(Instrument):
         self._arbitrary_waveform_generator.set_m1_marker_high_1_2(1.)
         self._arbitrary_waveform_generator.set_m1_marker_status_1_2('ON')
 
+        #!V
+
+    def write_Relaxation_pulsessequence(self, t_pi, t_wait_stop, t_wait_step, t_wait_start,t_meas=2e-6, delta_m1_start=0, delete=False):
+        '''
+        Putting in the awg memory the Relaxation pulses sequence and preparing the others instruments.
+        Inputs:
+            t_pi [s]:
+            t_wait_stop [s]:
+            t_wait_step [s]:
+            t_wait_start [s]:
+        '''
+        self._arbitrary_waveform_generator.set_m1_marker_status_1_2('OFF')
+        self._arbitrary_waveform_generator.set_m2_marker_status_1_2('OFF')
+
+        if delete == 'all':
+            # Emptying the awg memory
+            self._arbitrary_waveform_generator.delete_segments()
+            self._arbitrary_waveform_generator.reset()
+            self._arbitrary_waveform_generator.clear_err()
+            self._arbitrary_waveform_generator.set_trace_mode('SING')
+            self._arbitrary_waveform_generator.delete_segments()
+            self.clear_awg_segmentation()
+            self._arbitrary_waveform_generator.set_clock_freq(1e3)
+            # self._arbitrary_waveform_generator.set_clock_source('EXT')
+        elif delete == 'segments':
+            n_seg = self.get_awg_segmentation()['relaxation1']
+            print n_seg, type(n_seg)
+            self._arbitrary_waveform_generator.delete_segment_i(n_seg)
+            n_seg = self.get_awg_segmentation()['relaxation2']
+            print n_seg, type(n_seg)
+            self._arbitrary_waveform_generator.delete_segment_i(n_seg)
+
+        amplitude_tone1 = 0.9999
+        amplitude_tone2 = 0.9999
+
+        self.set_temp_start_secondtone(t_wait_stop + 2*t_wait_step - t_wait_start + 2*t_pi)
+        self.set_temp_length_secondtone(t_pi)
+        self.set_temp_start_firsttone(self.get_temp_start_secondtone() + self.get_temp_length_secondtone() + t_wait_start )
+        self.set_temp_length_firsttone(t_meas)
+        self.set_marker1_start(self.get_temp_start_firsttone()-delta_m1_start)
+        # self.set_marker1_width(self.get_temp_length_firsttone())
+
+        self._arbitrary_waveform_generator.set_ref_source('EXT')
+        self._arbitrary_waveform_generator.set_ref_freq(10)
+        self._arbitrary_waveform_generator.set_clock_freq(1e3)
+
+        N = len(np.arange(t_wait_start, t_wait_stop, t_wait_step))
+
+        # The readout and its marker are the same at each step, they end up in
+        # a single segment
+        sequence = pulse_sequence.PulseSequence('relaxation',
+                length=self.get_temp_start_firsttone() + self.get_temp_length_firsttone()\
+                       + self.get_marker1_width())
+        read_out = pulse_sequence.Pulse('firsttone', self.get_temp_start_firsttone(),
+                self.get_temp_length_firsttone(), amplitude_tone1,
+                self.get_down_converted_frequency()*1e9)
+        marker = pulse_sequence.Marker('firsttone', self._awg_routing['board_marker'],
+                self.get_marker1_start(), self.get_marker1_width())
+
+        IF_tone2 = self._SSB_tone2.get_IF_frequency()*1e9
+        for i in np.arange(N):
+            excitation = pulse_sequence.Pulse('secondtone',
+                    self.get_temp_start_secondtone() - i*t_wait_step,
+                    self.get_temp_length_secondtone(), amplitude_tone2, IF_tone2)
+            sequence.add_step(pulses=[read_out, excitation], markers=[marker])
+
+        self.set_temp_start_secondtone(self.get_temp_start_secondtone() - N*t_wait_step)
+
+        self.load_sequence(sequence)
+
     def write_Relaxation_pulsessequence2(self, t_pi, t_wait_vec, t_meas=2e-6,
                             delete=False, delta_m1_start=0, before=0, t_rise=None, nsigma=0):
         '''
@@ -3155,7 +3338,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -3193,8 +3376,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['relaxation']['binary'][ch] = []
-            self._awg_waves['relaxation']['cosine'][ch] = []
-            self._awg_waves['relaxation']['marker_trigger'][ch] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -3222,8 +3403,6 @@ class virtual_pulsing_instrument(Instrument):
         self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
             self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() + 1)
 
-        wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time1)
-
         if before>0:
             print 'here'
             for i in np.arange(N+before):
@@ -3269,9 +3448,6 @@ class virtual_pulsing_instrument(Instrument):
 
                 self._awg_waves['relaxation']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
                 self._awg_waves['relaxation']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-                self._awg_waves['relaxation']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-                self._awg_waves['relaxation']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-                self._awg_waves['relaxation']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
 
                 self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
                 self._seq_list2.append([1, self.get_number_segments_memorized() + i + 2, 0])
@@ -3305,9 +3481,6 @@ class virtual_pulsing_instrument(Instrument):
 
                 self._awg_waves['relaxation']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
                 self._awg_waves['relaxation']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-                self._awg_waves['relaxation']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-                self._awg_waves['relaxation']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-                self._awg_waves['relaxation']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
 
                 self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
                 self._seq_list2.append([1, self.get_number_segments_memorized() + i + 2, 0])
@@ -3368,7 +3541,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -3407,8 +3580,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['relaxation']['binary'][ch] = []
-            self._awg_waves['relaxation']['cosine'][ch] = []
-            self._awg_waves['relaxation']['marker_trigger'][ch] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -3453,17 +3624,12 @@ class virtual_pulsing_instrument(Instrument):
                 self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
                     self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized()+2*i + 1)
 
-                wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time1)
-
 
                 self._arbitrary_waveform_generator.send_waveform(qubit_excitation,
                     self._awg_routing['secondtone_channel'],  self.get_number_segments_memorized() + 2*i + 2)
 
                 self._awg_waves['relaxation']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
                 self._awg_waves['relaxation']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-                self._awg_waves['relaxation']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-                self._awg_waves['relaxation']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-                self._awg_waves['relaxation']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
 
                 self._seq_list1.append([1, self.get_number_segments_memorized() + 2*i + 1, 0])
                 self._seq_list2.append([1, self.get_number_segments_memorized() + 2*i + 2, 0])
@@ -3485,9 +3651,6 @@ class virtual_pulsing_instrument(Instrument):
 
                 self._awg_waves['relaxation']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
                 self._awg_waves['relaxation']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-                self._awg_waves['relaxation']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-                self._awg_waves['relaxation']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-                self._awg_waves['relaxation']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
 
                 self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
                 self._seq_list2.append([1, self.get_number_segments_memorized() + i + 2, 0])
@@ -3538,45 +3701,60 @@ class virtual_pulsing_instrument(Instrument):
             cwf2 [GHz]: continuous wave frequency of the second tone
             average (int): number of total averaging
         '''
-        self._microwave_generator1.set_gui_update('OFF')
-        self._microwave_generator2.set_gui_update('OFF')
-
-        self._microwave_generator1.set_freqsweep('off')
-        self.set_src1_cw_frequency(cwf1)
-        self._microwave_generator2.set_freqsweep('off')
-        self.set_src2_cw_frequency(cwf2)
+        dispatcher = ConfigurationDispatcher(self.get_concurrent_prep())
+        mw1 = self._microwave_generator1
+        mw2 = self._microwave_generator2
+        awg = self._arbitrary_waveform_generator
 
-        self._microwave_generator2.set_power(self._SSB_tone2.get_LO_power())
-        self._board.set_averaging(average)
-        self._board.set_nb_sequence(nb_sequences)
+        dispatcher.add('mw1', mw1.set_gui_update, 'OFF')
+        dispatcher.add('mw2', mw2.set_gui_update, 'OFF')
 
-        self._arbitrary_waveform_generator.channel_select(self._awg_routing['firsttone_channel'])
-        self._arbitrary_waveform_generator.sequence_select(self._sequence_dict['ramsey1'])
-        self._arbitrary_waveform_generator.channel_select(self._awg_routing['secondtone_channel'])
-        self._arbitrary_waveform_generator.sequence_select(self._sequence_dict['ramsey2'])
+        dispatcher.add('mw1', mw1.set_freqsweep, 'off')
+        dispatcher.add('mw1', self.set_src1_cw_frequency, cwf1)
+        dispatcher.add('mw2', mw2.set_freqsweep, 'off')
+        dispatcher.add('mw2', self.set_src2_cw_frequency, cwf2)
 
-        self._awg_dict_output[self._awg_routing['firsttone_channel']]('ON')
-        self._awg_dict_output[self._awg_routing['secondtone_channel']]('ON')
-        self._arbitrary_waveform_generator.set_m1_marker_status_1_2('ON')
-        self._arbitrary_waveform_generator.set_trigger_source('EVEN')
+        dispatcher.add('mw2', lambda: mw2.set_power(self._SSB_tone2.get_LO_power()))
+        dispatcher.add('board', self._board.set_averaging, average)
+        dispatcher.add('board', self._board.set_nb_sequence, nb_sequences)
 
         self.set_power_first_tone(power_tone1)
         amplitude1 = 10**((power_tone1)/10.)
         self.set_power_second_tone(power_tone2)
         amplitude2 = 10**((power_tone2)/10.)
-        #noprint 180928 !V
-        #print amplitude1, amplitude2
-        self._awg_dict_amplitude[self._awg_routing['firsttone_channel']](2*amplitude1)
-        self._awg_dict_amplitude[self._awg_routing['secondtone_channel']](2*amplitude2)
+
+        # The channel selections have to be done one after the other
+        def prep_awg():
+            awg.channel_select(self._awg_routing['firsttone_channel'])
+            awg.sequence_select(self._sequence_dict['ramsey1'])
+            awg.channel_select(self._awg_routing['secondtone_channel'])
+            awg.sequence_select(self._sequence_dict['ramsey2'])
+
+            self._awg_dict_output[self._awg_routing['firsttone_channel']]('ON')
+            self._awg_dict_output[self._awg_routing['secondtone_channel']]('ON')
+            awg.set_m1_marker_status_1_2('ON')
+            awg.set_trigger_source('EVEN')
+
+            self._awg_dict_amplitude[self._awg_routing['firsttone_channel']](2*amplitude1)
+            self._awg_dict_amplitude[self._awg_routing['secondtone_channel']](2*amplitude2)
+
+        awg_ready = dispatcher.add('awg', prep_awg)
 
         self._board_flag = 1
-        if self._acquisition:
-            processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
-                          self.get_down_converted_frequency()*1e9)
-        else:
-            processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
-                          self.get_down_converted_frequency()*1e9, t_ro=self.get_temp_length_firsttone())
-        self._board.measurement_initialization(processor=processus)
+
+        # Setting the measurement process once the awg is ready
+        def prep_board():
+            if self._acquisition:
+                processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
+                              self.get_down_converted_frequency()*1e9)
+            else:
+                processus = dt.RealImagPerSequence(self._board.get_acquisition_time()*1e-9, self._board.get_samplerate()*1e6,
+                              self.get_down_converted_frequency()*1e9, t_ro=self.get_temp_length_firsttone())
+            self._board.measurement_initialization(processor=processus)
+
+        dispatcher.add('board', prep_board, after=[awg_ready])
+
+        self._prep_timing = dispatcher.run()
 
     def write_Ramsey_pulsessequence(self, t_pi_o2, t_wait_stop, t_wait_step, t_wait_start,
                 t_meas=2e-6, t_wait=0, delta_m1_start=0., delete=False, t_rise=None, nsigma = 0):
@@ -3599,7 +3777,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -3643,8 +3821,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['ramsey']['binary'][ch] = []
-            self._awg_waves['ramsey']['cosine'][ch] = []
-            self._awg_waves['ramsey']['marker_trigger'][ch] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -3669,45 +3845,44 @@ class virtual_pulsing_instrument(Instrument):
                     np.int(self.get_marker1_start()*self._arbitrary_waveform_generator.get_clock_freq()*1e6),
                     np.int(self.get_marker1_width()*self._arbitrary_waveform_generator.get_clock_freq()*1e6),
                     wave_pulse_read_out)
-        self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
+        # Segments already holding the same waveform are reused
+        seg_read_out = self._arbitrary_waveform_generator.upload_waveform(wave_pulse_read_out,
             self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() + 1)
 
-        wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time)
-
-        for i in np.arange(N):
-            self.set_temp_start_secondtone(self.get_temp_start_secondtone() - t_wait_step)
-
-            if nsigma > 0:
-                pex1=[self.get_temp_start_secondtone(), self.get_temp_length_secondtone(),
-                    amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9, nsigma]
-                pex2=[self.get_temp_start_firsttone()- t_wait - t_pi_o2 , self.get_temp_length_secondtone(),
+        # All the excitations are computed at once, the second pi/2 pulse is
+        # the same for all of them
+        starts = self.get_temp_start_secondtone() - t_wait_step*(1. + np.arange(N))
+        if nsigma > 0:
+            shape = 'cosGaussian' #change 20180828
+            pex1=[starts, self.get_temp_length_secondtone(),
                 amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9, nsigma]
-                #qb_ex_cos = self.cos(pex1, time) + self.cos(pex2, time) #!V
-                qb_ex_cos = self.cosGaussian(pex1, time) + self.cosGaussian(pex2, time) #change 20180828
-            else:
-                pex1=[self.get_temp_start_secondtone(), self.get_temp_length_secondtone(),
-                    amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9]
-                pex2=[self.get_temp_start_firsttone()- t_wait - t_pi_o2 , self.get_temp_length_secondtone(),
+            pex2=[self.get_temp_start_firsttone()- t_wait - t_pi_o2 , self.get_temp_length_secondtone(),
+            amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9, nsigma]
+        else:
+            shape = 'cos'
+            pex1=[starts, self.get_temp_length_secondtone(),
                 amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9]
-                qb_ex_cos = self.cos(pex1, time) + self.cos(pex2, time) #!V
+            pex2=[self.get_temp_start_firsttone()- t_wait - t_pi_o2 , self.get_temp_length_secondtone(),
+            amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9]
+        qb_ex_cos = self.pulses_batch(shape, pex2, time, out=self.pulses_batch(shape, pex1, time))
+        qubit_excitation = self.volt2bit_batch(qb_ex_cos, time)
 
-            qubit_excitation = self.volt2bit_2(qb_ex_cos)
-            self._arbitrary_waveform_generator.send_waveform(qubit_excitation,
+        if N > 0:
+            self.set_temp_start_secondtone(starts[-1])
+
+        for i in np.arange(N):
+            seg_excitation = self._arbitrary_waveform_generator.upload_waveform(qubit_excitation[i],
                 self._awg_routing['secondtone_channel'],  self.get_number_segments_memorized() + i + 2)
 
             self._awg_waves['ramsey']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
-            self._awg_waves['ramsey']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-            self._awg_waves['ramsey']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-            self._awg_waves['ramsey']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-            self._awg_waves['ramsey']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
+            self._awg_waves['ramsey']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation[i])
 
-            self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
-            self._seq_list2.append([1, self.get_number_segments_memorized() + i + 2, 0])
+            self._seq_list2.append(seg_excitation)
 
-        self._seq_list2 = np.array(self._seq_list2)
-        self._seq_list1 = np.array(self._seq_list1)
+        self._seq_list2 = sequence_table(self._seq_list2)
+        self._seq_list1 = sequence_table(np.repeat(seg_read_out, N))
 
-        self.set_awg_segmentation({'ramsey': self.get_number_segments_memorized() + 1+1 + np.arange(N)} )
+        self.set_awg_segmentation({'ramsey': np.unique(np.append(seg_read_out, self._seq_list2['segment']))} )
 
         self._awg_dict_output[self._awg_routing['firsttone_channel']]('OFF')
         self._awg_dict_output[self._awg_routing['secondtone_channel']]('OFF')
@@ -3765,7 +3940,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -3809,8 +3984,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['ramsey']['binary'][ch] = []
-            self._awg_waves['ramsey']['cosine'][ch] = []
-            self._awg_waves['ramsey']['marker_trigger'][ch] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -3838,8 +4011,6 @@ class virtual_pulsing_instrument(Instrument):
         self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
             self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() + 1)
 
-        wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time)
-
         for i in np.arange(N):
             self.set_temp_start_secondtone(self.get_temp_start_secondtone() - t_wait_step)
             pex1=[self.get_temp_start_secondtone(), self.get_temp_length_secondtone(),
@@ -3858,9 +4029,6 @@ class virtual_pulsing_instrument(Instrument):
 
             self._awg_waves['ramsey']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
             self._awg_waves['ramsey']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-            self._awg_waves['ramsey']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-            self._awg_waves['ramsey']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-            self._awg_waves['ramsey']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
 
             self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
             self._seq_list2.append([1, self.get_number_segments_memorized() + i + 2, 0])
@@ -3924,7 +4092,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -3968,8 +4136,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['echo']['binary'][ch] = []
-            self._awg_waves['echo']['cosine'][ch] = []
-            self._awg_waves['echo']['marker_trigger'][ch] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -3989,8 +4155,6 @@ class virtual_pulsing_instrument(Instrument):
         self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
             self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() + 1)
 
-        wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time)
-
         for i in np.arange(N):
             # self.set_temp_start_secondtone(self.get_temp_start_secondtone() - t_wait_step)
             pex1=[self.get_temp_start_firsttone()-t_pi_o2, self.get_temp_length_secondtone(),
@@ -4011,9 +4175,6 @@ class virtual_pulsing_instrument(Instrument):
 
             self._awg_waves['echo']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
             self._awg_waves['echo']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-            self._awg_waves['echo']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-            self._awg_waves['echo']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-            self._awg_waves['echo']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
 
             self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
             self._seq_list2.append([1, self.get_number_segments_memorized() + i + 2, 0])
@@ -4178,7 +4339,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             # self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
 
@@ -4207,8 +4368,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['IQ']['binary'][ch] = []
-            self._awg_waves['IQ']['cosine'][ch] = []
-            self._awg_waves['IQ']['marker_trigger'][ch] = []
 
         self._seq_list = []
 
@@ -4250,8 +4409,6 @@ class virtual_pulsing_instrument(Instrument):
         self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
             self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() + 1)
 
-        wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time1)
-
         if type == 'twotone':
             pex1=[self.get_temp_start_secondtone(), self.get_temp_length_secondtone(),
                 amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9]
@@ -4262,11 +4419,8 @@ class virtual_pulsing_instrument(Instrument):
                 self._awg_routing['secondtone_channel'],  self.get_number_segments_memorized() + 1)
 
             self._awg_waves['IQ']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-            self._awg_waves['IQ']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
 
         self._awg_waves['IQ']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
-        self._awg_waves['IQ']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-        self._awg_waves['IQ']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
 
         for i in np.arange(4):
             self._seq_list.append([1, self.get_number_segments_memorized() + 1, 0])
@@ -4327,7 +4481,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
 
@@ -4354,8 +4508,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['IQ']['binary'][ch] = []
-            self._awg_waves['IQ']['cosine'][ch] = []
-            self._awg_waves['IQ']['marker_trigger'][ch] = []
 
         self._seq_list = []
 
@@ -4397,8 +4549,6 @@ class virtual_pulsing_instrument(Instrument):
         self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
             self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() + 1)
 
-        wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time1)
-
         if type == 'twotone':
             pex1=[self.get_temp_start_secondtone(), self.get_temp_length_secondtone(),
                 amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9]
@@ -4409,11 +4559,8 @@ class virtual_pulsing_instrument(Instrument):
                 self._awg_routing['secondtone_channel'],  self.get_number_segments_memorized() + 1)
 
             self._awg_waves['IQ']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-            self._awg_waves['IQ']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
 
         self._awg_waves['IQ']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
-        self._awg_waves['IQ']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-        self._awg_waves['IQ']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
 
         for i in np.arange(4):
             self._seq_list.append([1, self.get_number_segments_memorized() + 1, 0])
@@ -4474,7 +4621,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
 
@@ -4494,8 +4641,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['IQ']['binary'][ch] = []
-            self._awg_waves['IQ']['cosine'][ch] = []
-            self._awg_waves['IQ']['marker_trigger'][ch] = []
 
         self._seq_list = []
 
@@ -4550,14 +4695,10 @@ class virtual_pulsing_instrument(Instrument):
                     self._awg_routing['secondtone_channel'],  self.get_number_segments_memorized() +i + 1)
 
                 self._awg_waves['IQ']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-                self._awg_waves['IQ']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
 
-            wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time1)
             self._seq_list.append([1, self.get_number_segments_memorized() +i + 1, 0])
 
             self._awg_waves['IQ']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
-            self._awg_waves['IQ']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-            self._awg_waves['IQ']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
 
         self._seq_list= np.array(self._seq_list)
 
@@ -4615,7 +4756,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
 
@@ -4647,8 +4788,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['IQ']['binary'][ch] = []
-            self._awg_waves['IQ']['cosine'][ch] = []
-            self._awg_waves['IQ']['marker_trigger'][ch] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -4693,8 +4832,6 @@ class virtual_pulsing_instrument(Instrument):
         self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
             self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() + 1)
 
-        wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time1)
-
 
         pex1=[self.get_temp_start_secondtone(), self.get_temp_length_secondtone(),
             amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9]
@@ -4713,27 +4850,13 @@ class virtual_pulsing_instrument(Instrument):
             self._awg_routing['secondtone_channel'],  self.get_number_segments_memorized() + 3)
 
         self._awg_waves['IQ']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-        self._awg_waves['IQ']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
 
         self._awg_waves['IQ']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
-        self._awg_waves['IQ']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-        self._awg_waves['IQ']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
-
-        for i in np.arange(1): # without pi
-            self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
-            self._seq_list2.append([1, self.get_number_segments_memorized() + 3, 0])
-        for i in np.arange(1): # with pi
-            self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
-            self._seq_list2.append([1, self.get_number_segments_memorized() + 2, 0])
-        for i in np.arange(1): # without pi
-            self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
-            self._seq_list2.append([1, self.get_number_segments_memorized() + 3, 0])
-        for i in np.arange(1): # with pi
-            self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
-            self._seq_list2.append([1, self.get_number_segments_memorized() + 2, 0])
 
-        self._seq_list1 = np.array(self._seq_list1)
-        self._seq_list2 = np.array(self._seq_list2)
+        # Twice without pi then with pi
+        first_segment = self.get_number_segments_memorized() + 1
+        self._seq_list1 = sequence_table(np.repeat(first_segment, 4))
+        self._seq_list2 = tile_sequence(sequence_table([first_segment + 2, first_segment + 1]), 2)
 
         self.set_awg_segmentation({'IQ': self.get_number_segments_memorized() + 1 + np.arange(3)} )
 
@@ -4784,7 +4907,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
 
@@ -4816,8 +4939,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['IQ']['binary'][ch] = []
-            self._awg_waves['IQ']['cosine'][ch] = []
-            self._awg_waves['IQ']['marker_trigger'][ch] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -4855,8 +4976,6 @@ class virtual_pulsing_instrument(Instrument):
         self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
             self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() + 1)
 
-        wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time1)
-
 
         pex1=[self.get_temp_start_secondtone(), self.get_temp_length_secondtone(),
             amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9]
@@ -4875,27 +4994,13 @@ class virtual_pulsing_instrument(Instrument):
             self._awg_routing['secondtone_channel'],  self.get_number_segments_memorized() + 3)
 
         self._awg_waves['IQ']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-        self._awg_waves['IQ']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
 
         self._awg_waves['IQ']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
-        self._awg_waves['IQ']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-        self._awg_waves['IQ']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
-
-        for i in np.arange(1): # without pi
-            self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
-            self._seq_list2.append([1, self.get_number_segments_memorized() + 3, 0])
-        for i in np.arange(1): # with pi
-            self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
-            self._seq_list2.append([1, self.get_number_segments_memorized() + 2, 0])
-        for i in np.arange(1): # without pi
-            self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
-            self._seq_list2.append([1, self.get_number_segments_memorized() + 3, 0])
-        for i in np.arange(1): # with pi
-            self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
-            self._seq_list2.append([1, self.get_number_segments_memorized() + 2, 0])
 
-        self._seq_list1 = np.array(self._seq_list1)
-        self._seq_list2 = np.array(self._seq_list2)
+        # Twice without pi then with pi
+        first_segment = self.get_number_segments_memorized() + 1
+        self._seq_list1 = sequence_table(np.repeat(first_segment, 4))
+        self._seq_list2 = tile_sequence(sequence_table([first_segment + 2, first_segment + 1]), 2)
 
         self.set_awg_segmentation({'IQ': self.get_number_segments_memorized() + 1 + np.arange(3)} )
 
@@ -5137,7 +5242,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -5181,8 +5286,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['ramsey']['binary'][ch] = []
-            self._awg_waves['ramsey']['cosine'][ch] = []
-            self._awg_waves['ramsey']['marker_trigger'][ch] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -5216,8 +5319,6 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
                 self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() + i + 1)
 
-            wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time)
-
 
             pex1=[self.get_temp_start_secondtone(), self.get_temp_length_secondtone(),
                 amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9]
@@ -5233,9 +5334,6 @@ class virtual_pulsing_instrument(Instrument):
 
             self._awg_waves['ramsey']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
             self._awg_waves['ramsey']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-            self._awg_waves['ramsey']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-            self._awg_waves['ramsey']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-            self._awg_waves['ramsey']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
 
             self._seq_list1.append([1, self.get_number_segments_memorized() + i + 1, 0])
             self._seq_list2.append([1, self.get_number_segments_memorized() + N + i + 1, 0])
@@ -5296,7 +5394,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -5330,8 +5428,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['n_photon']['binary'][ch] = []
-            self._awg_waves['n_photon']['cosine'][ch] = []
-            self._awg_waves['n_photon']['marker_trigger'][ch] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -5365,15 +5461,10 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
                 self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() +2*i+ 1)
 
-            wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time1)
-
 
 
             self._awg_waves['n_photon']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
             self._awg_waves['n_photon']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-            self._awg_waves['n_photon']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-            self._awg_waves['n_photon']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-            self._awg_waves['n_photon']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
 
             self._seq_list1.append([1, self.get_number_segments_memorized() +2*i+ 1, 0])
             self._seq_list2.append([1, self.get_number_segments_memorized() + 2*i + 2, 0])
@@ -5493,7 +5584,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
         elif delete == 'segments':
             n_seg = self.get_awg_segmentation()['ramsey1']
             print n_seg, type(n_seg)
@@ -5528,8 +5619,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['ramsey']['binary'][ch] = []
-            self._awg_waves['ramsey']['cosine'][ch] = []
-            self._awg_waves['ramsey']['marker_trigger'][ch] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -5557,8 +5646,6 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
                 self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() + i + 1)
 
-            wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time)
-
 
             pex1=[self.get_temp_start_secondtone(), self.get_temp_length_secondtone(),
                 amplitude_tone2, self._SSB_tone2.get_IF_frequency()*1e9, 0.]
@@ -5573,9 +5660,6 @@ class virtual_pulsing_instrument(Instrument):
 
             self._awg_waves['ramsey']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
             self._awg_waves['ramsey']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-            self._awg_waves['ramsey']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-            self._awg_waves['ramsey']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-            self._awg_waves['ramsey']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
 
             self._seq_list1.append([1, self.get_number_segments_memorized() + i + 1, 0])
             self._seq_list2.append([1, self.get_number_segments_memorized() + N + i + 1, 0])
@@ -5636,7 +5720,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
 
         self._arbitrary_waveform_generator.init_channel(self._awg_routing['secondtone_channel'])
         self._awg_dict_coupling[self._awg_routing['secondtone_channel']]('DC')
@@ -5654,8 +5738,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['IQ']['binary'][ch] = []
-            self._awg_waves['IQ']['cosine'][ch] = []
-            self._awg_waves['IQ']['marker_trigger'][ch] = []
 
         self._seq_list = []
 
@@ -5689,8 +5771,6 @@ class virtual_pulsing_instrument(Instrument):
 
 
         self._awg_waves['IQ']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
-        self._awg_waves['IQ']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-        self._awg_waves['IQ']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
 
         for i in np.arange(4):
             self._seq_list.append([1, self.get_number_segments_memorized() + 1, 0])
@@ -5748,7 +5828,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
 
@@ -5875,7 +5955,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
 
@@ -5994,7 +6074,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
 
@@ -6119,7 +6199,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
 
@@ -6237,7 +6317,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
 
@@ -6373,7 +6453,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
 
@@ -6479,7 +6559,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -6528,8 +6608,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['rabi']['binary'][ch] = []
-            self._awg_waves['rabi']['cosine'][ch] = []
-            self._awg_waves['rabi']['marker_trigger'][ch] = []
 
         self._seq_list = []
 
@@ -6579,8 +6657,6 @@ class virtual_pulsing_instrument(Instrument):
                         wave_pulse_read_out)
 
 
-            wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time1)
-
             qb_ex_cos = self.cos(p2, time1) #change 20170505
             qubit_excitation = self.volt2bit_2(qb_ex_cos)
             self._arbitrary_waveform_generator.send_waveform(qubit_excitation,
@@ -6594,9 +6670,6 @@ class virtual_pulsing_instrument(Instrument):
 
             self._awg_waves['rabi']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
             self._awg_waves['rabi']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-            self._awg_waves['rabi']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-            self._awg_waves['rabi']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-            self._awg_waves['rabi']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
             self._seq_list.append([1, self.get_number_segments_memorized() + i + 1, 0])
 
 
@@ -6716,7 +6789,7 @@ class virtual_pulsing_instrument(Instrument):
             self._arbitrary_waveform_generator.clear_err()
             self._arbitrary_waveform_generator.set_trace_mode('SING')
             self._arbitrary_waveform_generator.delete_segments()
-            self._segmentation = {}
+            self.clear_awg_segmentation()
             self._arbitrary_waveform_generator.set_clock_freq(1e3)
             # self._arbitrary_waveform_generator.set_clock_source('EXT')
         elif delete == 'segments':
@@ -6754,8 +6827,6 @@ class virtual_pulsing_instrument(Instrument):
 
         for ch in CHANNEL:
             self._awg_waves['rabi']['binary'][ch] = []
-            self._awg_waves['rabi']['cosine'][ch] = []
-            self._awg_waves['rabi']['marker_trigger'][ch] = []
 
         self._seq_list1 = []
         self._seq_list2 = []
@@ -6782,8 +6853,6 @@ class virtual_pulsing_instrument(Instrument):
         self._arbitrary_waveform_generator.send_waveform(wave_pulse_read_out,
             self._awg_routing['firsttone_channel'],  self.get_number_segments_memorized() + 1)
 
-        wave_ro_marker = self.pulse([self.get_marker1_start(), self.get_marker1_width(), 1], time1)
-
         for i in np.arange(N):
             nb_samples2 =  round(1.1*( self.get_temp_start_secondtone() + self.get_temp_length_secondtone()  ) *\
                     self._arbitrary_waveform_generator.get_clock_freq()*1e6/16., 0)*16
@@ -6803,9 +6872,6 @@ class virtual_pulsing_instrument(Instrument):
 
             self._awg_waves['rabi']['binary'][self._awg_routing['firsttone_channel']].append(wave_pulse_read_out)
             self._awg_waves['rabi']['binary'][self._awg_routing['secondtone_channel']].append(qubit_excitation)
-            self._awg_waves['rabi']['cosine'][self._awg_routing['firsttone_channel']].append(wave_ro_cos)
-            self._awg_waves['rabi']['cosine'][self._awg_routing['secondtone_channel']].append(qb_ex_cos)
-            self._awg_waves['rabi']['marker_trigger'][self._awg_routing['firsttone_channel']].append(wave_ro_marker)
             self._seq_list1.append([1, self.get_number_segments_memorized() + 1, 0])
             self._seq_list2.append([1, self.get_number_segments_memorized() + i + 2, 0])
 
@@ -6849,25 +6915,253 @@ class virtual_pulsing_instrument(Instrument):
 
 
     ############################################################################
-    def display_pulses_sequence(self, sequence = 'onetone', display_type='binary'):
+    def load_sequence(self, sequence, block=32, prefetch=4, play=True):
+        '''
+        Compile a pulse sequence and put it in the awg memory, then prepare the
+        awg to play it step by step at each trigger.
+        Only the unique segments of each channel are uploaded, segments already
+        in the awg memory are reused.
+        The steps are rendered by blocks in a worker thread while the segments
+        already rendered are uploaded.
+        The sequence is added to the bank of programs under its name, see
+        select_program.
+        Inputs:
+            sequence (PulseSequence): see the module pulse_sequence, its
+                channels are routed with routing_awg.
+            block (int): number of steps rendered at once.
+            prefetch (int): number of rendered segments waiting for their
+                upload.
+            play (bool): if False, the sequence is only put in the awg memory,
+                to be played later by select_program.
+        Output:
+            compiled (CompiledSequence)
+        '''
+        awg = self._arbitrary_waveform_generator
+        channels = dict((channel, self._awg_routing[channel+'_channel'])
+                        for channel in sequence.channels())
+
+        awg.set_m1_marker_status_1_2('OFF')
+        awg.set_m2_marker_status_1_2('OFF')
+
+        for ch in channels.values():
+            awg.init_channel(ch)
+            self._awg_dict_coupling[ch]('DC')
+            self._awg_dict_amplitude[ch](2)
+        awg.set_marker_source('USER')
+
+        # The segments of a previous version of the sequence are freed, those
+        # holding the same waveforms are kept, the others reused.
+        allocator = self._segment_allocator
+        allocator.free(sequence.name)
+        self._segmentation.pop(sequence.name, None)
+
+        segment_ids = dict((channel, []) for channel in channels)
+
+        def upload(item):
+            channel, index, segment = item
+            ch = channels[channel]
+            try:
+                seg_id = awg.cached_segment(segment, ch)
+                if seg_id is None:
+                    seg_id = allocator.allocate(sequence.name, ch, len(segment))
+                    awg.upload_waveform(segment, ch, seg_id)
+                else:
+                    allocator.reserve(sequence.name, seg_id, ch, len(segment))
+            except ValueError as error:
+                raise ValueError('Segment {} of {} of the sequence {}: {}'.format(
+                                 index, channel, sequence.name, error))
+            segment_ids[channel].append(seg_id)
+
+        # Only the main thread talks to the awg
+        samplerate = awg.get_clock_freq()*1e6
+
+        def render(put):
+            return pulse_sequence.compile_sequence(sequence, self, samplerate,
+                        block=block, on_segment=lambda *item: put(item))
+
+        compiled = pulse_sequence.pipeline(render, upload, prefetch)
+
+        waves = self._awg_waves.setdefault(sequence.name,
+                    pulse_sequence.SequenceWaves(self._waveform_pool))
+        for ch in CHANNEL:
+            waves['binary'][ch] = []
+
+        used_segments = []
+        tables = {}
+        for channel in compiled.channels:
+            ch = channels[channel]
+            used_segments += segment_ids[channel]
+
+            table = compiled.tables[channel]
+            tables[channel] = sequence_table(np.array(segment_ids[channel])[table[:, 1]],
+                                             table[:, 0], table[:, 2])
+
+            waves['binary'][ch].extend(compiled.segments[channel][i]
+                                       for i in compiled.tables[channel][:, 1])
+
+        self._segmentation[sequence.name] = np.unique(used_segments)
+
+        for ch in channels.values():
+            self._awg_dict_output[ch]('OFF')
+
+        awg.set_channels_synchronised('ON')
+
+        # One awg sequence per channel, named as sequence.name + 1, 2 or 3
+        program = {}
+        for channel in compiled.channels:
+            name = sequence.name + {'firsttone':'1', 'secondtone':'2', 'thirdtone':'3'}[channel]
+            if name not in self._sequence_dict:
+                self._sequence_dict[name] = max(self._sequence_dict.values()) + 1
+
+            awg.channel_select(channels[channel])
+            awg.send_seq(tables[channel], self._sequence_dict[name])
+            program[channels[channel]] = self._sequence_dict[name]
+
+        self._program_bank[sequence.name] = program
+
+        # The channels have been put in user mode
+        self._bank_ready = False
+        if play:
+            self.select_program(sequence.name)
+
+        return compiled
+
+    def register_program(self, name, sequences):
         '''
-        Display the last pulses sequence written.
+        Add to the bank of programs sequences already in the awg memory, for
+        instance the ones of the write_* methods:
+            register_program('rabi', {'firsttone':'rabi1', 'secondtone':'rabi2'})
+        Inputs:
+            name (str): name of the program.
+            sequences (dict): {channel: sequence name} with channel a
+                logical channel ('firsttone', 'secondtone' or 'thirdtone') or
+                an awg channel, and the sequence name a key of the sequence
+                dictionary.
+        '''
+        program = {}
+        for channel, sequence in sequences.items():
+            if channel in ('firsttone', 'secondtone', 'thirdtone'):
+                channel = self._awg_routing[channel+'_channel']
+            if channel not in CHANNEL:
+                raise ValueError('channel should be in (firsttone, secondtone, thirdtone)+'+str(CHANNEL))
+            if sequence not in self._sequence_dict:
+                raise ValueError('sequence should be in '+str(self._sequence_dict.keys()))
+            program[channel] = self._sequence_dict[sequence]
+
+        self._program_bank[name] = program
+
+    def remove_program(self, name, free=False):
+        '''
+        Remove a program from the bank.
+        Inputs:
+            name (str): name of the program.
+            free (bool): if True, the segments of the sequence name are also
+                freed, see free_sequence.
+        '''
+        self._program_bank.pop(name, None)
+        if free:
+            self.free_sequence(name)
+
+    def programs(self):
+        '''
+        Return the names of the programs of the bank.
+        '''
+        return sorted(self._program_bank.keys())
+
+    def select_program(self, name, configure=None):
+        '''
+        Play a program of the bank. Only the sequence of each channel and the
+        outputs are reprogrammed, the waveforms stay in the awg memory, so
+        that switching between programs does no waveform transfer.
+        Inputs:
+            name (str): name of the program, see load_sequence and
+                register_program.
+            configure (bool): if True the trigger and run modes of the awg
+                are set again. By default they are set only after
+                load_sequence, or when the awg has been used without the bank.
+        '''
+        if name not in self._program_bank:
+            raise ValueError('program should be in '+str(self.programs()))
+
+        awg = self._arbitrary_waveform_generator
+        program = self._program_bank[name]
+        if configure is None:
+            configure = not self._bank_ready
+
+        for ch in CHANNEL:
+            if ch not in program:
+                self._awg_dict_output[ch]('OFF')
+
+        for ch, seq_id in sorted(program.items()):
+            awg.channel_select(ch)
+            awg.sequence_select(seq_id)
+
+        if configure:
+            awg.set_channels_synchronised('ON')
+            awg.set_trigger_source('EVEN')
+
+            awg.seq_jump_source('BUS')
+            awg.seq_mode('STEP')
+            awg.set_trigger_mode('NORM')
+            awg.set_trigger_timer_mode('TIME')
+            awg.set_run_mode('TRIG')
+            awg.set_func_mode('SEQ')
+            awg.set_trigger_timer_time(self._trigger_time)
+
+        for ch in program:
+            self._awg_dict_output[ch]('ON')
+
+        if configure:
+            awg.set_m1_marker_high_1_2(1.)
+            awg.set_m1_marker_status_1_2('ON')
+
+        self._bank_ready = True
+
+    def display_pulses_sequence(self, sequence = 'onetone', display_type='binary',
+                                width=2000):
         '''
+        Display the last pulses sequence written.
+        Inputs:
+            sequence (str or CompiledSequence): name of the sequence, or the
+                sequence returned by load_sequence.
+            display_type (str): 'binary' for the codes sent to the awg, or
+                'cosine' for the waveforms in volt and the markers.
+            width (int): the waveforms are shown as their min/max envelope
+                over width points, so that long sequences are displayed
+                quickly. None to plot every sample.
+        '''
+        if isinstance(sequence, pulse_sequence.CompiledSequence):
+            waves = {'binary':{}, 'cosine':{}, 'marker_trigger':{}}
+            for channel in sequence.channels:
+                ch = self._awg_routing[channel+'_channel']
+                rows = sequence.tables[channel][:, 1]
+                waves['binary'][ch] = [sequence.segments[channel][i] for i in rows]
+                waves['cosine'][ch] = list(sequence.volts[channel])
+                waves['marker_trigger'][ch] = list(sequence.markers[channel])
+        elif sequence in self._awg_waves:
+            waves = self._awg_waves[sequence]
+        else:
+            print 'sequence should be in '+str(self._awg_waves.keys())
+            return
+
         fig, ax = plt.subplots(1,1)
         if display_type == 'binary':
-            if sequence in ('onetone', 'twotone', 'rabi', 'relaxation', 'ramsey', 'IQ'):
-                for i in CHANNEL:
-                    ax.plot( [item for sublist in self._awg_waves[sequence]['binary'][i] for item in sublist], label='ch_'+str(i))
-            else:
-                print 'sequence should be in (onetone, twotone, rabi)'
+            views = ('binary',)
         else:
             ax.set_ylim(-2.1, 2.1)
-            if sequence in ('onetone', 'twotone', 'rabi', 'relaxation', 'ramsey', 'IQ'):
-                for i in CHANNEL:
-                    ax.plot( [item for sublist in self._awg_waves[sequence]['cosine'][i] for item in sublist], label='ch_'+str(i))
-                    ax.plot( [item for sublist in self._awg_waves[sequence]['marker_trigger'][i] for item in sublist], label='ch_'+str(i))
-            else:
-                print 'sequence should be in (onetone, twotone, rabi)'
+            views = ('cosine', 'marker_trigger')
+
+        for i in CHANNEL:
+            for view in views:
+                if not waves[view].get(i):
+                    continue
+
+                if width is None:
+                    ax.plot(np.concatenate(waves[view][i]), label='ch_'+str(i))
+                else:
+                    index, lower, upper = pulse_sequence.envelope(waves[view][i], width)
+                    ax.fill_between(index, lower, upper, step='post',
+                                    label='ch_'+str(i))
         ax.grid()
 
         ax.legend(loc='best')
@@ -7152,6 +7446,126 @@ class virtual_pulsing_instrument(Instrument):
 
         return pulse
 
+    def pulses_batch(self, shape, p, x, out=None):
+        '''
+        Return an array (N, len(x)) of N pulses computed at once.
+        The parameters p are the ones of the method shape ('cos', 'cos_phi',
+        'cosGaussian', 'cos_rise' or 'cos_plateau'), in the same order, each of
+        them being either a number or an array of the N values.
+        If out is given, the pulses are added to it, otherwise a new buffer is
+        allocated. Only the samples covered by the pulses are computed.
+        '''
+        if shape not in ('cos', 'cos_phi', 'cosGaussian', 'cos_rise', 'cos_plateau'):
+            raise ValueError('shape should be in (cos, cos_phi, cosGaussian, cos_rise, cos_plateau)')
+
+        # One row per pulse
+        p = [column[:, None] for column in
+             np.broadcast_arrays(*[np.atleast_1d(np.asarray(item, dtype=float)) for item in p])]
+
+        if shape == 'cos':
+            start, duration, amplitude, frequency = p
+            phi = np.zeros_like(start)
+        elif shape == 'cos_phi':
+            start, duration, amplitude, frequency, phi = p
+        elif shape == 'cosGaussian':
+            start, duration, amplitude, frequency, nsigma = p
+            phi = np.zeros_like(start)
+        elif shape == 'cos_rise':
+            start, t_rise, duration, amplitude, frequency = p
+            phi = np.zeros_like(start)
+        else:
+            start, t_rise, duration, amplitude, frequency, dutycycle, diff_PdB = p
+            phi = np.zeros_like(start)
+
+        # from second to sample, rounded as the round of python
+        time_step = x[1] - x[0]
+        start_s = np.floor(start/time_step + 0.5)
+        width   = np.floor(duration/time_step + 0.5)
+
+        if out is None:
+            out = np.zeros((len(start), len(x)))
+
+        # Only the samples where at least one pulse is non zero are computed
+        lo = int(np.clip(np.min(start_s), 0, len(x))) if len(start) else 0
+        hi = int(np.clip(np.max(start_s + width), lo, len(x))) if len(start) else 0
+        x_band = x[lo:hi]
+
+        # position of each sample in its pulse
+        k = np.arange(lo, hi)[None, :] - start_s
+        envelope = amplitude*((k >= 0) & (k < width))
+
+        if shape == 'cosGaussian':
+            center = np.minimum(start_s + np.floor(width/2.), len(x) - 1).astype(int)
+            sigma = np.where(width != 0, duration/2./nsigma, 1.)
+            envelope = envelope*np.exp(-(x_band[None, :] - x[center])**2/2./sigma**2)
+        elif shape in ('cos_rise', 'cos_plateau'):
+            rise = np.floor(t_rise/time_step + 0.5)
+            step = np.maximum(rise, 1.)
+            if shape == 'cos_rise':
+                ramp = np.select([k < rise, k >= width - rise],
+                                 [(1. + k)/step, (width - 1. - k)/step], 1.)
+            else:
+                ratio = 10**(diff_PdB/10.)
+                width_plateau = np.floor(dutycycle*(duration - 2*t_rise)/time_step + 0.5)
+                width_2 = width - 3*rise - width_plateau
+                ramp = np.select([k < rise,
+                                  k < rise + width_plateau,
+                                  k < 2*rise + width_plateau,
+                                  k < 2*rise + width_plateau + width_2],
+                                 [(1. + k)/step,
+                                  1.,
+                                  ratio + (1. - ratio)*(2*rise + width_plateau - 1. - k)/step,
+                                  ratio*np.ones_like(k)],
+                                 ratio*(width - 1. - k)/step)
+            # as in cos_rise and cos_plateau, the envelope is also multiplied
+            # by the amplitude
+            envelope = envelope*amplitude*ramp
+
+        # The carrier is computed once when it is the same for all the pulses
+        if len(frequency) > 0 and np.all(frequency == frequency[0]) and np.all(phi == phi[0]):
+            carrier = np.cos(2.*np.pi*frequency[0]*x_band + phi[0])[None, :]
+        else:
+            carrier = np.cos(2.*np.pi*frequency*x_band[None, :] + phi)
+
+        out[:, lo:hi] += envelope*carrier
+
+        return out
+
+    def volt2bit_batch(self, volt, x, markers=()):
+        '''
+        Return the uint16 codes of the AWG of an array (N, len(x)) of pulses,
+        as volt2bit_2, with the marker bits added in the same pass.
+        markers is a list of (marker_idx, start, width), start and width in
+        second being a number or an array of N values, rounded to the nearest
+        sample.
+        '''
+        full = 2. # in volt
+        resolution = 2**14. - 1.
+
+        volt = np.atleast_2d(volt)
+        codes = np.empty(volt.shape, dtype='uint16')
+
+        # Most of the samples are usually at 0 V, only the columns between the
+        # first and the last non zero ones are converted
+        columns = np.flatnonzero(volt.any(axis=0))
+        lo, hi = (columns[0], columns[-1] + 1) if len(columns) else (0, 0)
+
+        codes[...] = np.round(resolution/2., 0)
+        buff = volt[:, lo:hi] + full/2.
+        buff *= resolution
+        buff /= full
+        np.round(buff, 0, out=buff)
+        codes[:, lo:hi] = buff
+
+        samplerate = round(1./(x[1] - x[0]))
+        for marker_idx, start, width in markers:
+            start, width = np.broadcast_arrays(np.atleast_1d(start), np.atleast_1d(width))
+            self._arbitrary_waveform_generator.add_markers(marker_idx,
+                    np.round(start*samplerate), np.round(width*samplerate), codes,
+                    rows=None if len(start) == 1 else np.arange(len(start)))
+
+        return codes
+
     def Gaussian_cos_phi(self, p, x):
         '''
         Return an array of a cosine pulse
@@ -7186,34 +7600,36 @@ class virtual_pulsing_instrument(Instrument):
         '''
         This method is used to set the usual settings of the AWG
         '''
-        self._arbitrary_waveform_generator.set_trigger_source('EVEN')
-        self.status_AWG('OFF', nb_channel)
-        if nb_channel == 1:
-            self._arbitrary_waveform_generator.init_channel(self._awg_routing['firsttone_channel'])
-            self._awg_dict_coupling[self._awg_routing['firsttone_channel']]('DC')
-            self._awg_dict_amplitude[self._awg_routing['firsttone_channel']](2)
-        elif nb_channel == 2:
-            self._arbitrary_waveform_generator.init_channel(self._awg_routing['firsttone_channel'])
-            self._awg_dict_coupling[self._awg_routing['firsttone_channel']]('DC')
-            self._awg_dict_amplitude[self._awg_routing['firsttone_channel']](2)
-            self._arbitrary_waveform_generator.init_channel(self._awg_routing['secondtone_channel'])
-            self._awg_dict_coupling[self._awg_routing['secondtone_channel']]('DC')
-            self._awg_dict_amplitude[self._awg_routing['secondtone_channel']](2)
-
-        self.clock_AWG()
-        self._arbitrary_waveform_generator.set_channels_synchronised('ON')
-        self._arbitrary_waveform_generator.set_marker_source('USER')
-        self._arbitrary_waveform_generator.set_m2_marker_high_1_2(1.)
-        self._arbitrary_waveform_generator.set_m1_marker_high_1_2(1.)
-
-        self._arbitrary_waveform_generator.set_trigger_source('EVEN')
-        self._arbitrary_waveform_generator.seq_mode('STEP')
-        self._arbitrary_waveform_generator.seq_jump_source('BUS')
-        self._arbitrary_waveform_generator.set_trigger_mode('NORM')
-        self._arbitrary_waveform_generator.set_trigger_timer_mode('TIME')
-        self._arbitrary_waveform_generator.set_run_mode('TRIG')
-        self._arbitrary_waveform_generator.set_func_mode('SEQ')
-        self._arbitrary_waveform_generator.set_trigger_timer_time(self._trigger_time)
+        # Only the settings which changed are written, in a few command strings
+        with self._arbitrary_waveform_generator.coalesce():
+            self._arbitrary_waveform_generator.set_trigger_source('EVEN')
+            self.status_AWG('OFF', nb_channel)
+            if nb_channel == 1:
+                self._arbitrary_waveform_generator.init_channel(self._awg_routing['firsttone_channel'])
+                self._awg_dict_coupling[self._awg_routing['firsttone_channel']]('DC')
+                self._awg_dict_amplitude[self._awg_routing['firsttone_channel']](2)
+            elif nb_channel == 2:
+                self._arbitrary_waveform_generator.init_channel(self._awg_routing['firsttone_channel'])
+                self._awg_dict_coupling[self._awg_routing['firsttone_channel']]('DC')
+                self._awg_dict_amplitude[self._awg_routing['firsttone_channel']](2)
+                self._arbitrary_waveform_generator.init_channel(self._awg_routing['secondtone_channel'])
+                self._awg_dict_coupling[self._awg_routing['secondtone_channel']]('DC')
+                self._awg_dict_amplitude[self._awg_routing['secondtone_channel']](2)
+
+            self.clock_AWG()
+            self._arbitrary_waveform_generator.set_channels_synchronised('ON')
+            self._arbitrary_waveform_generator.set_marker_source('USER')
+            self._arbitrary_waveform_generator.set_m2_marker_high_1_2(1.)
+            self._arbitrary_waveform_generator.set_m1_marker_high_1_2(1.)
+
+            self._arbitrary_waveform_generator.set_trigger_source('EVEN')
+            self._arbitrary_waveform_generator.seq_mode('STEP')
+            self._arbitrary_waveform_generator.seq_jump_source('BUS')
+            self._arbitrary_waveform_generator.set_trigger_mode('NORM')
+            self._arbitrary_waveform_generator.set_trigger_timer_mode('TIME')
+            self._arbitrary_waveform_generator.set_run_mode('TRIG')
+            self._arbitrary_waveform_generator.set_func_mode('SEQ')
+            self._arbitrary_waveform_generator.set_trigger_timer_time(self._trigger_time)
 #################################################################################
 
     def status_AWG(self, status, nb_channel=1):
@@ -7225,6 +7641,9 @@ class virtual_pulsing_instrument(Instrument):
 
     def AWG_select_sequence(self, sequence='onetone', nb_channel=1 ):
 
+        # The awg is then used without the bank of programs
+        self._bank_ready = False
+
         if nb_channel == 1:
             self._arbitrary_waveform_generator.channel_select(self._awg_routing['firsttone_channel'])
             self._arbitrary_waveform_generator.sequence_select(self._sequence_dict[sequence])